@@ -17,7 +17,13 @@ from .models import HookHandlerRequest, TypeConfigurationModel
 LOG = logging.getLogger(__name__)
 TYPE_NAME = "{{ type_name }}"
 
-hook = Hook(TYPE_NAME, TypeConfigurationModel)
+# Target models generated under target_models/ are imported lazily, and only for
+# the target type being evaluated
+hook = Hook(
+    TYPE_NAME,
+    TypeConfigurationModel,
+    target_models_package=f"{__package__}.target_models",
+)
 test_entrypoint = hook.test_entrypoint
 
 
@@ -38,6 +44,9 @@ def pre_create_handler(
     try:
         # Reading the Resource Hook's target properties
         resource_properties = target_model.get("resourceProperties")
+        # or, as the generated target model for the target type (None if no
+        # target model was generated for it)
+        typed_resource_properties = request.hookContext.resourceProperties
 
         if isinstance(session, SessionProxy):
             client = session.client("s3")
@@ -1,27 +1,298 @@
 # boto3 doesn't have stub files
 from boto3.session import Session  # type: ignore
 
-from typing import Optional
+import threading
+from botocore.config import Config  # type: ignore
+from botocore.credentials import (  # type: ignore
+    CredentialProvider,
+    CredentialResolver,
+    Credentials as BotocoreCredentials,
+)
+from botocore.session import get_session  # type: ignore
+from botocore.session import Session as BotocoreSession  # type: ignore
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Mapping, MutableMapping, Optional, Tuple
 
+from .read_cache import ReadCache, cache_reads
+from .tracing import instrument_client
 from .utils import Credentials
 
+# components that only depend on the data files bundled with botocore, so they
+# can safely be shared by sessions with different credentials
+SHARED_COMPONENTS = ("data_loader",)
+SHARED_INTERNAL_COMPONENTS = ("endpoint_resolver", "exceptions_factory")
 
+# clients kept by a session with swappable credentials. they are keyed by the
+# arguments of the call, so a handler creating a new config for every call
+# would otherwise add a client, with its connection pool, per invocation
+MAX_CACHED_CLIENTS = 32
+
+
+class _SharedBotocoreComponents:
+    """Shares one botocore loader, endpoint resolver and exceptions factory
+    across every session created in the process, so service models and
+    endpoint data are read and parsed from disk once instead of per session."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._components: Optional[MutableMapping[str, Any]] = None
+        self._internal_components: Optional[MutableMapping[str, Any]] = None
+
+    def install(self, session: BotocoreSession) -> None:
+        # pylint: disable=protected-access
+        with self._lock:
+            if self._components is None or self._internal_components is None:
+                self._components = {
+                    name: session.get_component(name) for name in SHARED_COMPONENTS
+                }
+                self._internal_components = {
+                    name: session._get_internal_component(name)
+                    for name in SHARED_INTERNAL_COMPONENTS
+                }
+                return
+        for name, component in self._components.items():
+            session.register_component(name, component)
+        for name, component in self._internal_components.items():
+            session._register_internal_component(name, component)
+
+    def dedupe_search_paths(self) -> None:
+        # boto3 appends its own data path to the loader for every new session
+        if self._components:
+            search_paths = self._components["data_loader"].search_paths
+            search_paths[:] = list(dict.fromkeys(search_paths))
+
+
+_SHARED_COMPONENTS = _SharedBotocoreComponents()
+
+
+class _SwappableCredentials(BotocoreCredentials):  # type: ignore
+    """Credentials that can be replaced in place. Requests are signed with
+    ``get_frozen_credentials``, so clients created from a session holding these
+    credentials sign every request after a swap with the new identity."""
+
+    METHOD = "cloudformation-swappable"
+
+    def __init__(self, credentials: Credentials) -> None:
+        self._lock = threading.Lock()
+        super().__init__(
+            credentials.accessKeyId,
+            credentials.secretAccessKey,
+            credentials.sessionToken,
+            method=self.METHOD,
+        )
+        self._frozen = super().get_frozen_credentials()
+
+    def swap(self, credentials: Credentials) -> None:
+        with self._lock:
+            self.access_key = credentials.accessKeyId
+            self.secret_key = credentials.secretAccessKey
+            self.token = credentials.sessionToken
+            self._normalize()
+            self._frozen = super().get_frozen_credentials()
+
+    def get_frozen_credentials(self) -> Any:
+        return self._frozen
+
+
+class _SwappableCredentialProvider(CredentialProvider):  # type: ignore
+    METHOD = _SwappableCredentials.METHOD
+    CANONICAL_NAME = "custom-cloudformation-swappable"
+
+    def __init__(self, credentials: _SwappableCredentials) -> None:
+        super().__init__()
+        self._credentials = credentials
+
+    def load(self) -> _SwappableCredentials:
+        return self._credentials
+
+
+# pylint: disable=too-many-instance-attributes
 class SessionProxy:
-    def __init__(self, session: Session):
-        self.client = session.client
+    def __init__(
+        self,
+        session: Session,
+        credentials: Optional[_SwappableCredentials] = None,
+        client_config: Optional[Config] = None,
+        service_client_configs: Optional[Mapping[str, Config]] = None,
+    ):
         self.resource = session.resource
         self.session = session
+        self._credentials = credentials
+        self._clients: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._clients_lock = threading.Lock()
+        self.client_config = client_config
+        self.service_client_configs = service_client_configs or {}
+        self.traces_api_calls = False
+        self.read_cache: Optional[ReadCache] = None
+
+    def enable_api_call_tracing(self) -> None:
+        """Records the calls of every client this session creates in the API
+        call trace of the invocation that makes them."""
+        if self.traces_api_calls:
+            return
+        with self._clients_lock:
+            self.traces_api_calls = True
+            # cached clients were created without the trace hooks
+            self._clients.clear()
+
+    def enable_read_cache(self, cache: ReadCache) -> None:
+        """Sends the calls of every client this session creates through
+        ``cache``."""
+        if self.read_cache is cache:
+            return
+        with self._clients_lock:
+            self.read_cache = cache
+            # cached clients were created without the cache
+            self._clients.clear()
+
+    def configure(
+        self,
+        client_config: Optional[Config],
+        service_client_configs: Optional[Mapping[str, Config]],
+    ) -> None:
+        service_client_configs = service_client_configs or {}
+        if (
+            client_config is self.client_config
+            and service_client_configs == self.service_client_configs
+        ):
+            return
+        with self._clients_lock:
+            self.client_config = client_config
+            self.service_client_configs = service_client_configs
+            self._clients.clear()
+
+    def _get_client_config(
+        self, service_name: str, config: Optional[Config] = None
+    ) -> Optional[Config]:
+        # precedence: explicit config > service override > proxy-wide config
+        merged = self.client_config
+        for override in (self.service_client_configs.get(service_name), config):
+            if override is not None:
+                merged = override if merged is None else merged.merge(override)
+        return merged
+
+    def _create_client(
+        self, service_name: str, args: Tuple[Any, ...], kwargs: MutableMapping[str, Any]
+    ) -> Any:
+        config = self._get_client_config(service_name, kwargs.get("config"))
+        if config is not None:
+            kwargs = {**kwargs, "config": config}
+        client = self.session.client(service_name, *args, **kwargs)
+        if self.traces_api_calls:
+            instrument_client(client)
+        if self.read_cache:
+            cache_reads(client, self.read_cache)
+        return client
+
+    def client(self, service_name: str, *args: Any, **kwargs: Any) -> Any:
+        if not self._credentials or _has_explicit_credentials(kwargs):
+            return self._create_client(service_name, args, kwargs)
+        # clients of a session with swappable credentials are reused across
+        # invocations, keeping their connection pools warm
+        try:
+            key: Hashable = (service_name, args, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return self._create_client(service_name, args, kwargs)
+        with self._clients_lock:
+            try:
+                client = self._clients[key]
+            except KeyError:
+                client = self._clients[key] = self._create_client(
+                    service_name, args, kwargs
+                )
+                # the least recently used client is evicted
+                if len(self._clients) > MAX_CACHED_CLIENTS:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(key)
+            return client
+
+    def swap_credentials(self, credentials: Credentials) -> None:
+        if not self._credentials:
+            raise ValueError("Session was not created with swappable credentials")
+        self._credentials.swap(credentials)
+
+
+def _has_explicit_credentials(kwargs: MutableMapping[str, Any]) -> bool:
+    return any(
+        kwargs.get(name)
+        for name in ("aws_access_key_id", "aws_secret_access_key", "aws_session_token")
+    )
+
+
+# the signature of _get_boto_session, for replacing how handler sessions are made
+SessionFactory = Callable[..., Optional[SessionProxy]]
+
+_SESSIONS: MutableMapping[Tuple[str, Optional[str]], SessionProxy] = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _create_session(
+    credentials: Credentials,
+    region: Optional[str],
+    swappable_credentials: Optional[_SwappableCredentials] = None,
+    client_config: Optional[Config] = None,
+    service_client_configs: Optional[Mapping[str, Config]] = None,
+) -> SessionProxy:
+    botocore_session = get_session()
+    _SHARED_COMPONENTS.install(botocore_session)
+    if swappable_credentials:
+        botocore_session.register_component(
+            "credential_provider",
+            CredentialResolver([_SwappableCredentialProvider(swappable_credentials)]),
+        )
+        session = Session(region_name=region, botocore_session=botocore_session)
+    else:
+        session = Session(
+            aws_access_key_id=credentials.accessKeyId,
+            aws_secret_access_key=credentials.secretAccessKey,
+            aws_session_token=credentials.sessionToken,
+            region_name=region,
+            botocore_session=botocore_session,
+        )
+    _SHARED_COMPONENTS.dedupe_search_paths()
+    return SessionProxy(
+        session, swappable_credentials, client_config, service_client_configs
+    )
 
 
 def _get_boto_session(
-    credentials: Optional[Credentials], region: Optional[str] = None
+    credentials: Optional[Credentials],
+    region: Optional[str] = None,
+    identity: Optional[str] = None,
+    client_config: Optional[Config] = None,
+    service_client_configs: Optional[Mapping[str, Config]] = None,
 ) -> Optional[SessionProxy]:
+    """Create a session for the given credentials.
+
+    With an ``identity`` (e.g. "caller" or "provider"), the session for that
+    identity and region is kept for the lifetime of the process and only its
+    credentials are swapped on later calls, so clients and their connection
+    pools survive across invocations. Different identities never share a
+    session.
+
+    ``client_config`` is applied to every client the session creates, merged
+    with the ``service_client_configs`` entry for the client's service, if any.
+    """
     if not credentials:
         return None
-    session = Session(
-        aws_access_key_id=credentials.accessKeyId,
-        aws_secret_access_key=credentials.secretAccessKey,
-        aws_session_token=credentials.sessionToken,
-        region_name=region,
-    )
-    return SessionProxy(session)
+    if not identity:
+        return _create_session(
+            credentials, region, None, client_config, service_client_configs
+        )
+
+    with _SESSIONS_LOCK:
+        proxy = _SESSIONS.get((identity, region))
+        if proxy:
+            proxy.swap_credentials(credentials)
+            proxy.configure(client_config, service_client_configs)
+        else:
+            proxy = _SESSIONS[(identity, region)] = _create_session(
+                credentials,
+                region,
+                _SwappableCredentials(credentials),
+                client_config,
+                service_client_configs,
+            )
+    return proxy
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, TypeVar
+
+from .interface import CircuitState
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT_SECONDS = 30.0
+DEFAULT_HALF_OPEN_PROBES = 1
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# pylint: disable=too-many-instance-attributes
+class CircuitBreaker:
+    """Stops calling a failing backend, so a degraded telemetry service does
+    not slow down every invocation.
+
+    The circuit opens after ``failure_threshold`` consecutive failures, and
+    calls are rejected for ``reset_timeout`` seconds. It then lets up to
+    ``half_open_probes`` calls through at a time: the first success closes
+    it again, a failure reopens it.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = DEFAULT_RESET_TIMEOUT_SECONDS,
+        half_open_probes: int = DEFAULT_HALF_OPEN_PROBES,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.failures = 0
+        self.rejected = 0
+        self.state_changes: "Counter[CircuitState]" = Counter()
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            self._check_reset_timeout()
+            return self._state
+
+    def _check_reset_timeout(self) -> None:
+        if (
+            self._state == CircuitState.OPEN
+            and time.monotonic() - self._opened_at >= self.reset_timeout
+        ):
+            self._change_state(CircuitState.HALF_OPEN)
+
+    def _change_state(self, state: CircuitState) -> None:
+        LOG.info("Circuit breaker %s -> %s", self._state.name, state.name)
+        self._state = state
+        self.state_changes[state] += 1
+        self._probes = 0
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CircuitState.CLOSED:
+            self.failures = 0
+
+    def allow(self) -> bool:
+        """Whether a call may be made. A call that is allowed must be
+        followed by ``record_success`` or ``record_failure``."""
+        with self._lock:
+            self._check_reset_timeout()
+            if self._state == CircuitState.CLOSED:
+                return True
+            if (
+                self._state == CircuitState.HALF_OPEN
+                and self._probes < self.half_open_probes
+            ):
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._change_state(CircuitState.CLOSED)
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._state == CircuitState.HALF_OPEN or (
+                self._state == CircuitState.CLOSED
+                and self.failures >= self.failure_threshold
+            ):
+                self._change_state(CircuitState.OPEN)
+
+    def call(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit is {self._state.name}, call rejected")
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
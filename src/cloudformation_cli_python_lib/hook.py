@@ -1,24 +1,68 @@
+import importlib
 import json
 import logging
 import traceback
+from botocore.config import Config  # type: ignore
+from contextlib import nullcontext
 from datetime import datetime
+from fnmatch import fnmatchcase
 from functools import wraps
-from typing import Any, Callable, MutableMapping, Optional, Tuple, Type, Union
+from typing import (
+    Any,
+    Callable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
-from .boto3_proxy import SessionProxy, _get_boto_session
+from .boto3_proxy import SessionFactory, SessionProxy, _get_boto_session
+from .circuit_breaker import CircuitBreaker
 from .exceptions import InternalFailure, InvalidRequest, _HandlerError
 from .interface import (
     BaseHookHandlerRequest,
     HandlerErrorCode,
+    HookAnnotationSeverityLevel,
     HookInvocationPoint,
     HookProgressEvent,
     HookStatus,
+    LogDelivery,
     OperationStatus,
     ProgressEvent,
 )
-from .log_delivery import HookProviderLogHandler
-from .metrics import MetricsPublisherProxy
+from .invocation import _InvocationMixin
+from .log_delivery import (
+    HookProviderLogHandler,
+    HookStdoutLogHandler,
+    LogSampler,
+    LogShippingConfig,
+    _hook_log_fields,
+    log_context,
+)
+from .metrics import (
+    BackgroundMetricsFlusher,
+    MetricsAggregator,
+    MetricsPublisherProxy,
+    MetricsSink,
+    _check_aggregated_sink,
+    handler_metrics,
+)
+from .profiling import SamplingProfiler
+from .read_cache import ReadCache
+from .rules import (
+    DEFAULT_RULE_TIMEOUT_SECONDS,
+    HookRule,
+    RuleEngine,
+    RuleEvaluation,
+    RuleSignature,
+)
+from .tracing import api_call_trace
 from .utils import (
+    HOOK_REMOTE_PAYLOAD_MAX_SIZE_BYTES,
     BaseModel,
     Credentials,
     HookInvocationRequest,
@@ -30,6 +74,8 @@ from .utils import (
 
 LOG = logging.getLogger(__name__)
 
+UNSUPPORTED_TARGET_MESSAGE = "Target is not supported by this hook, skipping"
+
 HandlerSignature = Callable[
     [Optional[SessionProxy], Any, MutableMapping[str, Any], Any], ProgressEvent
 ]
@@ -56,19 +102,68 @@ def _ensure_serialize(
     return wrapper
 
 
-class Hook:
-    def __init__(
+# pylint: disable=too-many-instance-attributes
+class Hook(_InvocationMixin):
+    _stdout_log_handler_cls = HookStdoutLogHandler
+    _provider_log_handler_cls = HookProviderLogHandler
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
         self,
         type_name: str,
         type_configuration_model_cls: Type[BaseModel],
         log_format: Optional[logging.Formatter] = None,
+        *,
+        remote_payload_max_size: int = HOOK_REMOTE_PAYLOAD_MAX_SIZE_BYTES,
+        target_models_package: Optional[str] = None,
+        target_types: Optional[Sequence[str]] = None,
+        client_config: Optional[Config] = None,
+        service_client_configs: Optional[Mapping[str, Config]] = None,
+        session_factory: Optional[SessionFactory] = None,
+        metrics_sink: Optional[MetricsSink] = None,
+        metrics_flusher: Optional[BackgroundMetricsFlusher] = None,
+        metrics_aggregator: Optional[MetricsAggregator] = None,
+        log_shipping: Optional[LogShippingConfig] = None,
+        log_delivery: LogDelivery = LogDelivery.CLOUDWATCH_LOGS,
+        log_sampler: Optional[LogSampler] = None,
+        trace_api_calls: bool = False,
+        metrics_breaker: Optional[CircuitBreaker] = None,
+        logs_breaker: Optional[CircuitBreaker] = None,
+        read_cache: Optional[ReadCache] = None,
+        profiler: Optional[SamplingProfiler] = None,
     ) -> None:
         self.type_name = type_name
         self._type_configuration_model_cls: Type[
             BaseModel
         ] = type_configuration_model_cls
         self._handlers: MutableMapping[HookInvocationPoint, HandlerSignature] = {}
+        self._rules: List[HookRule] = []
         self.log_format = log_format
+        self.remote_payload_max_size = remote_payload_max_size
+        self.client_config = client_config
+        self.service_client_configs = service_client_configs
+        self.session_factory = session_factory
+        self.metrics_sink = metrics_sink
+        self.metrics_flusher = metrics_flusher
+        _check_aggregated_sink(metrics_sink, metrics_aggregator)
+        self.metrics_aggregator = metrics_aggregator
+        self.log_shipping = log_shipping
+        self.log_delivery = log_delivery
+        self.log_sampler = log_sampler
+        self.trace_api_calls = trace_api_calls
+        self.metrics_breaker = metrics_breaker
+        self.logs_breaker = logs_breaker
+        self.read_cache = read_cache
+        self.profiler = profiler
+        self._target_models_package = target_models_package
+        self._target_model_types: MutableMapping[str, Optional[Type[BaseModel]]] = {}
+        self._target_types = tuple(target_types) if target_types else ()
+        self._supported_targets: MutableMapping[Tuple[Any, Any], bool] = {}
+        self._unsupported_target_response = self._create_progress_response(
+            ProgressEvent(
+                status=OperationStatus.SUCCESS, message=UNSUPPORTED_TARGET_MESSAGE
+            ),
+            None,
+        )._serialize()
 
     def handler(
         self, invocation_point: HookInvocationPoint
@@ -79,6 +174,89 @@ class Hook:
 
         return _add_handler
 
+    def rule(  # pylint: disable=too-many-arguments
+        self,
+        name: str,
+        *,
+        target_types: Sequence[str] = ("*",),
+        paths: Sequence[str] = (),
+        timeout: float = DEFAULT_RULE_TIMEOUT_SECONDS,
+        severity: Optional[HookAnnotationSeverityLevel] = None,
+        remediation_message: Optional[str] = None,
+        remediation_link: Optional[str] = None,
+    ) -> Callable[[RuleSignature], RuleSignature]:
+        def _add_rule(f: RuleSignature) -> RuleSignature:
+            self._rules.append(
+                HookRule(
+                    name=name,
+                    check=f,
+                    target_types=tuple(target_types),
+                    paths=tuple(paths),
+                    timeout=timeout,
+                    severity=severity,
+                    remediation_message=remediation_message,
+                    remediation_link=remediation_link,
+                )
+            )
+            return f
+
+        return _add_rule
+
+    def evaluate_rules(
+        self,
+        request: BaseHookHandlerRequest,
+        type_configuration: Optional[BaseModel],
+    ) -> RuleEvaluation:
+        return RuleEngine(self._rules).evaluate(request, type_configuration)
+
+    def _get_target_model_type(
+        self, target_name: Optional[str]
+    ) -> Optional[Type[BaseModel]]:
+        if not self._target_models_package or not target_name:
+            return None
+        try:
+            return self._target_model_types[target_name]
+        except KeyError:
+            pass
+
+        # mirrors the codegen naming: AWS::SQS::Queue -> aws_sqs_queue.AwsSqsQueue
+        namespace = [s.lower() for s in target_name.split("::")]
+        module_name = f'{self._target_models_package}.{"_".join(namespace)}'
+        model_type: Optional[Type[BaseModel]]
+        try:
+            module = importlib.import_module(module_name)
+            model_type = getattr(module, "".join(s.capitalize() for s in namespace))
+        except (ImportError, AttributeError):
+            LOG.debug("No target model found for %s", target_name)
+            model_type = None
+        self._target_model_types[target_name] = model_type
+        return model_type
+
+    def _is_target_supported(self, event_data: MutableMapping[str, Any]) -> bool:
+        if not self._target_types:
+            return True
+        request_data = event_data.get("requestData")
+        if not isinstance(request_data, dict):
+            # leave malformed requests to the regular validation
+            return True
+        key = (request_data.get("targetType"), request_data.get("targetName"))
+        if not all(target is None or isinstance(target, str) for target in key):
+            return True
+        try:
+            return self._supported_targets[key]
+        except KeyError:
+            pass
+        # a pattern may name the target category (RESOURCE, STACK) or the target
+        # type name (AWS::S3::*)
+        supported = not any(key) or any(
+            fnmatchcase(target, pattern)
+            for target in key
+            if target
+            for pattern in self._target_types
+        )
+        self._supported_targets[key] = supported
+        return supported
+
     def _invoke_handler(  # pylint: disable=too-many-arguments
         self,
         session: Optional[SessionProxy],
@@ -95,7 +273,19 @@ class Hook:
                 f"No handler for {invocation_point.name}",
             )
 
-        return handler(session, request, callback_context, type_configuration)
+        profile = (
+            self.profiler.profile(invocation_point.name)
+            if self.profiler
+            else nullcontext()
+        )
+        with profile:
+            return handler(session, request, callback_context, type_configuration)
+
+    def _get_session(
+        self, credentials: Optional[Credentials], **kwargs: Any
+    ) -> Optional[SessionProxy]:
+        session_factory = self.session_factory or _get_boto_session
+        return self._create_session(session_factory, credentials, **kwargs)
 
     def _parse_test_request(
         self, event_data: MutableMapping[str, Any]
@@ -109,11 +299,12 @@ class Hook:
         try:
             event = HookTestEvent(**event_data)
             creds = Credentials(**event.credentials)
-            request: BaseHookHandlerRequest = UnmodelledHookRequest(
-                **event.request
-            ).to_modelled()
+            unmodelled_request = UnmodelledHookRequest(**event.request)
+            request: BaseHookHandlerRequest = unmodelled_request.to_modelled(
+                self._get_target_model_type(unmodelled_request.targetName)
+            )
 
-            session = _get_boto_session(creds, event.region)
+            session = self._get_session(creds, region=event.region)
             invocation_point = HookInvocationPoint[event.actionInvocationPoint]
         except Exception as e:  # pylint: disable=broad-except
             LOG.exception("Invalid request")
@@ -131,6 +322,21 @@ class Hook:
             ),
         )
 
+    def _add_metrics_publisher(
+        self,
+        metrics: MetricsPublisherProxy,
+        event: HookInvocationRequest,
+        provider_sess: Optional[SessionProxy],
+    ) -> None:
+        if event.requestData.providerLogGroupName and provider_sess:
+            metrics.add_hook_metrics_publisher(
+                provider_sess, event.hookTypeName, event.awsAccountId, self.metrics_sink
+            )
+        elif self.metrics_sink:
+            metrics.add_hook_metrics_publisher(
+                None, event.hookTypeName, event.awsAccountId, self.metrics_sink
+            )
+
     @_ensure_serialize
     def test_entrypoint(
         self, event: MutableMapping[str, Any], _context: Any
@@ -156,9 +362,8 @@ class Hook:
             LOG.critical("Base exception caught (this is usually bad)", exc_info=True)
         return ProgressEvent.failed(HandlerErrorCode.InternalFailure, msg)
 
-    @staticmethod
     def _parse_request(
-        event_data: MutableMapping[str, Any]
+        self, event_data: MutableMapping[str, Any]
     ) -> Tuple[
         Tuple[Optional[SessionProxy], Optional[SessionProxy]],
         HookInvocationPoint,
@@ -166,12 +371,26 @@ class Hook:
         HookInvocationRequest,
     ]:
         try:
-            event = HookInvocationRequest.deserialize(event_data)
-            caller_sess = _get_boto_session(event.requestData.callerCredentials)
-            provider_sess = _get_boto_session(event.requestData.providerCredentials)
-            # credentials are used when rescheduling, so can't zero them out (for now)
-            invocation_point = HookInvocationPoint[event.actionInvocationPoint]
-            callback_context = event.requestContext.callbackContext or {}
+            # a remote payload is only awaited once the target model is needed
+            event = HookInvocationRequest.deserialize(
+                event_data, self.remote_payload_max_size, defer_remote_payload=True
+            )
+            try:
+                caller_sess = self._get_session(
+                    event.requestData.callerCredentials, identity="caller"
+                )
+                provider_sess = self._get_session(
+                    event.requestData.providerCredentials,
+                    identity="provider",
+                    account_id=event.awsAccountId,
+                )
+                # credentials are used when rescheduling, so can't zero them out
+                # (for now)
+                invocation_point = HookInvocationPoint[event.actionInvocationPoint]
+                callback_context = event.requestContext.callbackContext or {}
+            except Exception:
+                event.requestData.discard_remote_payload()
+                raise
         except Exception as e:
             LOG.exception("Invalid request")
             raise InvalidRequest(f"{e} ({type(e).__name__})") from e
@@ -182,6 +401,10 @@ class Hook:
         self, request: HookInvocationRequest
     ) -> Tuple[BaseHookHandlerRequest, Optional[BaseModel]]:
         try:
+            # pylint: disable=protected-access
+            type_configuration = self._type_configuration_model_cls._deserialize(
+                request.hookModel or {}
+            )
             handler_request = UnmodelledHookRequest(
                 clientRequestToken=request.clientRequestToken,
                 awsAccountId=request.awsAccountId,
@@ -193,12 +416,8 @@ class Hook:
                 targetName=request.requestData.targetName,
                 targetType=request.requestData.targetType,
                 targetLogicalId=request.requestData.targetLogicalId,
-                targetModel=request.requestData.targetModel,
-            ).to_modelled()
-            # pylint: disable=protected-access
-            type_configuration = self._type_configuration_model_cls._deserialize(
-                request.hookModel or {}
-            )
+                targetModel=request.requestData.resolve_remote_payload(),
+            ).to_modelled(self._get_target_model_type(request.requestData.targetName))
 
             return handler_request, type_configuration
 
@@ -212,6 +431,7 @@ class Hook:
         self, event_data: MutableMapping[str, Any], context: LambdaContext
     ) -> MutableMapping[str, Any]:
         logs_setup = False
+        log_handler: Optional[logging.Handler] = None
 
         def print_or_log(message: str) -> None:
             if logs_setup:
@@ -220,35 +440,51 @@ class Hook:
                 print(message)
                 traceback.print_exc()
 
+        if not self._is_target_supported(event_data):
+            return {
+                **self._unsupported_target_response,
+                "clientRequestToken": event_data.get("clientRequestToken"),
+            }
+
+        metrics = MetricsPublisherProxy(
+            self.metrics_flusher, self.metrics_aggregator, self.metrics_breaker
+        )
+        event: Optional[HookInvocationRequest] = None
         try:
             sessions, invocation_point, callback, event = self._parse_request(
                 event_data
             )
             caller_sess, provider_sess = sessions
 
-            request, type_configuration = self._cast_hook_request(event)
+            log_handler = self._setup_logging(event, provider_sess)
+            logs_setup = log_handler is not None
+            self._add_metrics_publisher(metrics, event, provider_sess)
 
-            metrics = MetricsPublisherProxy()
-            if event.requestData.providerLogGroupName and provider_sess:
-                HookProviderLogHandler.setup(event, provider_sess, self.log_format)
-                logs_setup = True
-                metrics.add_hook_metrics_publisher(
-                    provider_sess, event.hookTypeName, event.awsAccountId
-                )
+            # any remote payload download overlaps with the setup above
+            request, type_configuration = self._cast_hook_request(event)
 
             metrics.publish_invocation_metric(datetime.utcnow(), invocation_point)
             start_time = datetime.utcnow()
             error = None
 
             try:
-                progress = self._invoke_handler(
-                    caller_sess, request, invocation_point, callback, type_configuration
-                )
+                with handler_metrics(metrics, invocation_point), log_context(
+                    _hook_log_fields(event)
+                ), api_call_trace() as trace:
+                    progress = self._invoke_handler(
+                        caller_sess,
+                        request,
+                        invocation_point,
+                        callback,
+                        type_configuration,
+                    )
             except Exception as e:  # pylint: disable=broad-except
                 error = e
 
             m_secs = (datetime.utcnow() - start_time).total_seconds() * 1000.0
             metrics.publish_duration_metric(datetime.utcnow(), invocation_point, m_secs)
+            metrics.publish_api_call_metrics(datetime.utcnow(), invocation_point, trace)
+            trace.log_summary()
             if error:
                 metrics.publish_exception_metric(
                     datetime.utcnow(), invocation_point, error
@@ -263,6 +499,12 @@ class Hook:
         except BaseException as e:  # pylint: disable=broad-except # noqa: B036
             print_or_log(f"Base exception caught (this is usually bad) {e}")
             progress = ProgressEvent.failed(HandlerErrorCode.InternalFailure)
+        finally:
+            # a download the invocation never waited for must not outlive it
+            if event:
+                event.requestData.discard_remote_payload()
+
+        self._flush_invocation(metrics, log_handler, context)
 
         # use the raw event_data as a last-ditch attempt to call back if the
         # request is invalid
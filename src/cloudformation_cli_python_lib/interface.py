@@ -1,9 +1,13 @@
 # pylint: disable=invalid-name
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import logging
+from copy import deepcopy
 from enum import Enum, auto
-from typing import Any, List, Mapping, MutableMapping, Optional, Type
+from functools import cached_property
+from typing import Any, List, Mapping, MutableMapping, Optional, Type, Union
+
+from .query import PathQuery, QueryCache
 
 LOG = logging.getLogger(__name__)
 
@@ -34,6 +38,12 @@ class HookInvocationPoint(str, _AutoName):
 class StandardUnit(str, _AutoName):
     Count = auto()
     Milliseconds = auto()
+    Microseconds = auto()
+    Seconds = auto()
+    Bytes = auto()
+    Kilobytes = auto()
+    Megabytes = auto()
+    Percent = auto()
 
 
 class MetricTypes(str, _AutoName):
@@ -42,6 +52,28 @@ class MetricTypes(str, _AutoName):
     HandlerInvocationDuration = auto()
 
 
+class LocalMetricsFormat(str, _AutoName):
+    JSONL = auto()
+    PROMETHEUS = auto()
+
+
+class DropPolicy(str, _AutoName):
+    BLOCK = auto()
+    DROP_NEWEST = auto()
+    DROP_OLDEST = auto()
+
+
+class CircuitState(str, _AutoName):
+    CLOSED = auto()
+    OPEN = auto()
+    HALF_OPEN = auto()
+
+
+class LogDelivery(str, _AutoName):
+    CLOUDWATCH_LOGS = auto()
+    STDOUT = auto()
+
+
 class OperationStatus(str, _AutoName):
     PENDING = auto()
     IN_PROGRESS = auto()
@@ -270,6 +302,33 @@ class HookContext:
     targetLogicalId: Optional[str]
     targetModel: Optional[Mapping[str, Any]]
     changeSetId: Optional[str] = None
+    targetModelType: Optional[Type[BaseModel]] = field(
+        default=None, repr=False, compare=False
+    )
+
+    @cached_property
+    def resourceProperties(self) -> Optional[BaseModel]:
+        return self._deserialize_target_model("resourceProperties")
+
+    @cached_property
+    def previousResourceProperties(self) -> Optional[BaseModel]:
+        return self._deserialize_target_model("previousResourceProperties")
+
+    @cached_property
+    def _target_model_queries(self) -> QueryCache:
+        return QueryCache(self.targetModel)
+
+    def query(self, query: Union[str, PathQuery], default: Any = None) -> Any:
+        """Evaluate a path query (see ``query.PathQuery``) against the target
+        model. Results are memoized for the lifetime of the request."""
+        return self._target_model_queries.get(query, default)
+
+    def _deserialize_target_model(self, key: str) -> Optional[BaseModel]:
+        if not self.targetModelType or not self.targetModel:
+            return None
+        # recasting happens in place, keep the raw target model untouched
+        # pylint: disable=protected-access
+        return self.targetModelType._deserialize(deepcopy(self.targetModel.get(key)))
 
 
 @dataclass
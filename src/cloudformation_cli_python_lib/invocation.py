@@ -0,0 +1,138 @@
+import logging
+import traceback
+from botocore.config import Config  # type: ignore
+from typing import Any, Mapping, Optional, Type
+
+from .boto3_proxy import SessionFactory, SessionProxy
+from .circuit_breaker import CircuitBreaker
+from .interface import LogDelivery
+from .log_delivery import (
+    LogSampler,
+    LogShippingConfig,
+    ProviderLogHandler,
+    ProviderLogQueueHandler,
+    StdoutLogHandler,
+    _discard_queued_records,
+)
+from .metrics import BackgroundMetricsFlusher, MetricsAggregator, MetricsPublisherProxy
+from .read_cache import ReadCache
+from .utils import Credentials, LambdaContext
+
+LOG = logging.getLogger(__name__)
+
+
+class _InvocationMixin:
+    """The sessions, logging and metrics delivery of an invocation, shared by
+    Resource and Hook, which set the attributes below.
+
+    The metrics flusher and aggregator, the circuit breakers and the read
+    cache are meant to be shared by all invocations in a process.
+
+    The handler metrics, API call trace and log context of an invocation are
+    context variables. They are not inherited by threads the handler starts,
+    unless those run in a copy of the handler's context.
+    """
+
+    _stdout_log_handler_cls: Type[StdoutLogHandler]
+    _provider_log_handler_cls: Type[ProviderLogHandler]
+
+    log_format: Optional[logging.Formatter]
+    client_config: Optional[Config]
+    service_client_configs: Optional[Mapping[str, Config]]
+    metrics_flusher: Optional[BackgroundMetricsFlusher]
+    metrics_aggregator: Optional[MetricsAggregator]
+    log_shipping: Optional[LogShippingConfig]
+    log_delivery: LogDelivery
+    log_sampler: Optional[LogSampler]
+    trace_api_calls: bool
+    logs_breaker: Optional[CircuitBreaker]
+    read_cache: Optional[ReadCache]
+
+    def _discard_undelivered(self, account_id: Optional[str]) -> None:
+        # metrics and logs left over from the previous invocation would be sent
+        # with the provider credentials of this one once they are swapped in.
+        # aggregated metrics are sent before, unless they are for this account
+        if self.metrics_flusher:
+            self.metrics_flusher.discard(self.metrics_flusher.drain_timeout)
+        if self.metrics_aggregator:
+            aggregated = self.metrics_aggregator.switch_account(account_id)
+            for sink, namespace, metric_data in aggregated:
+                try:
+                    sink.put_metric_data(namespace, metric_data)
+                except Exception:  # pylint: disable=broad-except
+                    LOG.exception("Failed to publish metrics of another account")
+        _discard_queued_records()
+
+    def _create_session(
+        self,
+        session_factory: SessionFactory,
+        credentials: Optional[Credentials],
+        *,
+        account_id: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Optional[SessionProxy]:
+        if kwargs.get("identity") == "provider":
+            self._discard_undelivered(account_id)
+        session = session_factory(
+            credentials,
+            client_config=self.client_config,
+            service_client_configs=self.service_client_configs,
+            **kwargs,
+        )
+        # only the calls of the handler are traced or cached, not those of the
+        # library
+        if session and kwargs.get("identity") != "provider":
+            if self.trace_api_calls:
+                session.enable_api_call_tracing()
+            if self.read_cache:
+                session.enable_read_cache(self.read_cache)
+                self.read_cache.start_invocation()
+        return session
+
+    def _create_log_handler(
+        self, event: Any, provider_sess: Optional[SessionProxy]
+    ) -> Optional[logging.Handler]:
+        if self.log_delivery == LogDelivery.STDOUT:
+            return self._stdout_log_handler_cls.setup(event, self.log_format)
+        if event.requestData.providerLogGroupName and provider_sess:
+            return self._provider_log_handler_cls.setup(
+                event,
+                provider_sess,
+                self.log_format,
+                self.log_shipping,
+                self.logs_breaker,
+            )
+        return None
+
+    def _setup_logging(
+        self, event: Any, provider_sess: Optional[SessionProxy]
+    ) -> Optional[logging.Handler]:
+        log_handler = self._create_log_handler(event, provider_sess)
+        if log_handler and self.log_sampler:
+            self.log_sampler.attach(log_handler)
+        return log_handler
+
+    def _flush_invocation(
+        self,
+        metrics: MetricsPublisherProxy,
+        log_handler: Optional[logging.Handler],
+        context: LambdaContext,
+    ) -> None:
+        # metrics and logs are buffered for the invocation. the handler has
+        # already run, so failing to send them is not fatal
+        try:
+            metrics.flush(context)
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("Failed to publish metrics")
+        # logs are delivered last, to include any failure above
+        if log_handler:
+            if self.log_sampler:
+                self.log_sampler.log_summary()
+            try:
+                if isinstance(log_handler, ProviderLogQueueHandler):
+                    log_handler.drain_before_deadline(context)
+                else:
+                    log_handler.flush()
+            except Exception as e:  # pylint: disable=broad-except
+                print(f"Failed to deliver provider logs {e}")
+                traceback.print_exc()
@@ -0,0 +1,118 @@
+import json
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from .interface import LocalMetricsFormat, StandardUnit
+from .metrics import MetricsSink
+
+
+class JsonLinesMetricsSink(MetricsSink):
+    """Appends each datum to a local file as a JSON line, with its namespace,
+    so load tests and benchmarks run without CloudWatch get the same metrics.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def put_metric_data(
+        self, namespace: str, metric_data: Sequence[Mapping[str, Any]]
+    ) -> None:
+        lines = "".join(
+            json.dumps({"Namespace": namespace, **datum}, default=str) + "\n"
+            for datum in metric_data
+        )
+        with self._lock, self.path.open("a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+def _prometheus_name(name: str) -> str:
+    """``HandlerInvocationCount`` as ``handler_invocation_count``."""
+    snake_case = re.sub(r"(?<=[a-z0-9])([A-Z])", r"_\1", name)
+    return re.sub(r"[^a-zA-Z0-9_]", "_", snake_case).lower()
+
+
+def _prometheus_label_value(value: Any) -> str:
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return escaped.replace("\n", "\\n")
+
+
+def _datum_totals(datum: Mapping[str, Any]) -> Tuple[float, float]:
+    """The sum and sample count of the values in a datum."""
+    if "StatisticValues" in datum:
+        statistics = datum["StatisticValues"]
+        return statistics["Sum"], statistics["SampleCount"]
+    if "Values" in datum:
+        counts = datum.get("Counts") or [1.0] * len(datum["Values"])
+        total = sum(value * count for value, count in zip(datum["Values"], counts))
+        return total, sum(counts)
+    return datum["Value"], 1.0
+
+
+class PrometheusMetricsSink(MetricsSink):
+    """Accumulates datums as Prometheus summaries, one series per metric and
+    dimension set, labelled with the namespace and dimensions.
+
+    ``render`` returns them in the Prometheus text format. With a ``path``,
+    the file is rewritten after every put, for a textfile collector or a
+    benchmark script to read.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None) -> None:
+        self.path = Path(path) if path else None
+        self._series: Dict[str, Dict[Tuple[Tuple[str, str], ...], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def put_metric_data(
+        self, namespace: str, metric_data: Sequence[Mapping[str, Any]]
+    ) -> None:
+        with self._lock:
+            for datum in metric_data:
+                name = _prometheus_name(datum["MetricName"])
+                unit = datum.get("Unit")
+                if unit and unit not in (StandardUnit.Count, StandardUnit.Count.value):
+                    name = f"{name}_{_prometheus_name(str(unit))}"
+                labels = (("namespace", namespace),) + tuple(
+                    (_prometheus_name(d["Name"]), str(d["Value"]))
+                    for d in datum.get("Dimensions", [])
+                )
+                totals = self._series.setdefault(name, {}).setdefault(
+                    labels, [0.0, 0.0]
+                )
+                total, count = _datum_totals(datum)
+                totals[0] += total
+                totals[1] += count
+            text = self._render()
+        if self.path:
+            self.path.write_text(text, encoding="utf-8")
+
+    def _render(self) -> str:
+        lines = []
+        for name, series in sorted(self._series.items()):
+            lines.append(f"# TYPE {name} summary")
+            for labels, (total, count) in sorted(series.items()):
+                label_text = ",".join(
+                    f'{key}="{_prometheus_label_value(value)}"' for key, value in labels
+                )
+                lines.append(f"{name}_sum{{{label_text}}} {total!r}")
+                lines.append(f"{name}_count{{{label_text}}} {count!r}")
+        return "".join(line + "\n" for line in lines)
+
+    def render(self) -> str:
+        with self._lock:
+            return self._render()
+
+
+def local_metrics_sink(
+    path: Optional[Union[str, Path]],
+    metrics_format: LocalMetricsFormat = LocalMetricsFormat.JSONL,
+) -> MetricsSink:
+    """A sink that keeps metrics on the local machine, in ``metrics_format``.
+    Only the Prometheus format can be used without a ``path``."""
+    if metrics_format == LocalMetricsFormat.PROMETHEUS:
+        return PrometheusMetricsSink(path)
+    if not path:
+        raise ValueError("A path is required to write metrics as JSON lines")
+    return JsonLinesMetricsSink(path)
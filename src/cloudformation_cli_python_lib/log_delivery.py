@@ -1,10 +1,53 @@
+from dataclasses import dataclass
+
+import json
 import logging
+import queue
+import random
+import sys
+import threading
 import time
+import traceback
 import uuid
-from typing import Any, Optional
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, TextIO
 
 from .boto3_proxy import SessionProxy
-from .utils import HandlerRequest, HookInvocationRequest
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .interface import DropPolicy
+from .utils import HandlerRequest, HookInvocationRequest, LambdaContext, _drain_timeout
+
+# PutLogEvents limits
+MAX_LOG_EVENTS_PER_BATCH = 10000
+MAX_LOG_BATCH_BYTES = 1048576
+LOG_EVENT_OVERHEAD_BYTES = 26
+MAX_LOG_EVENT_BYTES = 262144
+LOG_TRUNCATED_SUFFIX = "... (truncated)"
+MAX_LOG_BATCH_SPAN_MS = 24 * 60 * 60 * 1000
+MAX_SEQUENCE_TOKEN_RETRIES = 2
+
+DEFAULT_LOG_QUEUE_SIZE = 10000
+DEFAULT_LOG_DRAIN_TIMEOUT_SECONDS = 1.0
+
+DEFAULT_LOG_RECORD_BURST = 1000
+DEFAULT_LOG_BYTE_BURST = MAX_LOG_BATCH_BYTES
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclass
+class LogShippingConfig:
+    """Ships provider logs from a background thread. Records wait on a queue
+    of at most ``max_queue_size`` records, ``drop_policy`` decides what
+    happens when it is full."""
+
+    max_queue_size: int = DEFAULT_LOG_QUEUE_SIZE
+    drop_policy: DropPolicy = DropPolicy.DROP_OLDEST
+    drain_timeout: float = DEFAULT_LOG_DRAIN_TIMEOUT_SECONDS
 
 
 class ProviderFilter(logging.Filter):
@@ -16,30 +59,279 @@ class ProviderFilter(logging.Filter):
         return not record.name.startswith(self.provider)
 
 
+def _resource_log_fields(request: HandlerRequest) -> Dict[str, Any]:
+    return {
+        "action": request.action,
+        "resourceType": request.resourceType,
+        # the resource request's client request token is sent as bearerToken
+        "clientRequestToken": request.bearerToken,
+        "stackId": request.stackId,
+        "logicalResourceId": request.requestData.logicalResourceId,
+    }
+
+
+def _hook_log_fields(request: HookInvocationRequest) -> Dict[str, Any]:
+    return {
+        "invocationPoint": request.actionInvocationPoint,
+        "hookTypeName": request.hookTypeName,
+        "clientRequestToken": request.clientRequestToken,
+        "stackId": request.stackId,
+        "targetLogicalId": request.requestData.targetLogicalId,
+    }
+
+
+def _encode_fields(fields: Mapping[str, Any]) -> str:
+    """The members of a JSON object for ``fields``, to be spliced into one."""
+    if not fields:
+        return ""
+    return "," + json.dumps(fields, default=str, separators=(",", ":"))[1:-1]
+
+
+_encode_name = lru_cache(maxsize=256)(json.dumps)
+
+
+class LogContext:
+    def __init__(self, fields: Mapping[str, Any]) -> None:
+        self.fields = dict(fields)
+        self.encoded = _encode_fields(self.fields)
+
+
+_LOG_CONTEXT: ContextVar[Optional[LogContext]] = ContextVar("log_context", default=None)
+
+
+def get_log_context() -> Mapping[str, Any]:
+    """The request fields attached to records logged by the invocation being
+    handled, empty outside of an invocation."""
+    context = _LOG_CONTEXT.get()
+    return context.fields if context else {}
+
+
+@contextmanager
+def log_context(fields: Mapping[str, Any]) -> Iterator[LogContext]:
+    context = LogContext(fields)
+    token = _LOG_CONTEXT.set(context)
+    try:
+        yield context
+    finally:
+        _LOG_CONTEXT.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single line JSON objects, with the timestamp in
+    epoch milliseconds, the level, logger name and message, along with
+    ``static_fields`` and the request fields of the invocation being handled.
+
+    Static and request fields are encoded once rather than for every record.
+    """
+
+    def __init__(self, static_fields: Optional[Mapping[str, Any]] = None) -> None:
+        super().__init__()
+        self._static = _encode_fields(static_fields or {})
+
+    def format(self, record: logging.LogRecord) -> str:
+        return self.format_with(record)
+
+    def format_with(
+        self, record: logging.LogRecord, fields: str = "", request_fields: str = ""
+    ) -> str:
+        """Formats ``record`` with the encoded ``fields`` after the static
+        ones, and ``request_fields`` when no invocation is being handled."""
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            message = f"{message}\n{record.exc_text}"
+        if record.stack_info:
+            message = f"{message}\n{self.formatStack(record.stack_info)}"
+        context = _LOG_CONTEXT.get()
+        return (
+            f'{{"timestamp":{round(record.created * 1000)}'
+            f',"level":{_encode_name(record.levelname)}'
+            f',"logger":{_encode_name(record.name)}'
+            f"{self._static}{fields}{context.encoded if context else request_fields}"
+            f',"message":{json.dumps(message)}}}'
+        )
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def reset(self) -> None:
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+
+# pylint: disable=too-many-instance-attributes
+class LogSampler(logging.Filter):
+    """Bounds the provider log volume of an invocation.
+
+    Records of a level in ``sample_rates`` are kept with that probability.
+    The remaining records are then rate limited by token buckets over records
+    and message bytes, which start each invocation full with ``record_burst``
+    and ``byte_burst`` tokens and refill at the given per second rates.
+    A summary of what was dropped is logged when the invocation ends.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        sample_rates: Optional[Mapping[int, float]] = None,
+        *,
+        records_per_second: Optional[float] = None,
+        record_burst: int = DEFAULT_LOG_RECORD_BURST,
+        bytes_per_second: Optional[float] = None,
+        byte_burst: int = DEFAULT_LOG_BYTE_BURST,
+        sample: Callable[[], float] = random.random,
+    ) -> None:
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self._records = (
+            _TokenBucket(records_per_second, record_burst)
+            if records_per_second is not None
+            else None
+        )
+        self._bytes = (
+            _TokenBucket(bytes_per_second, byte_burst)
+            if bytes_per_second is not None
+            else None
+        )
+        self._sample = sample
+        self._lock = threading.Lock()
+        self.sampled: "Counter[str]" = Counter()
+        self.limited = 0
+        self.limited_bytes = 0
+
+    def attach(self, log_handler: logging.Handler) -> None:
+        """Filters the records of ``log_handler`` for a new invocation."""
+        with self._lock:
+            for bucket in (self._records, self._bytes):
+                if bucket:
+                    bucket.reset()
+            self.sampled.clear()
+            self.limited = self.limited_bytes = 0
+        log_handler.addFilter(self)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "log_sampling_summary", False):
+            return True
+        rate = self.sample_rates.get(record.levelno, 1.0)
+        if rate < 1.0 and self._sample() >= rate:
+            with self._lock:
+                self.sampled[record.levelname] += 1
+            return False
+        if not self._records and not self._bytes:
+            return True
+
+        size = len(record.getMessage().encode("utf-8"))
+        with self._lock:
+            for bucket in (self._records, self._bytes):
+                if bucket:
+                    bucket.refill()
+            if (self._records and self._records.tokens < 1) or (
+                self._bytes and self._bytes.tokens < size
+            ):
+                self.limited += 1
+                self.limited_bytes += size
+                return False
+            if self._records:
+                self._records.tokens -= 1
+            if self._bytes:
+                self._bytes.tokens -= size
+        return True
+
+    def summary(self) -> Optional[str]:
+        with self._lock:
+            dropped = []
+            if self.sampled:
+                counts = ", ".join(
+                    f"{count} {level}" for level, count in sorted(self.sampled.items())
+                )
+                dropped.append(f"sampling dropped {counts} records")
+            if self.limited:
+                dropped.append(
+                    f"rate limiting dropped {self.limited} records "
+                    f"({self.limited_bytes} bytes)"
+                )
+        if not dropped:
+            return None
+        return "Provider logs were reduced: " + "; ".join(dropped)
+
+    def log_summary(self) -> None:
+        message = self.summary()
+        if message:
+            LOG.warning(message, extra={"log_sampling_summary": True})
+
+
 class ProviderLogHandler(logging.Handler):
+    """Delivers log records to the provider log group. Records are buffered
+    and sent in batches within the PutLogEvents limits, when a limit would be
+    exceeded and when the handler is flushed at the end of an invocation."""
+
     def __init__(
-        self, group: str, stream: str, session: SessionProxy, *args: Any, **kwargs: Any
+        self,
+        group: str,
+        stream: str,
+        session: SessionProxy,
+        *args: Any,
+        breaker: Optional[CircuitBreaker] = None,
+        **kwargs: Any,
     ):
         super().__init__(*args, **kwargs)
         self.group = group
         self.stream = stream.replace(":", "__")
         self.client = session.client("logs")
+        self.breaker = breaker
+        self.skipped = 0
         self.sequence_token = ""  # nosec
+        self._stream_created = False
+        self._events: List[Mapping[str, Any]] = []
+        self._batch_bytes = 0
 
     @classmethod
-    def _get_existing_logger(cls) -> Optional["ProviderLogHandler"]:
+    def _get_existing_logger(cls) -> Optional[logging.Handler]:
         for handler in logging.getLogger().handlers:
             if isinstance(handler, cls):
                 return handler
+            if isinstance(handler, ProviderLogQueueHandler) and isinstance(
+                handler.target, cls
+            ):
+                return handler
         return None
 
+    @staticmethod
+    def _install(
+        log_handler: "ProviderLogHandler",
+        log_format: Optional[logging.Formatter],
+        shipping: Optional[LogShippingConfig],
+    ) -> logging.Handler:
+        installed: logging.Handler = log_handler
+        if shipping:
+            installed = ProviderLogQueueHandler(log_handler, shipping)
+        # a queue handler formats records before they are queued, on the
+        # thread that logged them and so with its request context
+        if log_format:
+            installed.setFormatter(log_format)
+        # add log handler to root, so that provider gets plugin logs too
+        logging.getLogger().addHandler(installed)
+        return installed
+
     @classmethod
     def setup(
         cls,
         request: HandlerRequest,
         provider_sess: Optional[SessionProxy],
         log_format: Optional[logging.Formatter] = None,
-    ) -> None:
+        shipping: Optional[LogShippingConfig] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> Optional[logging.Handler]:
         log_group = request.requestData.providerLogGroupName
         if request.stackId and request.requestData.logicalResourceId:
             stream_name = f"{request.stackId}/{request.requestData.logicalResourceId}"
@@ -51,21 +343,26 @@ class ProviderLogHandler(logging.Handler):
             if log_handler:
                 # This is a re-used lambda container, log handler is already setup, so
                 # we just refresh the client with new creds
-                log_handler.client = provider_sess.client("logs")
-                return
+                target = _provider_handler(log_handler)
+                target.client = provider_sess.client("logs")
+                target.breaker = breaker
+                return log_handler
 
             # filter provider messages from platform
             provider = request.resourceType.replace("::", "_").lower()
-            log_handler = cls(
-                group=log_group, stream=stream_name, session=provider_sess
+            log_handler = cls._install(
+                cls(
+                    group=log_group,
+                    stream=stream_name,
+                    session=provider_sess,
+                    breaker=breaker,
+                ),
+                log_format,
+                shipping,
             )
-
-            if log_format:
-                log_handler.setFormatter(log_format)
-
-            # add log handler to root, so that provider gets plugin logs too
-            logging.getLogger().addHandler(log_handler)
             logging.getLogger().handlers[0].addFilter(ProviderFilter(provider))
+            return log_handler
+        return None
 
     def _create_log_group(self) -> None:
         try:
@@ -81,52 +378,100 @@ class ProviderLogHandler(logging.Handler):
         except self.client.exceptions.ResourceAlreadyExistsException:
             pass
 
-    def _put_log_event(self, msg: logging.LogRecord) -> None:
+    def _create_log_stream_once(self) -> None:
+        try:
+            self._create_log_stream()
+        except self.client.exceptions.ResourceNotFoundException:
+            self._create_log_group()
+            self._create_log_stream()
+        self._stream_created = True
+
+    def _put_log_events(self, events: List[Mapping[str, Any]]) -> None:
         kwargs = {
             "logGroupName": self.group,
             "logStreamName": self.stream,
-            "logEvents": [
-                {"timestamp": round(time.time() * 1000), "message": self.format(msg)}
-            ],
+            "logEvents": events,
         }
-        if self.sequence_token:
-            kwargs["sequenceToken"] = self.sequence_token
+        retries = 0
+        while True:
+            if self.sequence_token:
+                kwargs["sequenceToken"] = self.sequence_token
+            try:
+                self.sequence_token = self.client.put_log_events(**kwargs)[
+                    "nextSequenceToken"
+                ]
+                return
+            except (
+                self.client.exceptions.DataAlreadyAcceptedException,
+                self.client.exceptions.InvalidSequenceTokenException,
+            ) as e:
+                self.sequence_token = str(e).rsplit(" ", maxsplit=1)[-1]
+                if retries == MAX_SEQUENCE_TOKEN_RETRIES:
+                    raise
+                retries += 1
+
+    def _send(self, events: List[Mapping[str, Any]]) -> None:
+        if not self._stream_created:
+            self._create_log_stream_once()
+        try:
+            self._put_log_events(events)
+        except self.client.exceptions.ResourceNotFoundException:
+            # the group or stream was deleted after it was created
+            self._create_log_stream_once()
+            self._put_log_events(events)
+
+    def _deliver(self, events: List[Mapping[str, Any]]) -> None:
+        if not self.breaker:
+            self._send(events)
+            return
         try:
-            self.sequence_token = self.client.put_log_events(**kwargs)[
-                "nextSequenceToken"
-            ]
-        except (
-            self.client.exceptions.DataAlreadyAcceptedException,
-            self.client.exceptions.InvalidSequenceTokenException,
-        ) as e:
-            self.sequence_token = str(e).rsplit(" ", maxsplit=1)[-1]
-            self._put_log_event(msg)
+            self.breaker.call(self._send, events)
+        except CircuitOpenError:
+            # CloudWatch Logs is failing, the batch is dropped
+            self.skipped += len(events)
 
     def emit(self, record: logging.LogRecord) -> None:
+        message = self.format(record)
+        timestamp = round(record.created * 1000)
+        encoded = message.encode("utf-8")
+        size = len(encoded) + LOG_EVENT_OVERHEAD_BYTES
+        if size > MAX_LOG_EVENT_BYTES:
+            # PutLogEvents rejects the whole batch for one oversized event
+            limit = MAX_LOG_EVENT_BYTES - LOG_EVENT_OVERHEAD_BYTES
+            limit -= len(LOG_TRUNCATED_SUFFIX)
+            message = encoded[:limit].decode("utf-8", "ignore") + LOG_TRUNCATED_SUFFIX
+            size = len(message.encode("utf-8")) + LOG_EVENT_OVERHEAD_BYTES
+        if self._events and (
+            len(self._events) >= MAX_LOG_EVENTS_PER_BATCH
+            or self._batch_bytes + size > MAX_LOG_BATCH_BYTES
+            or abs(timestamp - self._events[0]["timestamp"]) >= MAX_LOG_BATCH_SPAN_MS
+        ):
+            self.flush()
+        self._events.append({"timestamp": timestamp, "message": message})
+        self._batch_bytes += size
+
+    def flush(self) -> None:
+        self.acquire()
         try:
-            self._put_log_event(record)
-        except self.client.exceptions.ResourceNotFoundException as e:
-            if "log group does not exist" in str(e):
-                self._create_log_group()
-            self._create_log_stream()
-            self._put_log_event(record)
+            events, self._events, self._batch_bytes = self._events, [], 0
+            if events:
+                # events of a batch must be in chronological order
+                events.sort(key=lambda event: event["timestamp"])
+                self._deliver(events)
+        finally:
+            self.release()
 
 
 class HookProviderLogHandler(ProviderLogHandler):
-    @classmethod
-    def _get_existing_logger(cls) -> Optional["HookProviderLogHandler"]:
-        for handler in logging.getLogger().handlers:
-            if isinstance(handler, cls):
-                return handler
-        return None
-
     @classmethod
     def setup(  # type: ignore
         cls,
         request: HookInvocationRequest,
         provider_sess: Optional[SessionProxy],
         log_format: Optional[logging.Formatter] = None,
-    ) -> None:
+        shipping: Optional[LogShippingConfig] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> Optional[logging.Handler]:
         log_group = request.requestData.providerLogGroupName
         if request.stackId and request.requestData.targetLogicalId:
             stream_name = f"{request.stackId}/{request.requestData.targetLogicalId}"
@@ -138,18 +483,243 @@ class HookProviderLogHandler(ProviderLogHandler):
             if log_handler:
                 # This is a re-used lambda container, log handler is already setup, so
                 # we just refresh the client with new creds
-                log_handler.client = provider_sess.client("logs")
-                return
+                target = _provider_handler(log_handler)
+                target.client = provider_sess.client("logs")
+                target.breaker = breaker
+                return log_handler
 
             # filter provider messages from platform
             provider = request.hookTypeName.replace("::", "_").lower()
             logging.getLogger().handlers[0].addFilter(ProviderFilter(provider))
-            log_handler = cls(
-                group=log_group, stream=stream_name, session=provider_sess
+            return cls._install(
+                cls(
+                    group=log_group,
+                    stream=stream_name,
+                    session=provider_sess,
+                    breaker=breaker,
+                ),
+                log_format,
+                shipping,
+            )
+        return None
+
+
+class StdoutLogHandler(logging.StreamHandler):  # type: ignore
+    """Writes the records of the provider's loggers to stdout as JSON lines,
+    along with the provider log stream name and request identifiers. Lambda
+    captures stdout into the function's log group, so delivery costs no Logs
+    API calls."""
+
+    def __init__(
+        self,
+        log_stream: str,
+        fields: Mapping[str, Any],
+        stream: Optional[TextIO] = None,
+    ):
+        super().__init__(stream or sys.stdout)
+        self.set_request(log_stream, fields)
+
+    def set_request(self, log_stream: str, fields: Mapping[str, Any]) -> None:
+        self.log_stream = log_stream.replace(":", "__")
+        self.fields = fields
+        # for the JSON formatter, encoded once per invocation
+        self._encoded_stream = _encode_fields({"logStream": self.log_stream})
+        self._encoded_fields = _encode_fields(fields)
+
+    @classmethod
+    def _get_existing_logger(
+        cls, logger: logging.Logger
+    ) -> Optional["StdoutLogHandler"]:
+        for handler in logger.handlers:
+            if isinstance(handler, cls):
+                return handler
+        return None
+
+    @classmethod
+    def _install(
+        cls,
+        log_stream: str,
+        fields: Mapping[str, Any],
+        provider: str,
+        log_format: Optional[logging.Formatter],
+    ) -> "StdoutLogHandler":
+        # only provider messages, the platform already writes the others to
+        # stdout
+        logger = logging.getLogger(provider)
+        log_handler = cls._get_existing_logger(logger)
+        if log_handler:
+            # a re-used lambda container, only the request has changed
+            log_handler.set_request(log_stream, fields)
+            return log_handler
+
+        # filter provider messages from platform, so they are written once
+        root = logging.getLogger()
+        if root.handlers:
+            root.handlers[0].addFilter(ProviderFilter(provider))
+        log_handler = cls(log_stream, fields)
+        if log_format:
+            log_handler.setFormatter(log_format)
+        logger.addHandler(log_handler)
+        return log_handler
+
+    @classmethod
+    def setup(
+        cls, request: HandlerRequest, log_format: Optional[logging.Formatter] = None
+    ) -> Optional["StdoutLogHandler"]:
+        if not request.resourceType:
+            return None
+        logical_resource_id = request.requestData.logicalResourceId
+        if request.stackId and logical_resource_id:
+            log_stream = f"{request.stackId}/{logical_resource_id}"
+        else:
+            log_stream = f"{request.awsAccountId}-{request.region}"
+        fields = _resource_log_fields(request)
+        provider = request.resourceType.replace("::", "_").lower()
+        return cls._install(log_stream, fields, provider, log_format)
+
+    def format(self, record: logging.LogRecord) -> str:
+        if isinstance(self.formatter, JsonFormatter):
+            # the request context of the invocation replaces the fields of the
+            # request the handler was set up for
+            return self.formatter.format_with(
+                record, self._encoded_stream, self._encoded_fields
             )
+        return json.dumps(
+            {
+                "timestamp": round(record.created * 1000),
+                "level": record.levelname,
+                "logger": record.name,
+                "logStream": self.log_stream,
+                **self.fields,
+                "message": super().format(record),
+            },
+            default=str,
+        )
+
+
+class HookStdoutLogHandler(StdoutLogHandler):
+    @classmethod
+    def setup(  # type: ignore
+        cls,
+        request: HookInvocationRequest,
+        log_format: Optional[logging.Formatter] = None,
+    ) -> Optional["StdoutLogHandler"]:
+        if not request.hookTypeName:
+            return None
+        target_logical_id = request.requestData.targetLogicalId
+        if request.stackId and target_logical_id:
+            log_stream = f"{request.stackId}/{target_logical_id}"
+        else:
+            log_stream = f"{request.awsAccountId}-{request.clientRequestToken}"
+        fields = _hook_log_fields(request)
+        provider = request.hookTypeName.replace("::", "_").lower()
+        return cls._install(log_stream, fields, provider, log_format)
+
+
+class _ShippingListener(QueueListener):
+    def __init__(
+        self, records: "queue.Queue[logging.LogRecord]", target: logging.Handler
+    ) -> None:
+        super().__init__(records, target)
+        self.records = records
+        self.ident: Optional[int] = None
+
+    def start(self) -> None:
+        super().start()
+        self.ident = self._thread.ident  # type: ignore
+
+    def handle(self, record: logging.LogRecord) -> None:
+        # the listener thread must survive delivery errors. they are not
+        # logged, as that would queue more records for the same handler
+        try:
+            super().handle(record)
+            # batches are sent whenever the listener catches up with the queue
+            if self.records.empty():
+                for handler in self.handlers:
+                    handler.flush()
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"Failed to deliver provider logs {e}")
+            traceback.print_exc()
+
+
+class ProviderLogQueueHandler(QueueHandler):
+    """Puts records on a bounded queue, from which a background thread hands
+    them to a ProviderLogHandler, so logging does not wait on CloudWatch Logs.
+    """
+
+    def __init__(self, target: ProviderLogHandler, config: LogShippingConfig):
+        records: "queue.Queue[logging.LogRecord]" = queue.Queue(config.max_queue_size)
+        super().__init__(records)
+        self.records = records
+        self.target = target
+        self.config = config
+        self.dropped = 0
+        self.listener = _ShippingListener(records, target)
+        self.listener.start()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if threading.get_ident() == self.listener.ident:
+            # logged while shipping, e.g. by botocore. waiting for room on the
+            # queue would deadlock the listener, and shipping it logs more
+            return
+        if self.config.drop_policy == DropPolicy.BLOCK:
+            self.records.put(record)
+            return
+        while True:
+            try:
+                self.records.put_nowait(record)
+                return
+            except queue.Full:
+                if self.config.drop_policy == DropPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+            try:
+                self.records.get_nowait()
+                self.records.task_done()
+                self.dropped += 1
+            except queue.Empty:
+                # the listener emptied the queue in the meantime
+                pass
+
+    def drain(self, timeout: float) -> bool:
+        """Waits up to ``timeout`` seconds for the queued records to be
+        delivered. Returns whether they all were."""
+        deadline = time.monotonic() + timeout
+        tasks = self.records
+        with tasks.all_tasks_done:
+            while tasks.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                tasks.all_tasks_done.wait(remaining)
+        return True
+
+    def discard(self, timeout: float) -> bool:
+        """Drops the queued records, then waits up to ``timeout`` seconds for
+        those being delivered. Returns whether they all were."""
+        while True:
+            try:
+                self.records.get_nowait()
+            except queue.Empty:
+                break
+            self.records.task_done()
+            self.dropped += 1
+        return self.drain(timeout)
+
+    def drain_before_deadline(self, context: Optional[LambdaContext]) -> bool:
+        drained = self.drain(_drain_timeout(self.config.drain_timeout, context))
+        if not drained:
+            print("Provider logs still queued when the invocation ended")
+        return drained
+
+
+def _discard_queued_records() -> None:
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, ProviderLogQueueHandler):
+            handler.discard(handler.config.drain_timeout)
 
-            if log_format:
-                log_handler.setFormatter(log_format)
 
-            # add log handler to root, so that provider gets plugin logs too
-            logging.getLogger().addHandler(log_handler)
+def _provider_handler(log_handler: logging.Handler) -> ProviderLogHandler:
+    if isinstance(log_handler, ProviderLogQueueHandler):
+        return log_handler.target
+    return log_handler  # type: ignore
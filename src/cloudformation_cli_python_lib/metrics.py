@@ -1,20 +1,385 @@
 import datetime
+import json
 import logging
+import sys
+import threading
+import time
 from botocore.exceptions import ClientError  # type: ignore
-from typing import Any, List, Mapping, Optional, Union
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 from .boto3_proxy import SessionProxy
-from .interface import Action, HookInvocationPoint, MetricTypes, StandardUnit
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .interface import (
+    Action,
+    DropPolicy,
+    HookInvocationPoint,
+    MetricTypes,
+    StandardUnit,
+)
+from .tracing import ApiCallTrace
+from .utils import LambdaContext, _drain_timeout
 
 LOG = logging.getLogger(__name__)
 
 METRIC_NAMESPACE_ROOT = "AWS/CloudFormation"
+# PutMetricData accepts at most 1000 datums per request
+MAX_METRIC_DATA_PER_REQUEST = 1000
+DEFAULT_METRICS_QUEUE_SIZE = 10000
+DEFAULT_METRICS_DRAIN_TIMEOUT_SECONDS = 1.0
+DEFAULT_AGGREGATION_INTERVAL_SECONDS = 60.0
+# a datum accepts at most 150 distinct values
+MAX_VALUES_PER_DATUM = 150
 
 
 def format_dimensions(dimensions: Mapping[str, str]) -> List[Mapping[str, str]]:
     return [{"Name": key, "Value": value} for key, value in dimensions.items()]
 
 
+class MetricsSink:
+    """Where a publisher delivers its metrics. ``metric_data`` is a list of
+    datums in the ``PutMetricData`` format."""
+
+    def put_metric_data(
+        self, namespace: str, metric_data: Sequence[Mapping[str, Any]]
+    ) -> None:
+        raise NotImplementedError()
+
+
+class CloudWatchMetricsSink(MetricsSink):
+    def __init__(
+        self, session: SessionProxy, breaker: Optional[CircuitBreaker] = None
+    ) -> None:
+        self._client = session.client("cloudwatch")
+        self._breaker = breaker
+
+    def put_metric_data(
+        self, namespace: str, metric_data: Sequence[Mapping[str, Any]]
+    ) -> None:
+        put = self._client.put_metric_data
+        while metric_data:
+            batch = metric_data[:MAX_METRIC_DATA_PER_REQUEST]
+            metric_data = metric_data[MAX_METRIC_DATA_PER_REQUEST:]
+            try:
+                if self._breaker:
+                    self._breaker.call(put, Namespace=namespace, MetricData=batch)
+                else:
+                    put(Namespace=namespace, MetricData=batch)
+            except CircuitOpenError:
+                LOG.debug("Skipped %d metrics, CloudWatch is unavailable", len(batch))
+            except ClientError as e:
+                LOG.error("An error occurred while publishing metrics: %s", str(e))
+
+
+class EmbeddedMetricFormatSink(MetricsSink):
+    """Writes metrics as CloudWatch Embedded Metric Format log lines, one JSON
+    document per datum, which CloudWatch Logs turns into metrics. No API call
+    is made, so metrics must be written where the logs are collected: by
+    default standard output, which Lambda sends to the function's log group.
+    Aggregated metrics can't be written in this format.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _to_document(namespace: str, datum: Mapping[str, Any]) -> Mapping[str, Any]:
+        timestamp = datetime.datetime.fromisoformat(str(datum["Timestamp"]))
+        if not timestamp.tzinfo:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        dimensions = {d["Name"]: d["Value"] for d in datum["Dimensions"]}
+        return {
+            "_aws": {
+                "Timestamp": int(timestamp.timestamp() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": datum["MetricName"], "Unit": datum["Unit"]}
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+            datum["MetricName"]: datum["Value"],
+        }
+
+    def put_metric_data(
+        self, namespace: str, metric_data: Sequence[Mapping[str, Any]]
+    ) -> None:
+        lines = "".join(
+            json.dumps(self._to_document(namespace, datum)) + "\n"
+            for datum in metric_data
+        )
+        stream = self._stream or sys.stdout
+        with self._lock:
+            stream.write(lines)
+            stream.flush()
+
+
+# pylint: disable=too-many-instance-attributes
+class BackgroundMetricsFlusher:
+    """Delivers datums to their sinks from a background thread, so publishing
+    a metric does not wait on the sink.
+
+    Datums wait on a queue of at most ``max_queue_size`` entries. When it is
+    full, ``drop_policy`` decides whether publishing blocks, or the newest or
+    oldest datum is dropped.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = DEFAULT_METRICS_QUEUE_SIZE,
+        drop_policy: DropPolicy = DropPolicy.DROP_OLDEST,
+        drain_timeout: float = DEFAULT_METRICS_DRAIN_TIMEOUT_SECONDS,
+    ) -> None:
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
+        self.drain_timeout = drain_timeout
+        self.dropped = 0
+        self._queue: Deque[Tuple[MetricsSink, str, Mapping[str, Any]]] = deque()
+        self._unfinished = 0
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(
+        self, sink: MetricsSink, namespace: str, datum: Mapping[str, Any]
+    ) -> None:
+        with self._condition:
+            if self.drop_policy == DropPolicy.BLOCK:
+                while len(self._queue) >= self.max_queue_size:
+                    self._condition.wait()
+            elif len(self._queue) >= self.max_queue_size:
+                self.dropped += 1
+                if self.drop_policy == DropPolicy.DROP_NEWEST:
+                    return
+                self._queue.popleft()
+                self._unfinished -= 1
+            self._queue.append((sink, namespace, datum))
+            self._unfinished += 1
+            if not self._thread:
+                self._thread = threading.Thread(
+                    target=self._run, name="metrics-flusher", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify_all()
+
+    def drain(self, timeout: float) -> bool:
+        """Waits up to ``timeout`` seconds for the queued datums to be
+        delivered. Returns whether they all were."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._unfinished:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def discard(self, timeout: float) -> bool:
+        """Drops the queued datums, then waits up to ``timeout`` seconds for
+        those being delivered. Returns whether they all were."""
+        with self._condition:
+            self.dropped += len(self._queue)
+            self._unfinished -= len(self._queue)
+            self._queue.clear()
+            self._condition.notify_all()
+        return self.drain(timeout)
+
+    def drain_before_deadline(self, context: Optional[LambdaContext]) -> bool:
+        drained = self.drain(_drain_timeout(self.drain_timeout, context))
+        if not drained:
+            LOG.warning("Metrics still queued when the invocation ended")
+        return drained
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                items = list(self._queue)
+                self._queue.clear()
+                self._condition.notify_all()
+            try:
+                self._deliver(items)
+            finally:
+                with self._condition:
+                    self._unfinished -= len(items)
+                    self._condition.notify_all()
+
+    @staticmethod
+    def _deliver(items: Sequence[Tuple[MetricsSink, str, Mapping[str, Any]]]) -> None:
+        batches: Dict[Tuple[int, str], List[Mapping[str, Any]]] = {}
+        sinks: Dict[int, MetricsSink] = {}
+        for sink, namespace, datum in items:
+            sinks[id(sink)] = sink
+            batches.setdefault((id(sink), namespace), []).append(datum)
+        for (sink_id, namespace), metric_data in batches.items():
+            try:
+                sinks[sink_id].put_metric_data(namespace, metric_data)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception("An error occurred while publishing metrics")
+
+
+class _Aggregate:
+    def __init__(self, keep_values: bool) -> None:
+        self.sample_count = 0
+        self.sum = 0.0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self.values: Optional["Counter[float]"] = Counter() if keep_values else None
+
+    def add(self, value: float) -> None:
+        self.sample_count += 1
+        self.sum += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        if self.values is not None:
+            self.values[value] += 1
+
+    def to_metric_data(self, datum: Mapping[str, Any]) -> List[Mapping[str, Any]]:
+        if self.values is None:
+            statistics = {
+                "SampleCount": float(self.sample_count),
+                "Sum": self.sum,
+                "Minimum": self.minimum,
+                "Maximum": self.maximum,
+            }
+            return [{**datum, "StatisticValues": statistics}]
+        items = sorted(self.values.items())
+        metric_data: List[Mapping[str, Any]] = []
+        while items:
+            chunk, items = items[:MAX_VALUES_PER_DATUM], items[MAX_VALUES_PER_DATUM:]
+            metric_data.append(
+                {
+                    **datum,
+                    "Values": [value for value, _ in chunk],
+                    "Counts": [float(count) for _, count in chunk],
+                }
+            )
+        return metric_data
+
+
+class MetricsAggregator:
+    """Accumulates datums in memory across the invocations of a warm
+    container, and turns them into one datum per metric and dimension set:
+    either ``StatisticValues``, or ``Values``/``Counts`` arrays when
+    ``keep_values`` is set so CloudWatch can compute percentiles.
+
+    Aggregated metrics are sent when ``interval`` seconds have passed since the
+    last send, or when ``max_series`` distinct series are waiting, through the
+    sink most recently used for their namespace. That sink sends them with
+    the provider credentials of the current invocation, so the aggregates
+    belong to one account: ``switch_account`` hands them over for sending
+    before the credentials of another account are swapped in. Metrics
+    aggregated when the container is shut down are lost, and aggregated
+    datums can't be written in Embedded Metric Format.
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_AGGREGATION_INTERVAL_SECONDS,
+        max_series: int = MAX_METRIC_DATA_PER_REQUEST,
+        keep_values: bool = False,
+    ) -> None:
+        self.interval = interval
+        self.max_series = max_series
+        self.keep_values = keep_values
+        self._aggregates: Dict[Tuple[Any, ...], _Aggregate] = {}
+        self._sinks: Dict[str, MetricsSink] = {}
+        self._account_id: Optional[str] = None
+        self._window_start: Optional[str] = None
+        self._last_sent = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, sink: MetricsSink, namespace: str, datum: Mapping[str, Any]) -> None:
+        dimensions = tuple((d["Name"], d["Value"]) for d in datum["Dimensions"])
+        key = (namespace, datum["MetricName"], dimensions, datum["Unit"])
+        with self._lock:
+            self._sinks[namespace] = sink
+            if self._window_start is None:
+                self._window_start = datum["Timestamp"]
+            try:
+                aggregate = self._aggregates[key]
+            except KeyError:
+                aggregate = self._aggregates[key] = _Aggregate(self.keep_values)
+            aggregate.add(datum["Value"])
+
+    def switch_account(
+        self, account_id: Optional[str]
+    ) -> List[Tuple[MetricsSink, str, List[Mapping[str, Any]]]]:
+        """Takes the metric data aggregated for another account than
+        ``account_id``, which must be sent while its credentials are still in
+        place."""
+        with self._lock:
+            if account_id == self._account_id:
+                return []
+            self._account_id = account_id
+        return self.collect(force=True)
+
+    def collect(
+        self, force: bool = False
+    ) -> List[Tuple[MetricsSink, str, List[Mapping[str, Any]]]]:
+        """Takes the aggregated metric data for each sink and namespace, if
+        a threshold is reached or ``force`` is set."""
+        with self._lock:
+            due = (
+                force
+                or len(self._aggregates) >= self.max_series
+                or time.monotonic() - self._last_sent >= self.interval
+            )
+            if not due or not self._aggregates:
+                return []
+            aggregates, self._aggregates = self._aggregates, {}
+            timestamp, self._window_start = self._window_start, None
+            self._last_sent = time.monotonic()
+            sinks = dict(self._sinks)
+
+        by_namespace: Dict[str, List[Mapping[str, Any]]] = {}
+        for (namespace, metric_name, dimensions, unit), aggregate in aggregates.items():
+            datum = {
+                "MetricName": metric_name,
+                "Dimensions": format_dimensions(dict(dimensions)),
+                "Unit": unit,
+                "Timestamp": timestamp,
+            }
+            by_namespace.setdefault(namespace, []).extend(
+                aggregate.to_metric_data(datum)
+            )
+        return [
+            (sinks[namespace], namespace, metric_data)
+            for namespace, metric_data in by_namespace.items()
+        ]
+
+
+def _check_aggregated_sink(
+    sink: Optional[MetricsSink], aggregator: Optional[MetricsAggregator]
+) -> None:
+    # EMF has no equivalent of the statistic sets of aggregated datums
+    if aggregator and isinstance(sink, EmbeddedMetricFormatSink):
+        raise ValueError(
+            "Aggregated metrics can't be written in Embedded Metric Format, "
+            "use the aggregator with another sink"
+        )
+
+
 class MetricsPublisher:
     """A cloudwatch based metric publisher.\
     Given a resource type and session, \
@@ -32,37 +397,76 @@ class MetricsPublisher:
     publish_duration_metric: Publishes an duration metric
 
     publish_log_delivery_exception_metric: Publishes an log delivery exception metric
+
+    flush: Sends the buffered metrics to the sink, CloudWatch by default
     """
 
-    def __init__(self, session: SessionProxy, resource_type: str) -> None:
-        self._client = session.client("cloudwatch")
+    def __init__(
+        self,
+        session: Optional[SessionProxy],
+        resource_type: str,
+        sink: Optional[MetricsSink] = None,
+        *,
+        flusher: Optional[BackgroundMetricsFlusher] = None,
+        aggregator: Optional[MetricsAggregator] = None,
+    ) -> None:
+        if sink is None:
+            if session is None:
+                raise ValueError("A session is required to publish to CloudWatch")
+            sink = CloudWatchMetricsSink(session)
+        _check_aggregated_sink(sink, aggregator)
+        self._sink = sink
+        self._flusher = flusher
+        self._aggregator = aggregator
         self._resource_type = resource_type
         self._namespace = self._make_namespace(self._resource_type)
+        self._metric_data: List[Mapping[str, Any]] = []
+        self._metric_data_lock = threading.Lock()
+        self._dimensions: MutableMapping[
+            Tuple[Tuple[str, str], ...], List[Mapping[str, str]]
+        ] = {}
+
+    def _format_dimensions(
+        self, dimensions: Mapping[str, str]
+    ) -> List[Mapping[str, str]]:
+        key = tuple(dimensions.items())
+        try:
+            return self._dimensions[key]
+        except KeyError:
+            formatted = self._dimensions[key] = format_dimensions(dimensions)
+            return formatted
 
     def publish_metric(  # pylint: disable-msg=too-many-arguments
         self,
-        metric_name: MetricTypes,
+        metric_name: Union[MetricTypes, str],
         dimensions: Mapping[str, str],
         unit: StandardUnit,
         value: float,
         timestamp: datetime.datetime,
     ) -> None:
-        try:
-            self._client.put_metric_data(
-                Namespace=self._namespace,
-                MetricData=[
-                    {
-                        "MetricName": metric_name.name,
-                        "Dimensions": format_dimensions(dimensions),
-                        "Unit": unit.name,
-                        "Timestamp": str(timestamp),
-                        "Value": value,
-                    }
-                ],
-            )
-
-        except ClientError as e:
-            LOG.error("An error occurred while publishing metrics: %s", str(e))
+        datum = {
+            "MetricName": metric_name.name
+            if isinstance(metric_name, MetricTypes)
+            else metric_name,
+            "Dimensions": self._format_dimensions(dimensions),
+            "Unit": unit.name,
+            "Timestamp": str(timestamp),
+            "Value": value,
+        }
+        if self._aggregator:
+            self._aggregator.add(self._sink, self._namespace, datum)
+            return
+        if self._flusher:
+            self._flusher.submit(self._sink, self._namespace, datum)
+            return
+        with self._metric_data_lock:
+            self._metric_data.append(datum)
+
+    def flush(self) -> None:
+        with self._metric_data_lock:
+            metric_data, self._metric_data = self._metric_data, []
+        if metric_data:
+            self._sink.put_metric_data(self._namespace, metric_data)
 
     def publish_exception_metric(
         self, timestamp: datetime.datetime, action: Action, error: Any
@@ -111,6 +515,28 @@ class MetricsPublisher:
             timestamp=timestamp,
         )
 
+    def publish_custom_metric(  # pylint: disable=too-many-arguments
+        self,
+        timestamp: datetime.datetime,
+        action: Action,
+        metric_name: str,
+        value: float,
+        *,
+        unit: StandardUnit,
+        dimensions: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        self.publish_metric(
+            metric_name=metric_name,
+            dimensions={
+                "DimensionKeyActionType": action.name,
+                **(dimensions or {}),
+                "DimensionKeyResourceType": self._resource_type,
+            },
+            unit=unit,
+            value=value,
+            timestamp=timestamp,
+        )
+
     def publish_log_delivery_exception_metric(
         self, timestamp: datetime.datetime, error: Any
     ) -> None:
@@ -134,8 +560,19 @@ class MetricsPublisher:
 
 
 class HookMetricsPublisher(MetricsPublisher):
-    def __init__(self, session: SessionProxy, hook_type: str, account_id: str) -> None:
-        super().__init__(session, hook_type)
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        session: Optional[SessionProxy],
+        hook_type: str,
+        account_id: str,
+        sink: Optional[MetricsSink] = None,
+        *,
+        flusher: Optional[BackgroundMetricsFlusher] = None,
+        aggregator: Optional[MetricsAggregator] = None,
+    ) -> None:
+        super().__init__(
+            session, hook_type, sink, flusher=flusher, aggregator=aggregator
+        )
         self._hook_type = hook_type
         self._account_id = account_id
         self._namespace = self._make_hook_namespace(hook_type, account_id)
@@ -196,6 +633,29 @@ class HookMetricsPublisher(MetricsPublisher):
             timestamp=timestamp,
         )
 
+    # pylint: disable=arguments-differ,arguments-renamed,too-many-arguments
+    def publish_custom_metric(  # type: ignore
+        self,
+        timestamp: datetime.datetime,
+        invocation_point: HookInvocationPoint,
+        metric_name: str,
+        value: float,
+        *,
+        unit: StandardUnit,
+        dimensions: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        self.publish_metric(
+            metric_name=metric_name,
+            dimensions={
+                "DimensionKeyInvocationPointType": invocation_point.name,
+                **(dimensions or {}),
+                "DimensionKeyHookType": self._hook_type,
+            },
+            unit=unit,
+            value=value,
+            timestamp=timestamp,
+        )
+
     def publish_log_delivery_exception_metric(
         self, timestamp: datetime.datetime, error: Any
     ) -> None:
@@ -236,16 +696,43 @@ class MetricsPublisherProxy:
 
     publish_log_delivery_exception_metric: \
      Publishes a log delivery exception metric to the list of publishers
+
+    flush: Sends the metrics buffered by each publisher, at the end of an invocation.\
+    With a background flusher, waits for queued metrics until close to the deadline
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        flusher: Optional[BackgroundMetricsFlusher] = None,
+        aggregator: Optional[MetricsAggregator] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
         self._publishers: List[MetricsPublisher] = []
+        self._flusher = flusher
+        self._aggregator = aggregator
+        self._breaker = breaker
+
+    def _default_sink(
+        self, session: Optional[SessionProxy], sink: Optional[MetricsSink]
+    ) -> Optional[MetricsSink]:
+        if sink is None and session and self._breaker:
+            return CloudWatchMetricsSink(session, self._breaker)
+        return sink
 
     def add_metrics_publisher(
-        self, session: Optional[SessionProxy], type_name: Optional[str]
+        self,
+        session: Optional[SessionProxy],
+        type_name: Optional[str],
+        sink: Optional[MetricsSink] = None,
     ) -> None:
-        if session and type_name:
-            publisher = MetricsPublisher(session, type_name)
+        if (session or sink) and type_name:
+            publisher = MetricsPublisher(
+                session,
+                type_name,
+                self._default_sink(session, sink),
+                flusher=self._flusher,
+                aggregator=self._aggregator,
+            )
             self._publishers.append(publisher)
 
     def add_hook_metrics_publisher(
@@ -253,9 +740,17 @@ class MetricsPublisherProxy:
         session: Optional[SessionProxy],
         type_name: Optional[str],
         account_id: Optional[str],
+        sink: Optional[MetricsSink] = None,
     ) -> None:
-        if session and type_name and account_id:
-            publisher = HookMetricsPublisher(session, type_name, account_id)
+        if (session or sink) and type_name and account_id:
+            publisher = HookMetricsPublisher(
+                session,
+                type_name,
+                account_id,
+                self._default_sink(session, sink),
+                flusher=self._flusher,
+                aggregator=self._aggregator,
+            )
             self._publishers.append(publisher)
 
     def publish_exception_metric(
@@ -290,3 +785,110 @@ class MetricsPublisherProxy:
     ) -> None:
         for publisher in self._publishers:
             publisher.publish_log_delivery_exception_metric(timestamp, error)
+
+    def publish_custom_metric(  # pylint: disable=too-many-arguments
+        self,
+        timestamp: datetime.datetime,
+        action: Union[Action, HookInvocationPoint],
+        metric_name: str,
+        value: float,
+        *,
+        unit: StandardUnit,
+        dimensions: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        for publisher in self._publishers:
+            publisher.publish_custom_metric(
+                timestamp,
+                action,  # type: ignore
+                metric_name,
+                value,
+                unit=unit,
+                dimensions=dimensions,
+            )
+
+    def publish_api_call_metrics(
+        self,
+        timestamp: datetime.datetime,
+        action: Union[Action, HookInvocationPoint],
+        trace: ApiCallTrace,
+    ) -> None:
+        calls = trace.calls
+        if not calls:
+            return
+        for metric_name, value, unit in (
+            ("ApiCallCount", float(len(calls)), StandardUnit.Count),
+            ("ApiCallDuration", trace.duration_ms, StandardUnit.Milliseconds),
+            ("ApiCallRetryCount", float(trace.retries), StandardUnit.Count),
+        ):
+            self.publish_custom_metric(timestamp, action, metric_name, value, unit=unit)
+
+    def flush(self, context: Optional[LambdaContext] = None) -> None:
+        for publisher in self._publishers:
+            publisher.flush()
+        if self._aggregator and self._publishers:
+            for sink, namespace, metric_data in self._aggregator.collect():
+                if self._flusher:
+                    for datum in metric_data:
+                        self._flusher.submit(sink, namespace, datum)
+                else:
+                    sink.put_metric_data(namespace, metric_data)
+        if self._flusher and self._publishers:
+            self._flusher.drain_before_deadline(context)
+
+
+class HandlerMetrics:
+    """Publishes a handler's own metrics for the current invocation, with the
+    namespace and dimensions of the library's metrics and through the same
+    publishers, so they are sent with them.
+
+    Available to handlers from :func:`get_handler_metrics`.
+    """
+
+    def __init__(
+        self,
+        proxy: MetricsPublisherProxy,
+        action: Optional[Union[Action, HookInvocationPoint]],
+    ) -> None:
+        self._proxy = proxy
+        self._action = action
+
+    def publish(
+        self,
+        metric_name: str,
+        value: float = 1.0,
+        unit: StandardUnit = StandardUnit.Count,
+        dimensions: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        if self._action is None:
+            return
+        self._proxy.publish_custom_metric(
+            datetime.datetime.utcnow(),
+            self._action,
+            metric_name,
+            value,
+            unit=unit,
+            dimensions=dimensions,
+        )
+
+
+_HANDLER_METRICS: ContextVar[Optional[HandlerMetrics]] = ContextVar(
+    "handler_metrics", default=None
+)
+
+
+def get_handler_metrics() -> HandlerMetrics:
+    """The metrics of the invocation being handled. Outside of an invocation,
+    or without a metrics publisher, published metrics are discarded."""
+    return _HANDLER_METRICS.get() or HandlerMetrics(MetricsPublisherProxy(), None)
+
+
+@contextmanager
+def handler_metrics(
+    proxy: MetricsPublisherProxy, action: Union[Action, HookInvocationPoint]
+) -> Iterator[HandlerMetrics]:
+    metrics = HandlerMetrics(proxy, action)
+    token = _HANDLER_METRICS.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _HANDLER_METRICS.reset(token)
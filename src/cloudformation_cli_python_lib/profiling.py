@@ -0,0 +1,153 @@
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import Counter as CounterType, Iterator, List, Optional, Union
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_THRESHOLD_SECONDS = 1.0
+DEFAULT_SAMPLE_INTERVAL_SECONDS = 0.01
+MAX_STACK_DEPTH = 128
+# the provider log gets the most frequent stacks only, files get all of them.
+# the budget keeps the record well under the size of a CloudWatch Logs event
+MAX_LOGGED_STACKS = 100
+MAX_LOGGED_PROFILE_BYTES = 65536
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _collapse(frame: Optional[FrameType], max_depth: int = MAX_STACK_DEPTH) -> str:
+    """The stack of ``frame`` as ``outermost;...;innermost``."""
+    names: List[str] = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profile:
+    """The stacks sampled while profiling one call, with sample counts."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started = datetime.utcnow()
+        self.duration = 0.0
+        self.stacks: CounterType[str] = Counter()
+        self.kept = False
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def collapsed(
+        self, limit: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> str:
+        """The stacks in the collapsed format read by flame graph tools, one
+        ``frame;frame;frame count`` line per stack, most frequent first. With
+        ``max_bytes``, the stacks that would take the text past it are left
+        out."""
+        lines: List[str] = []
+        size = 0
+        for stack, count in self.stacks.most_common(limit):
+            line = f"{stack} {count}"
+            # lines after the first are preceded by a newline
+            size += len(line.encode("utf-8")) + (1 if lines else 0)
+            if max_bytes is not None and size > max_bytes:
+                break
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float, profile: Profile) -> None:
+        super().__init__(name="cfn-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.profile = profile
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(  # pylint: disable=protected-access
+                self.thread_id
+            )
+            if frame is not None:
+                self.profile.stacks[_collapse(frame)] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class SamplingProfiler:
+    """Samples the stack of the thread running a handler every ``interval``
+    seconds, and keeps the samples of calls that take ``threshold`` seconds
+    or more.
+
+    Kept profiles are logged in collapsed-stack format, or written to a
+    ``<name>-<timestamp>.collapsed`` file in ``output_dir`` if one is set.
+    Samples are taken on wall-clock time by a timer thread, so time spent
+    waiting on AWS calls shows up in the profile as well.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_PROFILE_THRESHOLD_SECONDS,
+        interval: float = DEFAULT_SAMPLE_INTERVAL_SECONDS,
+        output_dir: Optional[Union[str, Path]] = None,
+    ) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.output_dir = Path(output_dir) if output_dir else None
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[Profile]:
+        profile = Profile(name)
+        sampler = _Sampler(threading.get_ident(), self.interval, profile)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            yield profile
+        finally:
+            sampler.stop()
+            profile.duration = time.perf_counter() - start
+            if profile.duration >= self.threshold and profile.stacks:
+                profile.kept = True
+                self._report(profile)
+            else:
+                profile.stacks.clear()
+
+    def _report(self, profile: Profile) -> None:
+        if not self.output_dir:
+            LOG.warning(
+                "Profile of %s (%.0f ms, %d samples):\n%s",
+                profile.name,
+                profile.duration * 1000.0,
+                profile.samples,
+                profile.collapsed(MAX_LOGGED_STACKS, MAX_LOGGED_PROFILE_BYTES),
+            )
+            return
+        timestamp = profile.started.strftime("%Y%m%dT%H%M%S%f")
+        path = self.output_dir / f"{profile.name}-{timestamp}.collapsed"
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path.write_text(profile.collapsed() + "\n", encoding="utf-8")
+        except OSError:
+            LOG.exception("Failed to write the profile of %s", profile.name)
+        else:
+            LOG.warning(
+                "Profile of %s (%.0f ms, %d samples) written to %s",
+                profile.name,
+                profile.duration * 1000.0,
+                profile.samples,
+                path,
+            )
@@ -0,0 +1,142 @@
+import re
+from functools import lru_cache
+from typing import Any, Iterable, List, Mapping, MutableMapping, Optional, Tuple, Union
+
+# tokens of a path expression, e.g. $.resourceProperties.Tags[*].Key
+_TOKEN_PATTERN = re.compile(
+    r"""
+    \.?(?P<name>[^.\[\]'"*]+)            # .name or a leading name
+    | \.?\*                              # .* or a leading *
+    | \[(?P<index>-?\d+)\]               # [0]
+    | \[\*\]                             # [*]
+    | \[(?P<quote>['"])(?P<key>.*?)(?P=quote)\]  # ['name.with.dots']
+    """,
+    re.VERBOSE,
+)
+
+
+class _Wildcard:
+    def __repr__(self) -> str:
+        return "*"
+
+
+WILDCARD = _Wildcard()
+
+_Step = Union[str, int, _Wildcard]
+
+# expressions come from handler code, so the compiled cache is bounded
+MAX_COMPILED_QUERIES = 1024
+
+
+def _parse(expression: str) -> Tuple[_Step, ...]:
+    path = expression.strip()
+    if path.startswith("$"):
+        path = path[1:]
+    steps: List[_Step] = []
+    position = 0
+    while position < len(path):
+        match = _TOKEN_PATTERN.match(path, position)
+        if not match:
+            raise ValueError(
+                f"Invalid path expression '{expression}' at position {position}"
+            )
+        if match.group("name") is not None:
+            steps.append(match.group("name"))
+        elif match.group("index") is not None:
+            steps.append(int(match.group("index")))
+        elif match.group("key") is not None:
+            steps.append(match.group("key"))
+        else:
+            steps.append(WILDCARD)
+        position = match.end()
+    return tuple(steps)
+
+
+def _step(values: Iterable[Any], step: _Step) -> List[Any]:
+    matches: List[Any] = []
+    for value in values:
+        if step is WILDCARD:
+            if isinstance(value, Mapping):
+                matches.extend(value.values())
+            elif isinstance(value, list):
+                matches.extend(value)
+        elif isinstance(step, int):
+            if isinstance(value, list) and -len(value) <= step < len(value):
+                matches.append(value[step])
+        elif isinstance(value, Mapping) and step in value:
+            matches.append(value[step])
+    return matches
+
+
+class PathQuery:
+    """A compiled JSONPath-like expression over a hook target model.
+
+    Supports ``name`` and ``['quoted.name']`` keys, ``[n]`` list indexes and
+    ``*``/``[*]`` wildcards over list items or mapping values, optionally
+    starting with ``$``. Paths that do not exist in the data produce no matches.
+    """
+
+    __slots__ = ("expression", "_steps", "is_singular")
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        self._steps = _parse(expression)
+        self.is_singular = WILDCARD not in self._steps
+
+    def find(self, data: Any) -> List[Any]:
+        matches: List[Any] = [data]
+        for step in self._steps:
+            matches = _step(matches, step)
+            if not matches:
+                break
+        return matches
+
+    def get(self, data: Any, default: Any = None) -> Any:
+        """The value at this path (or ``default``) for a singular path,
+        the list of all matches for a path with wildcards."""
+        matches = self.find(data)
+        if not self.is_singular:
+            return matches
+        return matches[0] if matches else default
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, PathQuery) and other.expression == self.expression
+
+    def __hash__(self) -> int:
+        return hash(self.expression)
+
+    def __repr__(self) -> str:
+        return f"PathQuery({self.expression!r})"
+
+
+@lru_cache(maxsize=MAX_COMPILED_QUERIES)
+def compile_query(expression: str) -> PathQuery:
+    return PathQuery(expression)
+
+
+class QueryCache:
+    """Evaluates path queries against one document, memoizing the results so
+    that queries shared by several checks only walk the document once.
+    The document must not be modified while the cache is in use. Every
+    caller gets its own list of matches."""
+
+    def __init__(self, data: Optional[Mapping[str, Any]]) -> None:
+        self._data = data
+        self._results: MutableMapping[PathQuery, List[Any]] = {}
+
+    def find(self, query: Union[str, PathQuery]) -> List[Any]:
+        if isinstance(query, str):
+            query = compile_query(query)
+        try:
+            matches = self._results[query]
+        except KeyError:
+            matches = self._results[query] = query.find(self._data)
+        return list(matches)
+
+    def get(self, query: Union[str, PathQuery], default: Any = None) -> Any:
+        if isinstance(query, str):
+            query = compile_query(query)
+        matches = self.find(query)
+        if not query.is_singular:
+            return matches
+        return matches[0] if matches else default
@@ -0,0 +1,171 @@
+import copy
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_READ_OPERATION_PREFIXES = ("Describe", "Get", "List")
+DEFAULT_READ_CACHE_TTL_SECONDS = 1.0
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.response: Optional[Any] = None
+
+
+# pylint: disable=too-many-instance-attributes
+class ReadCache:
+    """Coalesces identical read-only calls made at the same time, and caches
+    their responses so repeated reads do not reach AWS.
+
+    Operations whose name starts with one of ``read_prefixes`` are read-only.
+    Responses are kept for ``ttl`` seconds, and never beyond the invocation.
+    A handler that polls a resource until it stabilizes, or uses a waiter,
+    needs a ``ttl`` shorter than its polling interval. Any other operation on
+    a service drops the cached responses of that service, and keeps reads of
+    the service made while it runs out of the cache. Calls are keyed on
+    service, region, credentials, operation and parameters. Operations with
+    streaming responses are never cached.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_READ_CACHE_TTL_SECONDS,
+        read_prefixes: Sequence[str] = DEFAULT_READ_OPERATION_PREFIXES,
+    ) -> None:
+        if ttl is None or ttl <= 0:
+            # polling would otherwise see the same response forever
+            raise ValueError("The read cache ttl must be a positive number")
+        self.ttl = ttl
+        self.read_prefixes = tuple(read_prefixes)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: Dict[Tuple[Any, ...], Tuple[float, Any]] = {}
+        self._flights: Dict[Tuple[Any, ...], _Flight] = {}
+        # bumped by invalidation, so responses of reads that overlap it are
+        # not cached
+        self._generation = 0
+        self._service_generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def is_read(self, operation_name: str) -> bool:
+        return operation_name.startswith(self.read_prefixes)
+
+    def invalidate(self, service_name: Optional[str] = None) -> None:
+        with self._lock:
+            if service_name is None:
+                self._generation += 1
+                self._entries.clear()
+            else:
+                generation = self._service_generations.get(service_name, 0)
+                self._service_generations[service_name] = generation + 1
+                for key in [key for key in self._entries if key[0] == service_name]:
+                    del self._entries[key]
+
+    def start_invocation(self) -> None:
+        self.invalidate()
+
+    def _current_generation(self, service_name: str) -> Tuple[int, int]:
+        return (self._generation, self._service_generations.get(service_name, 0))
+
+    @staticmethod
+    def _key(client: Any, operation_name: str, api_params: Any) -> Tuple[Any, ...]:
+        # pylint: disable=protected-access
+        credentials = client._request_signer._credentials
+        access_key = (
+            credentials.get_frozen_credentials().access_key if credentials else None
+        )
+        return (
+            client.meta.service_model.service_name,
+            client.meta.region_name,
+            access_key,
+            operation_name,
+            json.dumps(api_params, sort_keys=True, default=repr),
+        )
+
+    def _lookup(
+        self, key: Tuple[Any, ...]
+    ) -> Tuple[Optional[Any], Tuple[Any, ...], _Flight, bool]:
+        """The cached response, or the flight of the call to wait for or to
+        make, its key, and whether the caller makes it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() < entry[0]:
+                self.hits += 1
+                return entry[1], key, _Flight(), False
+            # calls started before an invalidation are not joined
+            flight_key = key + self._current_generation(key[0])
+            flight = self._flights.get(flight_key)
+            if flight:
+                self.coalesced += 1
+                return None, flight_key, flight, False
+            self.misses += 1
+            flight = self._flights[flight_key] = _Flight()
+            return None, flight_key, flight, True
+
+    def _mutate(
+        self,
+        service_name: str,
+        make_api_call: Callable[[str, Any], Any],
+        operation_name: str,
+        api_params: Any,
+    ) -> Any:
+        # reads made while the call runs may see the state before it
+        self.invalidate(service_name)
+        try:
+            return make_api_call(operation_name, api_params)
+        finally:
+            self.invalidate(service_name)
+
+    def call(
+        self,
+        client: Any,
+        make_api_call: Callable[[str, Any], Any],
+        operation_name: str,
+        api_params: Any,
+    ) -> Any:
+        service_model = client.meta.service_model
+        if not self.is_read(operation_name):
+            return self._mutate(
+                service_model.service_name, make_api_call, operation_name, api_params
+            )
+        if service_model.operation_model(operation_name).has_streaming_output:
+            return make_api_call(operation_name, api_params)
+
+        key = self._key(client, operation_name, api_params)
+        response, flight_key, flight, leader = self._lookup(key)
+        if response is not None:
+            return copy.deepcopy(response)
+        if not leader:
+            flight.done.wait()
+            if flight.response is None:
+                # errors are not shared, the call is made again
+                return make_api_call(operation_name, api_params)
+            return copy.deepcopy(flight.response)
+
+        try:
+            response = make_api_call(operation_name, api_params)
+            with self._lock:
+                if key + self._current_generation(key[0]) == flight_key:
+                    self._entries[key] = (time.monotonic() + self.ttl, response)
+            flight.response = response
+            return copy.deepcopy(response)
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+            flight.done.set()
+
+
+def cache_reads(client: Any, cache: ReadCache) -> None:
+    """Sends the calls of ``client`` through ``cache``."""
+    make_api_call = client._make_api_call  # pylint: disable=protected-access
+
+    def _make_api_call(operation_name: str, api_params: Any) -> Any:
+        return cache.call(client, make_api_call, operation_name, api_params)
+
+    client._make_api_call = _make_api_call  # pylint: disable=protected-access
@@ -0,0 +1,315 @@
+import base64
+import json
+import logging
+import threading
+import time
+from botocore.awsrequest import AWSResponse  # type: ignore
+from botocore.config import Config  # type: ignore
+from botocore.response import StreamingBody  # type: ignore
+from datetime import datetime
+from io import BytesIO
+from pathlib import Path
+from typing import Any, List, Mapping, MutableMapping, Optional, Tuple, Union
+
+from .boto3_proxy import (
+    SessionFactory,
+    SessionProxy,
+    _create_session,
+    _get_boto_session,
+)
+from .utils import Credentials
+
+LOG = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+
+class ReplayError(Exception):
+    pass
+
+
+class _StreamedBytes(bytes):
+    """The content of a streaming response body."""
+
+
+def _encode(value: Any) -> Any:  # pylint: disable=too-many-return-statements
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, _StreamedBytes):
+        return {"__stream__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, Mapping):
+        return {str(key): _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return {"__repr__": repr(value)}
+
+
+def _decode(value: Any) -> Any:  # pylint: disable=too-many-return-statements
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    if "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    if "__stream__" in value:
+        body = base64.b64decode(value["__stream__"])
+        return StreamingBody(BytesIO(body), len(body))
+    if "__repr__" in value:
+        return value["__repr__"]
+    return {key: _decode(item) for key, item in value.items()}
+
+
+def _buffer_streaming_bodies(parsed: MutableMapping[str, Any]) -> Mapping[str, Any]:
+    """Reads streaming bodies so they can be recorded. A body can only be read
+    once, so the handler is given a buffered copy in its place."""
+    recorded = dict(parsed)
+    for key, value in parsed.items():
+        if isinstance(value, StreamingBody):
+            body = recorded[key] = _StreamedBytes(value.read())
+            parsed[key] = StreamingBody(BytesIO(body), len(body))
+    return recorded
+
+
+class Cassette:
+    """botocore request/response pairs stored in a JSON file, so handlers can
+    be run against recorded AWS responses without network access.
+
+    Interactions are matched on service, operation and API parameters, and
+    replayed in the order they were recorded. Only responses that were
+    received are recorded: connection errors and timeouts are not. Only the
+    calls of the handler are recorded, not those the library makes with the
+    provider session.
+
+    Recorded interactions are written to the file when the cassette is used
+    as a context manager and exits, or by calling ``save``.
+    """
+
+    def __init__(self, path: Union[str, Path], match_params: bool = True) -> None:
+        self.path = Path(path)
+        self.match_params = match_params
+        self.interactions: List[MutableMapping[str, Any]] = []
+        self._lock = threading.Lock()
+        self._unsaved = False
+        if self.path.exists():
+            self.load()
+
+    def __enter__(self) -> "Cassette":
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        if self._unsaved:
+            self.save()
+
+    def load(self) -> None:
+        with self.path.open(encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CASSETTE_VERSION:
+            raise ReplayError(
+                f"Unsupported cassette version {data.get('version')} in {self.path}"
+            )
+        self.interactions = data["interactions"]
+
+    def save(self) -> None:
+        with self._lock:
+            data = {"version": CASSETTE_VERSION, "interactions": self.interactions}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            self._unsaved = False
+
+    def record(  # pylint: disable=too-many-arguments
+        self,
+        service: str,
+        operation: str,
+        params: Any,
+        *,
+        status_code: int,
+        parsed: Mapping[str, Any],
+        duration_ms: float,
+    ) -> None:
+        interaction = {
+            "service": service,
+            "operation": operation,
+            "params": params,
+            "statusCode": status_code,
+            "response": _encode(parsed),
+            "durationMs": duration_ms,
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+            self._unsaved = True
+
+    def match_key(self, service: str, operation: str, params: Any) -> Tuple[str, ...]:
+        """``params`` are the encoded API parameters of the call."""
+        if self.match_params:
+            return (service, operation, json.dumps(params, sort_keys=True))
+        return (service, operation)
+
+    def playback(self) -> MutableMapping[Tuple[str, ...], List[Mapping[str, Any]]]:
+        """The recorded interactions grouped by match key, in recorded order."""
+        queues: MutableMapping[Tuple[str, ...], List[Mapping[str, Any]]] = {}
+        for interaction in self.interactions:
+            key = self.match_key(
+                interaction["service"],
+                interaction["operation"],
+                interaction["params"],
+            )
+            queues.setdefault(key, []).append(interaction)
+        return queues
+
+    def record_sessions(self) -> SessionFactory:
+        """A drop-in replacement for ``_get_boto_session`` whose sessions call
+        AWS and record every response to this cassette."""
+
+        def factory(
+            credentials: Optional[Credentials],
+            region: Optional[str] = None,
+            identity: Optional[str] = None,
+            client_config: Optional[Config] = None,
+            service_client_configs: Optional[Mapping[str, Config]] = None,
+        ) -> Optional[SessionProxy]:
+            if not credentials or not _is_handler_identity(identity):
+                return _get_boto_session(
+                    credentials, region, identity, client_config, service_client_configs
+                )
+            session = _create_session(credentials, region).session
+            return RecordingSessionProxy(
+                session,
+                self,
+                client_config=client_config,
+                service_client_configs=service_client_configs,
+            )
+
+        return factory
+
+    def replay_sessions(
+        self, latency: float = 0.0, recorded_latency: bool = False
+    ) -> SessionFactory:
+        """A drop-in replacement for ``_get_boto_session`` whose sessions
+        answer from this cassette without network access.
+
+        Each replayed call sleeps for ``latency`` seconds, plus the recorded
+        duration of the call if ``recorded_latency`` is set. Every session
+        replays the cassette from the start. The provider session of the
+        library is a regular session.
+        """
+
+        def factory(
+            credentials: Optional[Credentials],
+            region: Optional[str] = None,
+            identity: Optional[str] = None,
+            client_config: Optional[Config] = None,
+            service_client_configs: Optional[Mapping[str, Config]] = None,
+        ) -> Optional[SessionProxy]:
+            if not credentials or not _is_handler_identity(identity):
+                return _get_boto_session(
+                    credentials, region, identity, client_config, service_client_configs
+                )
+            session = _create_session(credentials, region).session
+            return ReplayingSessionProxy(
+                session,
+                self,
+                latency=latency,
+                recorded_latency=recorded_latency,
+                client_config=client_config,
+                service_client_configs=service_client_configs,
+            )
+
+        return factory
+
+
+def _is_handler_identity(identity: Optional[str]) -> bool:
+    # the test entrypoint creates the handler session without an identity
+    return identity in (None, "caller")
+
+
+def _store_params(params: Any, context: MutableMapping[str, Any], **_: Any) -> None:
+    # encoded right away, as later handlers may add parameters
+    context["cassette_params"] = _encode(params)
+    context["cassette_started"] = time.perf_counter()
+
+
+class RecordingSessionProxy(SessionProxy):
+    def __init__(
+        self,
+        session: Any,
+        cassette: Cassette,
+        *,
+        client_config: Optional[Config] = None,
+        service_client_configs: Optional[Mapping[str, Config]] = None,
+    ) -> None:
+        super().__init__(session, None, client_config, service_client_configs)
+        self.cassette = cassette
+        session.events.register("before-parameter-build", _store_params)
+        session.events.register("after-call", self._after_call)
+
+    def _after_call(
+        self,
+        http_response: Any,
+        parsed: MutableMapping[str, Any],
+        model: Any,
+        context: MutableMapping[str, Any],
+        **_: Any,
+    ) -> None:
+        duration_ms = (time.perf_counter() - context["cassette_started"]) * 1000.0
+        self.cassette.record(
+            model.service_model.service_name,
+            model.name,
+            context.get("cassette_params"),
+            status_code=http_response.status_code,
+            parsed=_buffer_streaming_bodies(parsed),
+            duration_ms=duration_ms,
+        )
+
+
+class ReplayingSessionProxy(SessionProxy):
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        session: Any,
+        cassette: Cassette,
+        *,
+        latency: float = 0.0,
+        recorded_latency: bool = False,
+        client_config: Optional[Config] = None,
+        service_client_configs: Optional[Mapping[str, Config]] = None,
+    ) -> None:
+        super().__init__(session, None, client_config, service_client_configs)
+        self.cassette = cassette
+        self.latency = latency
+        self.recorded_latency = recorded_latency
+        self._playback = cassette.playback()
+        self._playback_lock = threading.Lock()
+        session.events.register("before-parameter-build", _store_params)
+        session.events.register("before-call", self._before_call)
+
+    def _before_call(
+        self, model: Any, context: MutableMapping[str, Any], **_: Any
+    ) -> Tuple[AWSResponse, Any]:
+        service, operation = model.service_model.service_name, model.name
+        params = context.get("cassette_params")
+        key = self.cassette.match_key(service, operation, params)
+        with self._playback_lock:
+            try:
+                interaction = self._playback[key].pop(0)
+            except (KeyError, IndexError):
+                raise ReplayError(
+                    f"No recorded response left for {service}.{operation} "
+                    f"with parameters {json.dumps(params)} in {self.cassette.path}"
+                ) from None
+
+        delay = self.latency
+        if self.recorded_latency:
+            delay += interaction["durationMs"] / 1000.0
+        if delay > 0:
+            time.sleep(delay)
+
+        status_code = interaction["statusCode"]
+        http_response = AWSResponse(None, status_code, {}, None)
+        LOG.debug("Replaying %s.%s (%s)", service, operation, status_code)
+        return http_response, _decode(interaction["response"])
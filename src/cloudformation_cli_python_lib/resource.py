@@ -1,21 +1,43 @@
 import json
 import logging
 import traceback
+from botocore.config import Config  # type: ignore
+from contextlib import nullcontext
 from datetime import datetime
 from functools import wraps
-from typing import Any, Callable, MutableMapping, Optional, Tuple, Type, Union
+from typing import Any, Callable, Mapping, MutableMapping, Optional, Tuple, Type, Union
 
-from .boto3_proxy import SessionProxy, _get_boto_session
+from .boto3_proxy import SessionFactory, SessionProxy, _get_boto_session
+from .circuit_breaker import CircuitBreaker
 from .exceptions import InternalFailure, InvalidRequest, _HandlerError
 from .interface import (
     Action,
     BaseResourceHandlerRequest,
     HandlerErrorCode,
+    LogDelivery,
     OperationStatus,
     ProgressEvent,
 )
-from .log_delivery import ProviderLogHandler
-from .metrics import MetricsPublisherProxy
+from .invocation import _InvocationMixin
+from .log_delivery import (
+    LogSampler,
+    LogShippingConfig,
+    ProviderLogHandler,
+    StdoutLogHandler,
+    _resource_log_fields,
+    log_context,
+)
+from .metrics import (
+    BackgroundMetricsFlusher,
+    MetricsAggregator,
+    MetricsPublisherProxy,
+    MetricsSink,
+    _check_aggregated_sink,
+    handler_metrics,
+)
+from .profiling import SamplingProfiler
+from .read_cache import ReadCache
+from .tracing import api_call_trace
 from .utils import (
     BaseModel,
     Credentials,
@@ -55,13 +77,32 @@ def _ensure_serialize(
     return wrapper
 
 
-class Resource:
-    def __init__(
+# pylint: disable=too-many-instance-attributes
+class Resource(_InvocationMixin):
+    _stdout_log_handler_cls = StdoutLogHandler
+    _provider_log_handler_cls = ProviderLogHandler
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
         self,
         type_name: str,
         resouce_model_cls: Type[BaseModel],
         type_configuration_model_cls: Optional[Type[BaseModel]] = None,
         log_format: Optional[logging.Formatter] = None,
+        *,
+        client_config: Optional[Config] = None,
+        service_client_configs: Optional[Mapping[str, Config]] = None,
+        session_factory: Optional[SessionFactory] = None,
+        metrics_sink: Optional[MetricsSink] = None,
+        metrics_flusher: Optional[BackgroundMetricsFlusher] = None,
+        metrics_aggregator: Optional[MetricsAggregator] = None,
+        log_shipping: Optional[LogShippingConfig] = None,
+        log_delivery: LogDelivery = LogDelivery.CLOUDWATCH_LOGS,
+        log_sampler: Optional[LogSampler] = None,
+        trace_api_calls: bool = False,
+        metrics_breaker: Optional[CircuitBreaker] = None,
+        logs_breaker: Optional[CircuitBreaker] = None,
+        read_cache: Optional[ReadCache] = None,
+        profiler: Optional[SamplingProfiler] = None,
     ) -> None:
         self.type_name = type_name
         self._model_cls: Type[BaseModel] = resouce_model_cls
@@ -70,6 +111,21 @@ class Resource:
         ] = type_configuration_model_cls
         self._handlers: MutableMapping[Action, HandlerSignature] = {}
         self.log_format = log_format
+        self.client_config = client_config
+        self.service_client_configs = service_client_configs
+        self.session_factory = session_factory
+        self.metrics_sink = metrics_sink
+        self.metrics_flusher = metrics_flusher
+        _check_aggregated_sink(metrics_sink, metrics_aggregator)
+        self.metrics_aggregator = metrics_aggregator
+        self.log_shipping = log_shipping
+        self.log_delivery = log_delivery
+        self.log_sampler = log_sampler
+        self.trace_api_calls = trace_api_calls
+        self.metrics_breaker = metrics_breaker
+        self.logs_breaker = logs_breaker
+        self.read_cache = read_cache
+        self.profiler = profiler
 
     def handler(self, action: Action) -> Callable[[HandlerSignature], HandlerSignature]:
         def _add_handler(f: HandlerSignature) -> HandlerSignature:
@@ -91,13 +147,21 @@ class Resource:
             return ProgressEvent.failed(
                 HandlerErrorCode.InternalFailure, f"No handler for {action.name}"
             )
-        progress = handler(session, request, callback_context)
+        profile = self.profiler.profile(action.name) if self.profiler else nullcontext()
+        with profile:
+            progress = handler(session, request, callback_context)
         is_in_progress = progress.status == OperationStatus.IN_PROGRESS
         is_mutable = action in MUTATING_ACTIONS
         if is_in_progress and not is_mutable:
             raise InternalFailure("READ and LIST handlers must return synchronously.")
         return progress
 
+    def _get_session(
+        self, credentials: Optional[Credentials], **kwargs: Any
+    ) -> Optional[SessionProxy]:
+        session_factory = self.session_factory or _get_boto_session
+        return self._create_session(session_factory, credentials, **kwargs)
+
     def _parse_test_request(
         self, event_data: MutableMapping[str, Any]
     ) -> Tuple[
@@ -113,7 +177,7 @@ class Resource:
                 **event.request
             ).to_modelled(self._model_cls, self._type_configuration_model_cls)
 
-            session = _get_boto_session(creds, event.region)
+            session = self._get_session(creds, region=event.region)
             action = Action[event.action]
         except Exception as e:  # pylint: disable=broad-except
             LOG.exception("Invalid request")
@@ -137,9 +201,8 @@ class Resource:
             LOG.critical("Base exception caught (this is usually bad)", exc_info=True)
         return ProgressEvent.failed(HandlerErrorCode.InternalFailure, msg)
 
-    @staticmethod
     def _parse_request(
-        event_data: MutableMapping[str, Any]
+        self, event_data: MutableMapping[str, Any]
     ) -> Tuple[
         Tuple[Optional[SessionProxy], Optional[SessionProxy]],
         Action,
@@ -148,8 +211,14 @@ class Resource:
     ]:
         try:
             event = HandlerRequest.deserialize(event_data)
-            caller_sess = _get_boto_session(event.requestData.callerCredentials)
-            provider_sess = _get_boto_session(event.requestData.providerCredentials)
+            caller_sess = self._get_session(
+                event.requestData.callerCredentials, identity="caller"
+            )
+            provider_sess = self._get_session(
+                event.requestData.providerCredentials,
+                identity="provider",
+                account_id=event.awsAccountId,
+            )
             # credentials are used when rescheduling, so can't zero them out (for now)
             action = Action[event.action]
             callback_context = event.callbackContext or {}
@@ -190,6 +259,7 @@ class Resource:
         self, event_data: MutableMapping[str, Any], context: LambdaContext
     ) -> MutableMapping[str, Any]:
         logs_setup = False
+        log_handler: Optional[logging.Handler] = None
 
         def print_or_log(message: str) -> None:
             if logs_setup:
@@ -198,28 +268,43 @@ class Resource:
                 print(message)
                 traceback.print_exc()
 
+        metrics = MetricsPublisherProxy(
+            self.metrics_flusher, self.metrics_aggregator, self.metrics_breaker
+        )
         try:
             sessions, action, callback, event = self._parse_request(event_data)
             caller_sess, provider_sess = sessions
 
             request = self._cast_resource_request(event)
 
-            metrics = MetricsPublisherProxy()
+            log_handler = self._setup_logging(event, provider_sess)
+            logs_setup = log_handler is not None
             if event.requestData.providerLogGroupName and provider_sess:
-                ProviderLogHandler.setup(event, provider_sess, self.log_format)
-                logs_setup = True
-                metrics.add_metrics_publisher(provider_sess, event.resourceType)
+                metrics.add_metrics_publisher(
+                    provider_sess, event.resourceType, self.metrics_sink
+                )
+            elif self.metrics_sink:
+                metrics.add_metrics_publisher(
+                    None, event.resourceType, self.metrics_sink
+                )
 
             metrics.publish_invocation_metric(datetime.utcnow(), action)
             start_time = datetime.utcnow()
             error = None
 
             try:
-                progress = self._invoke_handler(caller_sess, request, action, callback)
+                with handler_metrics(metrics, action), log_context(
+                    _resource_log_fields(event)
+                ), api_call_trace() as trace:
+                    progress = self._invoke_handler(
+                        caller_sess, request, action, callback
+                    )
             except Exception as e:  # pylint: disable=broad-except
                 error = e
             m_secs = (datetime.utcnow() - start_time).total_seconds() * 1000.0
             metrics.publish_duration_metric(datetime.utcnow(), action, m_secs)
+            metrics.publish_api_call_metrics(datetime.utcnow(), action, trace)
+            trace.log_summary()
             if error:
                 metrics.publish_exception_metric(datetime.utcnow(), action, error)
                 raise error
@@ -233,6 +318,8 @@ class Resource:
             print_or_log(f"Base exception caught (this is usually bad) {e}")
             progress = ProgressEvent.failed(HandlerErrorCode.InternalFailure)
 
+        self._flush_invocation(metrics, log_handler, context)
+
         if progress.result:  # pragma: no cover
             progress.result = None
         if progress.annotations:  # pragma: no cover
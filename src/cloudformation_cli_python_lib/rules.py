@@ -0,0 +1,261 @@
+from dataclasses import dataclass, field
+
+import logging
+import threading
+import time
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+)
+from fnmatch import fnmatchcase
+from typing import Any, Callable, List, Mapping, Optional, Sequence, Tuple
+
+from .interface import (
+    BaseHookHandlerRequest,
+    BaseModel,
+    HandlerErrorCode,
+    HookAnnotation,
+    HookAnnotationSeverityLevel,
+    HookAnnotationStatus,
+    HookContext,
+    OperationStatus,
+    ProgressEvent,
+)
+from .query import PathQuery, compile_query
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_RULE_TIMEOUT_SECONDS = 5.0
+MAX_RULE_WORKERS = 16
+RULE_START_POLL_SECONDS = 0.05
+
+# a rule returns None when the target is compliant, or a failure message
+RuleSignature = Callable[
+    [BaseHookHandlerRequest, Mapping[str, Any], Optional[BaseModel]], Optional[str]
+]
+
+
+# pylint: disable=too-many-instance-attributes
+@dataclass
+class HookRule:
+    name: str
+    check: RuleSignature
+    target_types: Sequence[str] = ("*",)
+    paths: Sequence[str] = ()
+    timeout: float = DEFAULT_RULE_TIMEOUT_SECONDS
+    severity: Optional[HookAnnotationSeverityLevel] = None
+    remediation_message: Optional[str] = None
+    remediation_link: Optional[str] = None
+    _queries: Tuple[PathQuery, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # rules are registered at import time, so paths are compiled only once
+        self._queries = tuple(compile_query(path) for path in self.paths)
+
+    def applies_to(self, hook_context: HookContext) -> bool:
+        targets = (hook_context.targetType, hook_context.targetName)
+        return any(
+            fnmatchcase(target, pattern)
+            for target in targets
+            if target
+            for pattern in self.target_types
+        )
+
+    def resolve(self, hook_context: HookContext) -> Mapping[str, Any]:
+        return {query.expression: hook_context.query(query) for query in self._queries}
+
+    def annotation(
+        self, status: HookAnnotationStatus, message: Optional[str] = None
+    ) -> HookAnnotation:
+        failed = status == HookAnnotationStatus.FAILED
+        return HookAnnotation(
+            annotationName=self.name,
+            status=status,
+            statusMessage=message,
+            remediationMessage=self.remediation_message if failed else None,
+            remediationLink=self.remediation_link if failed else None,
+            severityLevel=self.severity,
+        )
+
+
+@dataclass
+class RuleResult:
+    annotation: HookAnnotation
+    duration_ms: float
+
+
+@dataclass
+class RuleEvaluation:
+    results: List[RuleResult]
+
+    @property
+    def annotations(self) -> List[HookAnnotation]:
+        return [result.annotation for result in self.results]
+
+    @property
+    def timings(self) -> Mapping[str, float]:
+        return {
+            result.annotation.annotationName: result.duration_ms
+            for result in self.results
+        }
+
+    @property
+    def failed(self) -> List[HookAnnotation]:
+        return [
+            annotation
+            for annotation in self.annotations
+            if annotation.status == HookAnnotationStatus.FAILED
+        ]
+
+    def to_progress_event(self) -> ProgressEvent:
+        failed = self.failed
+        if not failed:
+            return ProgressEvent(
+                status=OperationStatus.SUCCESS, annotations=self.annotations
+            )
+        names = ", ".join(annotation.annotationName for annotation in failed)
+        return ProgressEvent(
+            status=OperationStatus.FAILED,
+            errorCode=HandlerErrorCode.NonCompliant,
+            message=f"{len(failed)} of {len(self.results)} rules failed: {names}",
+            annotations=self.annotations,
+        )
+
+
+# the failure message (if any) and duration in milliseconds of a rule
+_RuleOutcome = Tuple[Optional[str], float]
+
+
+class _RuleRun:
+    """A rule submitted to the worker pool. Its timeout runs from the moment
+    a worker starts it, not from when it was queued."""
+
+    def __init__(self, rule: HookRule) -> None:
+        self.rule = rule
+        self.started = threading.Event()
+        self.start = 0.0
+
+    def timed_out(self) -> RuleResult:
+        return RuleResult(
+            self.rule.annotation(
+                HookAnnotationStatus.FAILED,
+                f"Rule timed out after {self.rule.timeout} seconds",
+            ),
+            self.rule.timeout * 1000.0,
+        )
+
+
+class RuleEngine:
+    """Runs the rules that apply to a hook target concurrently, and collects
+    their outcomes as hook annotations.
+
+    A rule that raises, or does not finish within its timeout, is reported as
+    FAILED. Timed out rules cannot be interrupted, they are left to finish in
+    the background and their result is discarded. Rules queued behind busy
+    workers start their timeout when they start running; a rule that cannot
+    start because every worker is held by a timed out rule is reported as
+    timed out too.
+    """
+
+    def __init__(
+        self, rules: Sequence[HookRule], max_workers: int = MAX_RULE_WORKERS
+    ) -> None:
+        self._rules = rules
+        self._max_workers = max_workers
+
+    def evaluate(
+        self,
+        request: BaseHookHandlerRequest,
+        type_configuration: Optional[BaseModel],
+    ) -> RuleEvaluation:
+        rules = [rule for rule in self._rules if rule.applies_to(request.hookContext)]
+        if not rules:
+            return RuleEvaluation([])
+
+        workers = min(len(rules), self._max_workers)
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="hook-rule"
+        )
+        try:
+            runs = [_RuleRun(rule) for rule in rules]
+            submitted = [
+                (run, executor.submit(self._run, run, request, type_configuration))
+                for run in runs
+            ]
+            timed_out: List["Future[_RuleOutcome]"] = []
+            results = [
+                self._collect(run, future, timed_out, workers)
+                for run, future in submitted
+            ]
+        finally:
+            executor.shutdown(wait=False)
+
+        for result in results:
+            LOG.debug(
+                "Rule %s: %s in %.2f ms",
+                result.annotation.annotationName,
+                result.annotation.status.name,
+                result.duration_ms,
+            )
+        return RuleEvaluation(results)
+
+    @staticmethod
+    def _run(
+        run: _RuleRun,
+        request: BaseHookHandlerRequest,
+        type_configuration: Optional[BaseModel],
+    ) -> _RuleOutcome:
+        run.start = time.perf_counter()
+        run.started.set()
+        rule = run.rule
+        message = rule.check(
+            request, rule.resolve(request.hookContext), type_configuration
+        )
+        return message, (time.perf_counter() - run.start) * 1000.0
+
+    @staticmethod
+    def _wait_until_started(
+        run: _RuleRun, timed_out: List["Future[_RuleOutcome]"], workers: int
+    ) -> bool:
+        # runs are started in order, so every run that holds a worker has
+        # already been collected. once they all timed out and are still
+        # running, the pool is stuck and this run will never start
+        while not run.started.wait(RULE_START_POLL_SECONDS):
+            if sum(future.running() for future in timed_out) >= workers:
+                return False
+        return True
+
+    @classmethod
+    def _collect(
+        cls,
+        run: _RuleRun,
+        future: "Future[_RuleOutcome]",
+        timed_out: List["Future[_RuleOutcome]"],
+        workers: int,
+    ) -> RuleResult:
+        rule = run.rule
+        if not cls._wait_until_started(run, timed_out, workers) and future.cancel():
+            return run.timed_out()
+        run.started.wait()
+        remaining = rule.timeout - (time.perf_counter() - run.start)
+        try:
+            message, duration_ms = future.result(timeout=max(remaining, 0.0))
+        except FutureTimeoutError:
+            timed_out.append(future)
+            return run.timed_out()
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception("Rule %s raised an exception", rule.name)
+            return RuleResult(
+                rule.annotation(
+                    HookAnnotationStatus.FAILED,
+                    f"Rule raised an exception: {e} ({type(e).__name__})",
+                ),
+                (time.perf_counter() - run.start) * 1000.0,
+            )
+
+        if message is None:
+            return RuleResult(rule.annotation(HookAnnotationStatus.PASSED), duration_ms)
+        return RuleResult(
+            rule.annotation(HookAnnotationStatus.FAILED, message), duration_ms
+        )
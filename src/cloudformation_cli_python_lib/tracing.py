@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Mapping, MutableMapping, Optional
+
+LOG = logging.getLogger(__name__)
+
+
+@dataclass
+class ApiCall:
+    service: str
+    operation: str
+    duration_ms: float
+    retries: int
+    status_code: Optional[int]
+
+
+class ApiCallTrace:
+    """The AWS API calls made while handling one invocation."""
+
+    def __init__(self) -> None:
+        self._calls: List[ApiCall] = []
+        self._lock = threading.Lock()
+
+    def record(self, call: ApiCall) -> None:
+        with self._lock:
+            self._calls.append(call)
+
+    @property
+    def calls(self) -> List[ApiCall]:
+        with self._lock:
+            return list(self._calls)
+
+    @property
+    def duration_ms(self) -> float:
+        return sum(call.duration_ms for call in self.calls)
+
+    @property
+    def retries(self) -> int:
+        return sum(call.retries for call in self.calls)
+
+    def summary(self) -> Mapping[str, Mapping[str, Any]]:
+        """Call count, total duration, retries and errors per operation,
+        keyed by ``service.Operation``."""
+        operations: Dict[str, Dict[str, Any]] = {}
+        for call in self.calls:
+            operation = operations.setdefault(
+                f"{call.service}.{call.operation}",
+                {"count": 0, "durationMs": 0.0, "retries": 0, "errors": 0},
+            )
+            operation["count"] += 1
+            operation["durationMs"] += call.duration_ms
+            operation["retries"] += call.retries
+            if call.status_code is None or call.status_code >= 300:
+                operation["errors"] += 1
+        return operations
+
+    def log_summary(self) -> None:
+        if self.calls:
+            LOG.info("AWS API calls: %s", json.dumps(self.summary(), sort_keys=True))
+
+
+_API_CALL_TRACE: ContextVar[Optional[ApiCallTrace]] = ContextVar(
+    "api_call_trace", default=None
+)
+
+
+def get_api_call_trace() -> ApiCallTrace:
+    """The trace of the invocation being handled. Calls are only traced when
+    the type traces API calls. Outside of an invocation, the trace is empty."""
+    return _API_CALL_TRACE.get() or ApiCallTrace()
+
+
+@contextmanager
+def api_call_trace() -> Iterator[ApiCallTrace]:
+    trace = ApiCallTrace()
+    token = _API_CALL_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _API_CALL_TRACE.reset(token)
+
+
+def _before_call(context: MutableMapping[str, Any], **_: Any) -> None:
+    context["trace_started"] = time.perf_counter()
+
+
+def _needs_retry(attempts: int, request_dict: Mapping[str, Any], **_: Any) -> None:
+    # emitted after every attempt, including the last one
+    request_dict["context"]["trace_attempts"] = attempts
+
+
+def _after_call(
+    http_response: Any, model: Any, context: MutableMapping[str, Any], **_: Any
+) -> None:
+    trace = _API_CALL_TRACE.get()
+    started = context.get("trace_started")
+    if trace is None or started is None:
+        return
+    trace.record(
+        ApiCall(
+            service=model.service_model.service_name,
+            operation=model.name,
+            duration_ms=(time.perf_counter() - started) * 1000.0,
+            retries=max(context.get("trace_attempts", 1) - 1, 0),
+            status_code=getattr(http_response, "status_code", None),
+        )
+    )
+
+
+def instrument_client(client: Any) -> None:
+    """Records the calls of ``client`` in the trace of the invocation that
+    makes them. Calls that fail without a response, such as connection
+    errors, are not recorded."""
+    events = client.meta.events
+    # first and as specific as any other handler, as a handler that answers
+    # the call (like a stubber) stops the event
+    events.register_first("before-call.*.*", _before_call)
+    events.register("needs-retry", _needs_retry)
+    events.register("after-call", _after_call)
@@ -3,6 +3,7 @@ from dataclasses import dataclass, field, fields
 
 import json
 import requests  # type: ignore
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import date, datetime, time
 from requests.adapters import HTTPAdapter  # type: ignore
 from typing import (
@@ -33,6 +34,10 @@ HOOK_REMOTE_PAYLOAD_CONNECT_AND_READ_TIMEOUT_SECONDS = 10
 HOOK_REMOTE_PAYLOAD_RETRY_LIMIT = 3
 HOOK_REMOTE_PAYLOAD_RETRY_BACKOFF_FACTOR = 1
 HOOK_REMOTE_PAYLOAD_RETRY_STATUSES = [500, 502, 503, 504]
+HOOK_REMOTE_PAYLOAD_MAX_SIZE_BYTES = 32 * 1024 * 1024
+HOOK_REMOTE_PAYLOAD_CHUNK_SIZE_BYTES = 64 * 1024
+# time left for returning the response after draining queued metrics and logs
+DRAIN_DEADLINE_MARGIN_SECONDS = 0.5
 
 
 class KitchenSinkEncoder(json.JSONEncoder):
@@ -227,15 +232,23 @@ class HookRequestData:
     callerCredentials: Optional[Credentials] = None
     providerCredentials: Optional[Credentials] = None
     providerLogGroupName: Optional[str] = None
+    _remote_payload: Optional["Future[Optional[Mapping[str, Any]]]"] = field(
+        default=None, init=False, repr=False, compare=False
+    )
 
     def __init__(self, **kwargs: Any) -> None:
-        dataclass_fields = {f.name for f in fields(self)}
+        dataclass_fields = {f.name for f in fields(self) if f.init}
         for k, v in kwargs.items():
             if k in dataclass_fields:
                 setattr(self, k, v)
 
     @classmethod
-    def deserialize(cls, json_data: MutableMapping[str, Any]) -> "HookRequestData":
+    def deserialize(
+        cls,
+        json_data: MutableMapping[str, Any],
+        max_payload_size: int = HOOK_REMOTE_PAYLOAD_MAX_SIZE_BYTES,
+        defer_remote_payload: bool = False,
+    ) -> "HookRequestData":
         req_data = HookRequestData(**json_data)
         for key in json_data:
             if not key.endswith("Credentials"):
@@ -246,30 +259,31 @@ class HookRequestData:
                 setattr(req_data, key, Credentials(**cred_data))
 
         if req_data.is_hook_invocation_payload_remote():
-            with requests.Session() as s:
-                retries = Retry(
-                    total=HOOK_REMOTE_PAYLOAD_RETRY_LIMIT,
-                    backoff_factor=HOOK_REMOTE_PAYLOAD_RETRY_BACKOFF_FACTOR,
-                    status_forcelist=HOOK_REMOTE_PAYLOAD_RETRY_STATUSES,
-                )
-
-                s.mount("http://", HTTPAdapter(max_retries=retries))
-                s.mount("https://", HTTPAdapter(max_retries=retries))
-
-                response = s.get(
-                    req_data.payload,
-                    timeout=HOOK_REMOTE_PAYLOAD_CONNECT_AND_READ_TIMEOUT_SECONDS,
-                )
-
-                if response.status_code == 200:
-                    setattr(
-                        req_data,
-                        HOOK_REQUEST_DATA_TARGET_MODEL_FIELD_NAME,
-                        response.json(),
-                    )
+            req_data._remote_payload = _fetch_remote_payload_in_background(
+                str(req_data.payload), max_payload_size
+            )
+            if not defer_remote_payload:
+                req_data.resolve_remote_payload()
 
         return req_data
 
+    def resolve_remote_payload(self) -> Optional[Mapping[str, Any]]:
+        """Wait for a remote payload download started by ``deserialize`` (if any)
+        and use it as the target model. Download errors are re-raised here."""
+        future, self._remote_payload = self._remote_payload, None
+        if future is not None:
+            target_model = future.result()
+            if target_model is not None:
+                setattr(self, HOOK_REQUEST_DATA_TARGET_MODEL_FIELD_NAME, target_model)
+        return self.targetModel
+
+    def discard_remote_payload(self) -> None:
+        """Cancel a remote payload download that is no longer needed. A
+        download that already started is left to finish in the background."""
+        future, self._remote_payload = self._remote_payload, None
+        if future is not None:
+            future.cancel()
+
     def serialize(self) -> Mapping[str, Any]:
         return {
             key: {k: v for k, v in value.items() if v is not None}
@@ -278,7 +292,7 @@ class HookRequestData:
             if key.endswith("Credentials")
             else value
             for key, value in self.__dict__.items()
-            if value is not None
+            if value is not None and not key.startswith("_")
         }
 
     def is_hook_invocation_payload_remote(self) -> bool:
@@ -290,6 +304,73 @@ class HookRequestData:
         return False
 
 
+def _fetch_remote_payload_in_background(
+    url: str, max_payload_size: int
+) -> "Future[Optional[Mapping[str, Any]]]":
+    """Start downloading a remote payload, so the fetch can overlap with the
+    rest of the invocation setup. Each download gets its own worker, so one
+    left behind by a failed invocation never delays the next invocation."""
+    executor = ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="hook-remote-payload"
+    )
+    try:
+        return executor.submit(_fetch_remote_payload, url, max_payload_size)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _fetch_remote_payload(
+    url: str, max_payload_size: int
+) -> Optional[Mapping[str, Any]]:
+    """Download and decode a remote hook payload of at most
+    ``max_payload_size`` bytes. The body is streamed so that a payload over
+    the cap is rejected without being read in full. It is still decoded in
+    one go, so memory peaks at the body and its text, then at the text and
+    the decoded payload. Returns ``None`` if the payload could not be
+    retrieved."""
+    with requests.Session() as s:
+        retries = Retry(
+            total=HOOK_REMOTE_PAYLOAD_RETRY_LIMIT,
+            backoff_factor=HOOK_REMOTE_PAYLOAD_RETRY_BACKOFF_FACTOR,
+            status_forcelist=HOOK_REMOTE_PAYLOAD_RETRY_STATUSES,
+        )
+
+        s.mount("http://", HTTPAdapter(max_retries=retries))
+        s.mount("https://", HTTPAdapter(max_retries=retries))
+
+        with s.get(
+            url,
+            timeout=HOOK_REMOTE_PAYLOAD_CONNECT_AND_READ_TIMEOUT_SECONDS,
+            stream=True,
+        ) as response:
+            if response.status_code != 200:
+                return None
+
+            content_length = response.headers.get("Content-Length")
+            if content_length and int(content_length) > max_payload_size:
+                raise InvalidRequest(
+                    f"Remote hook payload of {content_length} bytes exceeds the "
+                    f"maximum of {max_payload_size} bytes"
+                )
+
+            body = bytearray()
+            for chunk in response.iter_content(
+                chunk_size=HOOK_REMOTE_PAYLOAD_CHUNK_SIZE_BYTES
+            ):
+                body += chunk
+                if len(body) > max_payload_size:
+                    raise InvalidRequest(
+                        "Remote hook payload exceeds the maximum of "
+                        f"{max_payload_size} bytes"
+                    )
+
+    # the body is released before the text is parsed
+    text = body.decode(json.detect_encoding(body), "surrogatepass")
+    del body
+    payload: Mapping[str, Any] = json.loads(text)
+    return payload
+
+
 @dataclass
 class HookInvocationRequest:
     awsAccountId: str
@@ -310,10 +391,15 @@ class HookInvocationRequest:
                 setattr(self, k, v)
 
     @classmethod
-    def deserialize(cls, json_data: MutableMapping[str, Any]) -> Any:
+    def deserialize(
+        cls,
+        json_data: MutableMapping[str, Any],
+        max_payload_size: int = HOOK_REMOTE_PAYLOAD_MAX_SIZE_BYTES,
+        defer_remote_payload: bool = False,
+    ) -> Any:
         event = HookInvocationRequest(**json_data)
         event.requestData = HookRequestData.deserialize(
-            json_data.get("requestData", {})
+            json_data.get("requestData", {}), max_payload_size, defer_remote_payload
         )
         event.requestContext = HookRequestContext.deserialize(
             json_data.get("requestContext", {})
@@ -354,7 +440,9 @@ class UnmodelledHookRequest:
             if k in dataclass_fields:
                 setattr(self, k, v)
 
-    def to_modelled(self) -> BaseHookHandlerRequest:
+    def to_modelled(
+        self, target_model_type: Optional[Type[BaseModel]] = None
+    ) -> BaseHookHandlerRequest:
         return BaseHookHandlerRequest(
             clientRequestToken=self.clientRequestToken,
             hookContext=HookContext(
@@ -368,6 +456,7 @@ class UnmodelledHookRequest:
                 targetType=self.targetType,
                 targetLogicalId=self.targetLogicalId,
                 targetModel=self.targetModel,
+                targetModelType=target_model_type,
             ),
         )
 
@@ -377,6 +466,16 @@ class LambdaContext:
     invoked_function_arn: str
 
 
+def _drain_timeout(timeout: float, context: Optional[LambdaContext]) -> float:
+    """``timeout``, shortened so draining ends before the deadline of the
+    invocation."""
+    if context is not None:
+        remaining_ms = context.get_remaining_time_in_millis()  # type: ignore
+        remaining = remaining_ms / 1000.0
+        timeout = min(timeout, remaining - DRAIN_DEADLINE_MARGIN_SECONDS)
+    return max(timeout, 0.0)
+
+
 def deserialize_list(
     json_data: Union[List[Any], Dict[str, Any]], inner_dataclass: Any
 ) -> Optional[List[Any]]:
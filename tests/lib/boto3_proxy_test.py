@@ -1,7 +1,17 @@
+# pylint: disable=protected-access
+import pytest
 from boto3.session import Session
-from cloudformation_cli_python_lib.boto3_proxy import SessionProxy, _get_boto_session
+from cloudformation_cli_python_lib.boto3_proxy import (
+    SessionProxy,
+    _get_boto_session,
+    _SharedBotocoreComponents,
+)
 from cloudformation_cli_python_lib.utils import Credentials
 
+from botocore.config import Config
+from botocore.loaders import JSONFileLoader
+from unittest.mock import patch
+
 
 def test_get_boto_session_returns_proxy():
     proxy = _get_boto_session(Credentials("", "", ""))
@@ -17,3 +27,154 @@ def test_can_retrieve_boto_session():
     proxy = _get_boto_session(Credentials("", "", ""))
     session = proxy.session
     assert isinstance(session, Session)
+
+
+def test_sessions_share_botocore_components():
+    first = _get_boto_session(Credentials("a", "b", "c"), "us-east-1").session._session
+    second = _get_boto_session(Credentials("d", "e", "f"), "us-west-2").session._session
+
+    loader = first.get_component("data_loader")
+    assert second.get_component("data_loader") is loader
+    for name in ("endpoint_resolver", "exceptions_factory"):
+        assert second._get_internal_component(name) is first._get_internal_component(
+            name
+        )
+    # boto3 adds its data path for every session, it must only be there once
+    assert len(loader.search_paths) == len(set(loader.search_paths))
+
+
+def test_dedupe_search_paths_before_any_session():
+    components = _SharedBotocoreComponents()
+    components.dedupe_search_paths()
+    assert components._components is None
+
+
+def test_service_models_loaded_once_per_process():
+    creds = Credentials("a", "b", "c")
+    _get_boto_session(creds, "us-east-1").client("cloudwatch")
+
+    with patch.object(
+        JSONFileLoader, "load_file", side_effect=AssertionError("reloaded")
+    ):
+        client = _get_boto_session(creds, "eu-west-1").client("cloudwatch")
+
+    assert client.meta.region_name == "eu-west-1"
+
+
+def test_identity_session_swaps_credentials_and_keeps_clients():
+    first = Credentials("AKID1", "secret1", "token1")
+    second = Credentials("AKID2", "secret2", "token2")
+
+    proxy = _get_boto_session(first, "us-east-1", identity="test-swap")
+    client = proxy.client("cloudwatch")
+    assert proxy.client("cloudwatch") is client
+    signing_creds = client._request_signer._credentials
+    assert signing_creds.get_frozen_credentials().access_key == "AKID1"
+
+    assert _get_boto_session(second, "us-east-1", identity="test-swap") is proxy
+    assert proxy.client("cloudwatch") is client
+    frozen = signing_creds.get_frozen_credentials()
+    assert (frozen.access_key, frozen.secret_key, frozen.token) == (
+        "AKID2",
+        "secret2",
+        "token2",
+    )
+    assert proxy.session.get_credentials().access_key == "AKID2"
+
+
+def test_identity_session_client_cache_is_bounded():
+    proxy = _get_boto_session(Credentials("a", "b", "c"), "us-east-1", "test-bounded")
+    first = proxy.client("cloudwatch")
+    with patch("cloudformation_cli_python_lib.boto3_proxy.MAX_CACHED_CLIENTS", 2):
+        # a new config per call, as a handler creating it on every invocation
+        for _ in range(5):
+            proxy.client("s3", config=Config(read_timeout=3))
+            assert proxy.client("cloudwatch") is first
+        assert len(proxy._clients) == 2
+        proxy.client("logs")
+        proxy.client("s3", config=Config(read_timeout=3))
+    assert proxy.client("cloudwatch") is not first
+
+
+def test_identities_never_share_sessions():
+    caller = _get_boto_session(Credentials("a", "b", "c"), "us-east-1", "test-caller")
+    provider = _get_boto_session(
+        Credentials("d", "e", "f"), "us-east-1", "test-provider"
+    )
+    other_region = _get_boto_session(
+        Credentials("a", "b", "c"), "us-west-2", "test-caller"
+    )
+
+    assert caller is not provider
+    assert caller is not other_region
+    caller_creds = caller.session.get_credentials()
+    assert caller_creds.get_frozen_credentials().access_key == "a"
+    assert provider.session.get_credentials().get_frozen_credentials().access_key == (
+        "d"
+    )
+
+
+def test_identity_session_client_caching():
+    proxy = _get_boto_session(Credentials("a", "b", "c"), "us-east-1", "test-nocache")
+    explicit = proxy.client(
+        "cloudwatch", aws_access_key_id="x", aws_secret_access_key="y"
+    )
+    assert explicit is not proxy.client("cloudwatch")
+    assert explicit._request_signer._credentials.access_key == "x"
+
+    cached = proxy.client("cloudwatch", config=None, endpoint_url=None)
+    assert cached is proxy.client("cloudwatch", config=None, endpoint_url=None)
+    with patch.object(proxy.session, "client") as mock_client:
+        proxy.client("cloudwatch", unhashable_kwarg={})
+        proxy.client("cloudwatch", unhashable_kwarg={})
+    assert mock_client.call_count == 2
+
+
+def test_swap_credentials_requires_identity_session():
+    proxy = _get_boto_session(Credentials("a", "b", "c"), "us-east-1")
+    assert proxy.client("cloudwatch") is not proxy.client("cloudwatch")
+    with pytest.raises(ValueError):
+        proxy.swap_credentials(Credentials("d", "e", "f"))
+
+
+def test_client_config_merged_per_service():
+    proxy = _get_boto_session(
+        Credentials("a", "b", "c"),
+        "us-east-1",
+        client_config=Config(
+            max_pool_connections=50,
+            retries={"mode": "adaptive", "max_attempts": 5},
+            connect_timeout=2,
+            tcp_keepalive=True,
+        ),
+        service_client_configs={"logs": Config(read_timeout=3)},
+    )
+
+    config = proxy.client("cloudwatch").meta.config
+    assert config.max_pool_connections == 50
+    assert config.retries["mode"] == "adaptive"
+    assert (config.connect_timeout, config.read_timeout) == (2, 60)
+    assert config.tcp_keepalive
+
+    config = proxy.client("logs").meta.config
+    assert (config.connect_timeout, config.read_timeout) == (2, 3)
+
+    config = proxy.client("logs", config=Config(read_timeout=4)).meta.config
+    assert (config.max_pool_connections, config.read_timeout) == (50, 4)
+
+
+def test_identity_session_client_config_changes_reset_clients():
+    creds = Credentials("a", "b", "c")
+    config = Config(read_timeout=3)
+    proxy = _get_boto_session(creds, "us-east-1", "test-config", config)
+    client = proxy.client("cloudwatch", config=Config(connect_timeout=1))
+    assert client.meta.config.read_timeout == 3
+    assert proxy.client("cloudwatch") is proxy.client("cloudwatch")
+
+    assert _get_boto_session(creds, "us-east-1", "test-config", config) is proxy
+    cached = proxy.client("cloudwatch")
+    assert proxy.client("cloudwatch") is cached
+
+    _get_boto_session(creds, "us-east-1", "test-config", Config(read_timeout=5))
+    assert proxy.client("cloudwatch") is not cached
+    assert proxy.client("cloudwatch").meta.config.read_timeout == 5
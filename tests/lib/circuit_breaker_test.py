@@ -0,0 +1,80 @@
+# pylint: disable=redefined-outer-name
+import pytest
+from cloudformation_cli_python_lib.circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from cloudformation_cli_python_lib.interface import CircuitState
+
+from unittest.mock import Mock, patch
+
+
+@pytest.fixture
+def clock():
+    with patch(
+        "cloudformation_cli_python_lib.circuit_breaker.time.monotonic"
+    ) as monotonic:
+        monotonic.return_value = 100.0
+        yield monotonic
+
+
+def fail(breaker, times=1):
+    for _ in range(times):
+        with pytest.raises(ValueError):
+            breaker.call(Mock(side_effect=ValueError("failing")))
+
+
+@pytest.mark.usefixtures("clock")
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3)
+    fail(breaker, 2)
+    assert breaker.call(Mock(return_value="ok")) == "ok"
+    fail(breaker, 2)
+    assert breaker.state == CircuitState.CLOSED
+
+    fail(breaker)
+    assert breaker.state == CircuitState.OPEN
+    function = Mock()
+    with pytest.raises(CircuitOpenError):
+        breaker.call(function)
+    function.assert_not_called()
+    assert breaker.rejected == 1
+    assert breaker.state_changes == {CircuitState.OPEN: 1}
+
+
+def test_half_open_probe_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+    fail(breaker)
+    clock.return_value = 109.0
+    assert not breaker.allow()
+
+    clock.return_value = 110.0
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow()
+    # only one probe at a time
+    assert not breaker.allow()
+    breaker.record_success()
+
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow()
+    assert breaker.state_changes == {
+        CircuitState.OPEN: 1,
+        CircuitState.HALF_OPEN: 1,
+        CircuitState.CLOSED: 1,
+    }
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+    fail(breaker, 2)
+    clock.return_value = 110.0
+    fail(breaker)
+    assert breaker.state == CircuitState.OPEN
+
+    # the cool-down starts again
+    clock.return_value = 119.0
+    assert not breaker.allow()
+    clock.return_value = 120.0
+    assert breaker.call(Mock(return_value="ok")) == "ok"
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.state_changes[CircuitState.OPEN] == 2
@@ -1,4 +1,4 @@
-# pylint: disable=redefined-outer-name,protected-access,line-too-long
+# pylint: disable=redefined-outer-name,protected-access,line-too-long,too-many-lines
 from dataclasses import dataclass
 
 import pytest
@@ -11,8 +11,19 @@ from cloudformation_cli_python_lib.interface import (
     HookInvocationPoint,
     HookProgressEvent,
     HookStatus,
+    LogDelivery,
     OperationStatus,
     ProgressEvent,
+    StandardUnit,
+)
+from cloudformation_cli_python_lib.log_delivery import (
+    LogShippingConfig,
+    ProviderLogQueueHandler,
+)
+from cloudformation_cli_python_lib.metrics import (
+    HookMetricsPublisher,
+    MetricsAggregator,
+    get_handler_metrics,
 )
 from cloudformation_cli_python_lib.utils import (
     Credentials,
@@ -21,9 +32,11 @@ from cloudformation_cli_python_lib.utils import (
 )
 
 import json
+import threading
 from datetime import datetime
-from typing import Any, Mapping
-from unittest.mock import Mock, call, patch, sentinel
+from fnmatch import fnmatchcase
+from typing import Any, Iterator, Mapping
+from unittest.mock import ANY, MagicMock, Mock, call, create_autospec, patch, sentinel
 
 ENTRYPOINT_PAYLOAD = {
     "awsAccountId": "123456789012",
@@ -134,6 +147,85 @@ def test_entrypoint_success():
     mock_handler.assert_called_once()
 
 
+@pytest.mark.parametrize(
+    "target_types", [["AWS::Test::*"], ["RESOURCE"], ["AWS::Other::*", "*::Resource"]]
+)
+def test_entrypoint_supported_target(target_types):
+    hook = Hook(TYPE_NAME, Mock(), target_types=target_types)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    mock_handler = hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(
+        Mock(return_value=event)
+    )
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ), patch("cloudformation_cli_python_lib.hook._get_boto_session", autospec=True):
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_handler.assert_called_once()
+
+
+def test_entrypoint_unsupported_target_skipped():
+    hook = Hook(TYPE_NAME, Mock(), target_types=["AWS::S3::*", "STACK"])
+    mock_handler = hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock())
+
+    with patch.object(hook, "_parse_request") as mock_parse, patch(
+        "cloudformation_cli_python_lib.hook.fnmatchcase", wraps=fnmatchcase
+    ) as mock_match:
+        event = hook(ENTRYPOINT_PAYLOAD, None)
+        calls = mock_match.call_count
+        event_again = hook(ENTRYPOINT_PAYLOAD, None)
+
+    mock_parse.assert_not_called()
+    mock_handler.assert_not_called()
+    # the match result is cached per target
+    assert mock_match.call_count == calls
+    assert (
+        event
+        == event_again
+        == {
+            "hookStatus": HookStatus.SUCCESS.name,  # pylint: disable=no-member
+            "message": "Target is not supported by this hook, skipping",
+            "callbackDelaySeconds": 0,
+            "clientRequestToken": "4b90a7e4-b790-456b-a937-0cfdfa211dfe",
+        }
+    )
+
+
+def test_entrypoint_target_filter_ignores_malformed_request():
+    hook = Hook(TYPE_NAME, Mock(), target_types=["AWS::S3::*"])
+    with patch("cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"):
+        event = hook.__call__.__wrapped__(hook, {}, None)  # pylint: disable=no-member
+    assert event["errorCode"] == HandlerErrorCode.InvalidRequest
+
+
+def test_entrypoint_target_filter_leaves_unhashable_target_to_parser():
+    hook = Hook(TYPE_NAME, Mock(), target_types=["AWS::S3::*"])
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    mock_handler = hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(
+        Mock(return_value=event)
+    )
+    payload = ENTRYPOINT_PAYLOAD.copy()
+    payload["requestData"] = {**payload["requestData"], "targetName": ["AWS::S3::*"]}
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ), patch(
+        "cloudformation_cli_python_lib.hook._get_boto_session", autospec=True
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ):
+        event = hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, payload, None
+        )
+
+    mock_handler.assert_called_once()
+    assert event["hookStatus"] == HookStatus.SUCCESS.name  # pylint: disable=no-member
+    assert event["clientRequestToken"] == ENTRYPOINT_PAYLOAD["clientRequestToken"]
+
+
 def test_entrypoint_handler_raises():
     @dataclass
     class TypeConfigurationModel(BaseModel):
@@ -158,6 +250,7 @@ def test_entrypoint_handler_raises():
         )
 
     mock_metrics.return_value.publish_exception_metric.assert_called_once()
+    mock_metrics.return_value.flush.assert_called_once()
 
     assert event == {
         "errorCode": "InvalidRequest",
@@ -221,6 +314,258 @@ def test_entrypoint_success_without_caller_provider_creds():
         assert event == expected
 
 
+def test_entrypoint_metrics_sink_without_log_group():
+    mock_sink = Mock(spec_set=["put_metric_data"])
+    hook = Hook(TYPE_NAME, Mock(), metrics_sink=mock_sink)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+
+    payload = ENTRYPOINT_PAYLOAD.copy()
+    payload["requestData"] = payload["requestData"].copy()
+    payload["requestData"]["providerLogGroupName"] = None
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ), patch("cloudformation_cli_python_lib.hook._get_boto_session", autospec=True):
+        hook.__call__.__wrapped__(hook, payload, None)  # pylint: disable=no-member
+
+    mock_sink.put_metric_data.assert_called_once()
+    namespace, metric_data = mock_sink.put_metric_data.call_args[0]
+    assert namespace == HookMetricsPublisher._make_hook_namespace(
+        ENTRYPOINT_PAYLOAD["hookTypeName"], ENTRYPOINT_PAYLOAD["awsAccountId"]
+    )
+    assert [datum["MetricName"] for datum in metric_data] == [
+        "HandlerInvocationCount",
+        "HandlerInvocationDuration",
+    ]
+
+
+def test_entrypoint_handler_metrics():
+    hook = Hook(TYPE_NAME, Mock())
+
+    @hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)
+    def pre_create(_session, _request, _callback_context, _type_configuration):
+        get_handler_metrics().publish("ItemsChecked", 2)
+        return ProgressEvent(status=OperationStatus.SUCCESS, message="")
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ), patch(
+        "cloudformation_cli_python_lib.hook._get_boto_session", autospec=True
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ) as mock_metrics:
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_metrics.return_value.publish_custom_metric.assert_called_once_with(
+        ANY,
+        HookInvocationPoint.CREATE_PRE_PROVISION,
+        "ItemsChecked",
+        2,
+        unit=StandardUnit.Count,
+        dimensions=None,
+    )
+
+
+def test_entrypoint_drains_queued_logs():
+    shipping = LogShippingConfig()
+    hook = Hook(TYPE_NAME, Mock(), log_shipping=shipping)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+    log_handler = create_autospec(ProviderLogQueueHandler, instance=True)
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup",
+        return_value=log_handler,
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.hook._get_boto_session", autospec=True
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ):
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    assert mock_log_delivery.call_args[0][3] is shipping
+    log_handler.drain_before_deadline.assert_called_once_with(None)
+    log_handler.flush.assert_not_called()
+
+
+def test_entrypoint_stdout_log_delivery():
+    hook = Hook(TYPE_NAME, Mock(), log_delivery=LogDelivery.STDOUT)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.hook.HookStdoutLogHandler.setup"
+    ) as mock_stdout, patch(
+        "cloudformation_cli_python_lib.hook._get_boto_session", autospec=True
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ):
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_log_delivery.assert_not_called()
+    mock_stdout.assert_called_once()
+    mock_stdout.return_value.flush.assert_called_once()
+
+
+def test_entrypoint_log_sampler():
+    log_sampler = Mock()
+    hook = Hook(TYPE_NAME, Mock(), log_sampler=log_sampler)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.hook._get_boto_session", autospec=True
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ):
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    log_sampler.attach.assert_called_once_with(mock_log_delivery.return_value)
+    log_sampler.log_summary.assert_called_once_with()
+
+
+def test_entrypoint_passes_circuit_breakers():
+    metrics_breaker, logs_breaker = Mock(), Mock()
+    hook = Hook(
+        TYPE_NAME,
+        Mock(),
+        metrics_breaker=metrics_breaker,
+        logs_breaker=logs_breaker,
+    )
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.hook._get_boto_session", autospec=True
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ) as mock_metrics:
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_metrics.assert_called_once_with(None, None, metrics_breaker)
+    assert mock_log_delivery.call_args[0][4] is logs_breaker
+
+
+def test_entrypoint_flush_failures_are_not_fatal(capsys):
+    hook = Hook(TYPE_NAME, Mock())
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.hook._get_boto_session", autospec=True
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ) as mock_metrics:
+        mock_metrics.return_value.flush.side_effect = Exception("network down")
+        mock_log_delivery.return_value.flush.side_effect = Exception("throttled")
+        event = hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_metrics.return_value.flush.assert_called_once()
+    mock_log_delivery.return_value.flush.assert_called_once()
+    assert "Failed to deliver provider logs throttled" in capsys.readouterr().out
+    assert event["hookStatus"] == HookStatus.SUCCESS.name  # pylint: disable=no-member
+
+
+def test_entrypoint_traces_caller_api_calls():
+    session_factory = Mock()
+    hook = Hook(
+        TYPE_NAME, Mock(), session_factory=session_factory, trace_api_calls=True
+    )
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+    caller_sess, provider_sess = Mock(), Mock()
+    session_factory.side_effect = lambda *args, identity, **kwargs: {
+        "caller": caller_sess,
+        "provider": provider_sess,
+    }[identity]
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ), patch(
+        "cloudformation_cli_python_lib.hook.MetricsPublisherProxy"
+    ) as mock_metrics:
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    caller_sess.enable_api_call_tracing.assert_called_once_with()
+    provider_sess.enable_api_call_tracing.assert_not_called()
+    mock_metrics.return_value.publish_api_call_metrics.assert_called_once()
+
+
+def test_entrypoint_caches_caller_reads():
+    session_factory, read_cache = Mock(), Mock()
+    hook = Hook(
+        TYPE_NAME, Mock(), session_factory=session_factory, read_cache=read_cache
+    )
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+    caller_sess, provider_sess = Mock(), Mock()
+    session_factory.side_effect = lambda *args, identity, **kwargs: {
+        "caller": caller_sess,
+        "provider": provider_sess,
+    }[identity]
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ), patch("cloudformation_cli_python_lib.hook.MetricsPublisherProxy"):
+        hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, ENTRYPOINT_PAYLOAD, None
+        )
+
+    caller_sess.enable_read_cache.assert_called_once_with(read_cache)
+    provider_sess.enable_read_cache.assert_not_called()
+    caller_sess.enable_api_call_tracing.assert_not_called()
+    read_cache.start_invocation.assert_called_once_with()
+
+
+def test_entrypoint_aggregates_of_another_account_failing_to_send(caplog):
+    mock_sink = Mock(spec_set=["put_metric_data"])
+    mock_sink.put_metric_data.side_effect = Exception("expired")
+    hook = Hook(
+        TYPE_NAME,
+        Mock(),
+        metrics_sink=mock_sink,
+        metrics_aggregator=MetricsAggregator(interval=3600.0),
+    )
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(Mock(return_value=event))
+    other_account = {**ENTRYPOINT_PAYLOAD, "awsAccountId": "210987654321"}
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.HookProviderLogHandler.setup"
+    ), patch("cloudformation_cli_python_lib.hook._get_boto_session", autospec=True):
+        for payload in (ENTRYPOINT_PAYLOAD, other_account):
+            hook.__call__.__wrapped__(hook, payload, None)  # pylint: disable=no-member
+
+    namespace, _metric_data = mock_sink.put_metric_data.call_args[0]
+    assert namespace == HookMetricsPublisher._make_hook_namespace(
+        ENTRYPOINT_PAYLOAD["hookTypeName"], ENTRYPOINT_PAYLOAD["awsAccountId"]
+    )
+    assert "Failed to publish metrics of another account" in caplog.text
+
+
 def test_cast_hook_request_invalid_request(hook):
     request = HookInvocationRequest.deserialize(ENTRYPOINT_PAYLOAD)
     request.requestData = None
@@ -236,7 +581,12 @@ def test__parse_request_valid_request_and__cast_hook_request():
         sentinel.type_configuration
     ]
 
-    hook = Hook(TYPE_NAME, mock_type_configuration_model)
+    hook = Hook(
+        TYPE_NAME,
+        mock_type_configuration_model,
+        client_config=sentinel.client_config,
+        service_client_configs=sentinel.service_client_configs,
+    )
 
     with patch("cloudformation_cli_python_lib.hook._get_boto_session") as mock_session:
         ret = hook._parse_request(ENTRYPOINT_PAYLOAD)
@@ -247,14 +597,20 @@ def test__parse_request_valid_request_and__cast_hook_request():
             call(
                 Credentials(
                     **json.loads(ENTRYPOINT_PAYLOAD["requestData"]["callerCredentials"])
-                )
+                ),
+                identity="caller",
+                client_config=sentinel.client_config,
+                service_client_configs=sentinel.service_client_configs,
             ),
             call(
                 Credentials(
                     **json.loads(
                         ENTRYPOINT_PAYLOAD["requestData"]["providerCredentials"]
                     )
-                )
+                ),
+                identity="provider",
+                client_config=sentinel.client_config,
+                service_client_configs=sentinel.service_client_configs,
             ),
         ],
         any_order=True,
@@ -368,6 +724,23 @@ def test__invoke_handler_was_found(hook):
     )
 
 
+def test__invoke_handler_profiles_handler():
+    profiler = MagicMock()
+    hook = Hook(TYPE_NAME, Mock(), profiler=profiler)
+    progress_event = ProgressEvent(status=OperationStatus.SUCCESS)
+    hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(
+        Mock(return_value=progress_event)
+    )
+
+    resp = hook._invoke_handler(
+        None, Mock(), HookInvocationPoint.CREATE_PRE_PROVISION, {}, None
+    )
+
+    assert resp is progress_event
+    profiler.profile.assert_called_once_with("CREATE_PRE_PROVISION")
+    profiler.profile.return_value.__enter__.assert_called_once()
+
+
 @pytest.mark.parametrize("event,messages", [({}, ("missing", "credentials"))])
 def test__parse_test_request_invalid_request(hook, event, messages):
     with pytest.raises(InternalFailure) as excinfo:
@@ -430,6 +803,61 @@ def test__parse_test_request_valid_request():
     assert callback_context == {}
 
 
+def test__cast_hook_request_routes_to_target_model():
+    target_model_type = Mock(spec_set=["_deserialize"])
+    target_model_type._deserialize.side_effect = lambda json_data: json_data
+    module = Mock(spec_set=["AwsTestResource"], AwsTestResource=target_model_type)
+
+    hook = Hook(TYPE_NAME, Mock(), target_models_package="my_hook.target_models")
+    request = HookInvocationRequest.deserialize(ENTRYPOINT_PAYLOAD)
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.importlib.import_module",
+        return_value=module,
+    ) as mock_import:
+        modeled_request, _ = hook._cast_hook_request(request)
+        hook._cast_hook_request(request)
+
+    # imported once, on first use, and only for the target being evaluated
+    mock_import.assert_called_once_with("my_hook.target_models.aws_test_resource")
+    target_model_type._deserialize.assert_not_called()
+
+    hook_context = modeled_request.hookContext
+    assert hook_context.targetModelType is target_model_type
+    assert hook_context.resourceProperties is sentinel.resource_properties
+    assert hook_context.resourceProperties is sentinel.resource_properties
+    assert (
+        hook_context.previousResourceProperties is sentinel.previous_resource_properties
+    )
+    # deserialized once per request
+    assert target_model_type._deserialize.call_count == 2
+
+
+@pytest.mark.parametrize("exc_cls", [ImportError, AttributeError])
+def test__cast_hook_request_without_target_model(exc_cls):
+    hook = Hook(TYPE_NAME, Mock(), target_models_package="my_hook.target_models")
+    request = HookInvocationRequest.deserialize(ENTRYPOINT_PAYLOAD)
+
+    with patch(
+        "cloudformation_cli_python_lib.hook.importlib.import_module",
+        side_effect=exc_cls,
+    ) as mock_import:
+        modeled_request, _ = hook._cast_hook_request(request)
+        hook._cast_hook_request(request)
+
+    mock_import.assert_called_once()
+    assert modeled_request.hookContext.targetModelType is None
+    assert modeled_request.hookContext.resourceProperties is None
+
+
+def test__cast_hook_request_target_models_not_configured(hook):
+    with patch(
+        "cloudformation_cli_python_lib.hook.importlib.import_module"
+    ) as mock_import:
+        assert hook._get_target_model_type("AWS::Test::Resource") is None
+    mock_import.assert_not_called()
+
+
 def test_test_entrypoint_handler_error(hook):
     # "un-apply" decorator
     event = hook.test_entrypoint.__wrapped__(  # pylint: disable=no-member
@@ -478,6 +906,60 @@ def test_test_entrypoint_success():
     mock_handler.assert_called_once()
 
 
+def test_entrypoint_discards_undelivered_before_swapping_credentials():
+    manager = Mock()
+    hook = Hook(
+        TYPE_NAME,
+        Mock(),
+        session_factory=manager.session_factory,
+        metrics_flusher=manager.flusher,
+    )
+    manager.flusher.drain_timeout = 1.0
+
+    with patch(
+        "cloudformation_cli_python_lib.invocation._discard_queued_records",
+        manager.discard_queued_records,
+    ):
+        hook._parse_request(ENTRYPOINT_PAYLOAD)
+
+    calls = [name for name, _, _ in manager.mock_calls]
+    assert calls == [
+        "session_factory",
+        "flusher.discard",
+        "discard_queued_records",
+        "session_factory",
+    ]
+    assert manager.session_factory.call_args_list[1][1]["identity"] == "provider"
+    manager.flusher.discard.assert_called_once_with(1.0)
+
+
+def test_test_entrypoint_session_factory():
+    mock_session_factory = Mock()
+    hook = Hook(TYPE_NAME, Mock(), session_factory=mock_session_factory)
+    mock_handler = hook.handler(HookInvocationPoint.CREATE_PRE_PROVISION)(
+        Mock(return_value=ProgressEvent(status=OperationStatus.SUCCESS))
+    )
+
+    payload = {
+        "credentials": {"accessKeyId": "a", "secretAccessKey": "b", "sessionToken": ""},
+        "actionInvocationPoint": "CREATE_PRE_PROVISION",
+        "request": {"clientRequestToken": "ecba020e-b2e6-4742-a7d0-8a06ae7c4b2b"},
+    }
+    with patch("cloudformation_cli_python_lib.hook._get_boto_session") as mock_session:
+        hook.test_entrypoint.__wrapped__(
+            hook, payload, None
+        )  # pylint: disable=no-member
+
+    mock_session.assert_not_called()
+    mock_session_factory.assert_called_once_with(
+        Credentials("a", "b", ""),
+        region=None,
+        client_config=None,
+        service_client_configs=None,
+    )
+    assert mock_handler.call_args[0][0] is mock_session_factory.return_value
+
+
 @pytest.mark.parametrize(
     "operation_status,hook_status",
     [
@@ -531,6 +1013,7 @@ def test__test_stack_level_hook_input(hook):
     ) as mock_requests_lib:
         mock_requests_lib.return_value = MockResponse(200, {"foo": "bar"})
         _, _, _, req = hook._parse_request(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+        req.requestData.resolve_remote_payload()
 
     assert req.requestData.targetName == "STACK"
     assert req.requestData.targetType == "STACK"
@@ -546,6 +1029,7 @@ def test__test_stack_level_hook_input_failed_s3_download(hook):
     ) as mock_requests_lib:
         mock_requests_lib.return_value = MockResponse(404, {"foo": "bar"})
         _, _, _, req = hook._parse_request(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+        req.requestData.resolve_remote_payload()
 
     assert req.requestData.targetName == "STACK"
     assert req.requestData.targetType == "STACK"
@@ -553,10 +1037,174 @@ def test__test_stack_level_hook_input_failed_s3_download(hook):
     assert req.requestData.targetModel == {}
 
 
+def test__test_stack_level_hook_input_deferred_until_cast(hook):
+    hook = Hook(TYPE_NAME, Mock())
+    fetched = threading.Event()
+    release = threading.Event()
+
+    def slow_get(*_args, **_kwargs):
+        fetched.set()
+        release.wait(5)
+        return MockResponse(200, {"foo": "bar"})
+
+    with patch(
+        "cloudformation_cli_python_lib.utils.requests.Session.get",
+        side_effect=slow_get,
+    ):
+        _, _, _, req = hook._parse_request(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+        # parsing returns while the download is still in flight
+        assert fetched.wait(5)
+        assert req.requestData.targetModel == {}
+        release.set()
+        modeled_request, _ = hook._cast_hook_request(req)
+
+    assert modeled_request.hookContext.targetModel == {"foo": "bar"}
+    assert req.requestData.targetModel == {"foo": "bar"}
+    assert "_remote_payload" not in req.requestData.serialize()
+
+
+def test__hook_request_data_resolves_remote_payload_when_not_deferred():
+    with patch(
+        "cloudformation_cli_python_lib.utils.requests.Session.get"
+    ) as mock_requests_lib:
+        mock_requests_lib.return_value = MockResponse(200, {"foo": "bar"})
+        request = HookInvocationRequest.deserialize(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+
+    assert request.requestData.targetModel == {"foo": "bar"}
+
+
+def test__parse_request_discards_remote_payload_on_error(hook):
+    future = Mock()
+    with patch(
+        "cloudformation_cli_python_lib.utils._fetch_remote_payload_in_background",
+        return_value=future,
+    ), patch.object(hook, "_get_session", side_effect=ValueError("bad")):
+        with pytest.raises(InvalidRequest):
+            hook._parse_request(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+
+    future.cancel.assert_called_once_with()
+
+
+def test_entrypoint_discards_remote_payload_on_error():
+    hook = Hook(TYPE_NAME, Mock())
+    future = Mock()
+    with patch(
+        "cloudformation_cli_python_lib.utils._fetch_remote_payload_in_background",
+        return_value=future,
+    ), patch("cloudformation_cli_python_lib.hook._get_boto_session"), patch.object(
+        hook, "_setup_logging", side_effect=ValueError("bad")
+    ):
+        event = hook.__call__.__wrapped__(  # pylint: disable=no-member
+            hook, STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD, None
+        )
+
+    assert event["errorCode"] == HandlerErrorCode.InternalFailure
+    future.cancel.assert_called_once_with()
+    future.result.assert_not_called()
+
+
+def test_remote_payloads_do_not_share_a_worker():
+    release = threading.Event()
+    started = []
+
+    def slow_get(*_args, **_kwargs):
+        started.append(threading.current_thread().name)
+        release.wait(5)
+        return MockResponse(200, {"foo": "bar"})
+
+    with patch(
+        "cloudformation_cli_python_lib.utils.requests.Session.get",
+        side_effect=slow_get,
+    ):
+        stale = HookInvocationRequest.deserialize(
+            STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD, defer_remote_payload=True
+        )
+        stale.requestData.discard_remote_payload()
+        request = HookInvocationRequest.deserialize(
+            STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD, defer_remote_payload=True
+        )
+        # the second download runs while the first one is still in flight
+        for _ in range(500):
+            if len(started) == 2:
+                break
+            threading.Event().wait(0.01)
+        assert len(started) == 2
+        release.set()
+        assert request.requestData.resolve_remote_payload() == {"foo": "bar"}
+
+
+def test__test_stack_level_hook_input_payload_too_large_content_length(hook):
+    hook = Hook(TYPE_NAME, Mock(), remote_payload_max_size=8)
+
+    with patch(
+        "cloudformation_cli_python_lib.utils.requests.Session.get"
+    ) as mock_requests_lib:
+        mock_requests_lib.return_value = MockResponse(200, {"foo": "bar"})
+        _, _, _, req = hook._parse_request(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+        with pytest.raises(InvalidRequest) as excinfo:
+            hook._cast_hook_request(req)
+
+    assert "exceeds the maximum of 8 bytes" in str(excinfo.value)
+
+
+def test__test_stack_level_hook_input_payload_too_large_streamed(hook):
+    hook = Hook(TYPE_NAME, Mock(), remote_payload_max_size=8)
+
+    with patch(
+        "cloudformation_cli_python_lib.utils.requests.Session.get"
+    ) as mock_requests_lib:
+        mock_requests_lib.return_value = MockResponse(
+            200, {"foo": "bar"}, send_content_length=False
+        )
+        _, _, _, req = hook._parse_request(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+        with pytest.raises(InvalidRequest) as excinfo:
+            hook._cast_hook_request(req)
+
+    assert "exceeds the maximum of 8 bytes" in str(excinfo.value)
+
+
+def test__test_stack_level_hook_input_streamed_in_chunks(hook):
+    hook = Hook(TYPE_NAME, Mock())
+    target_model = {"foo": "bar" * 100000}
+
+    with patch(
+        "cloudformation_cli_python_lib.utils.requests.Session.get"
+    ) as mock_requests_lib:
+        mock_requests_lib.return_value = MockResponse(
+            200, target_model, send_content_length=False
+        )
+        _, _, _, req = hook._parse_request(STACK_LEVEL_HOOK_ENTRYPOINT_PAYLOAD)
+        req.requestData.resolve_remote_payload()
+
+    _, kwargs = mock_requests_lib.call_args
+    assert kwargs["stream"] is True
+    assert req.requestData.targetModel == target_model
+
+
 @dataclass
 class MockResponse:
     status_code: int
     _json: Mapping[str, Any]
+    send_content_length: bool = True
+
+    @property
+    def content(self) -> bytes:
+        return json.dumps(self._json).encode("utf-8")
+
+    @property
+    def headers(self) -> Mapping[str, str]:
+        if self.send_content_length:
+            return {"Content-Length": str(len(self.content))}
+        return {}
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        content = self.content
+        while content:
+            yield content[:chunk_size]
+            content = content[chunk_size:]
+
+    def __enter__(self) -> "MockResponse":
+        return self
 
-    def json(self) -> Mapping[str, Any]:
-        return self._json
+    def __exit__(self, *args: Any) -> None:
+        pass
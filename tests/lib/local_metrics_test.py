@@ -0,0 +1,111 @@
+# pylint: disable=protected-access
+import pytest
+from cloudformation_cli_python_lib.interface import Action, LocalMetricsFormat
+from cloudformation_cli_python_lib.local_metrics import (
+    JsonLinesMetricsSink,
+    PrometheusMetricsSink,
+    local_metrics_sink,
+)
+from cloudformation_cli_python_lib.metrics import (
+    MetricsPublisher,
+    MetricsPublisherProxy,
+)
+
+import json
+from datetime import datetime
+
+RESOURCE_TYPE = "Aa::Bb::Cc"
+RESOURCE_NAMESPACE = MetricsPublisher._make_namespace(RESOURCE_TYPE)
+
+
+def test_json_lines_sink(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    sink = local_metrics_sink(path)
+    assert isinstance(sink, JsonLinesMetricsSink)
+    proxy = MetricsPublisherProxy()
+    proxy.add_metrics_publisher(None, RESOURCE_TYPE, sink)
+    proxy.publish_invocation_metric(datetime(2019, 1, 1), Action.CREATE)
+    proxy.flush()
+    proxy.publish_duration_metric(datetime(2019, 1, 1), Action.CREATE, 12.5)
+    proxy.flush()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["MetricName"] for line in lines] == [
+        "HandlerInvocationCount",
+        "HandlerInvocationDuration",
+    ]
+    assert lines[1] == {
+        "Namespace": RESOURCE_NAMESPACE,
+        "MetricName": "HandlerInvocationDuration",
+        "Dimensions": [
+            {"Name": "DimensionKeyActionType", "Value": "CREATE"},
+            {"Name": "DimensionKeyResourceType", "Value": RESOURCE_TYPE},
+        ],
+        "Unit": "Milliseconds",
+        "Timestamp": "2019-01-01 00:00:00",
+        "Value": 12.5,
+    }
+
+
+def test_prometheus_sink(tmp_path):
+    path = tmp_path / "metrics.prom"
+    sink = local_metrics_sink(path, LocalMetricsFormat.PROMETHEUS)
+    assert isinstance(sink, PrometheusMetricsSink)
+    proxy = MetricsPublisherProxy()
+    proxy.add_metrics_publisher(None, RESOURCE_TYPE, sink)
+    for duration in (10.0, 30.0):
+        proxy.publish_invocation_metric(datetime(2019, 1, 1), Action.CREATE)
+        proxy.publish_duration_metric(datetime(2019, 1, 1), Action.CREATE, duration)
+    proxy.flush()
+    sink.put_metric_data(
+        'a"b',
+        [
+            {
+                "MetricName": "Latency",
+                "Dimensions": [{"Name": "Key", "Value": "line\nbreak"}],
+                "Unit": "Seconds",
+                "StatisticValues": {"SampleCount": 2.0, "Sum": 3.0},
+            },
+            {"MetricName": "Latency", "Unit": "Seconds", "Values": [1.0, 2.0]},
+        ],
+    )
+
+    labels = (
+        f'namespace="{RESOURCE_NAMESPACE}",dimension_key_action_type="CREATE",'
+        f'dimension_key_resource_type="{RESOURCE_TYPE}"'
+    )
+    assert sink.render() == "".join(
+        line + "\n"
+        for line in [
+            "# TYPE handler_invocation_count summary",
+            f"handler_invocation_count_sum{{{labels}}} 2.0",
+            f"handler_invocation_count_count{{{labels}}} 2.0",
+            "# TYPE handler_invocation_duration_milliseconds summary",
+            f"handler_invocation_duration_milliseconds_sum{{{labels}}} 40.0",
+            f"handler_invocation_duration_milliseconds_count{{{labels}}} 2.0",
+            "# TYPE latency_seconds summary",
+            'latency_seconds_sum{namespace="a\\"b"} 3.0',
+            'latency_seconds_count{namespace="a\\"b"} 2.0',
+            'latency_seconds_sum{namespace="a\\"b",key="line\\nbreak"} 3.0',
+            'latency_seconds_count{namespace="a\\"b",key="line\\nbreak"} 2.0',
+        ]
+    )
+    assert path.read_text() == sink.render()
+
+
+def test_local_metrics_sink_requires_path_for_json_lines():
+    assert isinstance(
+        local_metrics_sink(None, LocalMetricsFormat.PROMETHEUS), PrometheusMetricsSink
+    )
+    with pytest.raises(ValueError):
+        local_metrics_sink(None)
+
+
+def test_prometheus_sink_without_path():
+    sink = PrometheusMetricsSink()
+    sink.put_metric_data("ns", [{"MetricName": "Items", "Unit": "Count", "Value": 3.0}])
+    assert sink.render() == (
+        "# TYPE items summary\n"
+        'items_sum{namespace="ns"} 3.0\n'
+        'items_count{namespace="ns"} 1.0\n'
+    )
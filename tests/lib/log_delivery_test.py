@@ -1,9 +1,21 @@
-# pylint: disable=redefined-outer-name,protected-access
+# pylint: disable=redefined-outer-name,protected-access,too-many-lines
 import pytest
+from cloudformation_cli_python_lib.circuit_breaker import CircuitBreaker
+from cloudformation_cli_python_lib.interface import DropPolicy
 from cloudformation_cli_python_lib.log_delivery import (
+    LOG_EVENT_OVERHEAD_BYTES,
     HookProviderLogHandler,
+    HookStdoutLogHandler,
+    JsonFormatter,
+    LogSampler,
+    LogShippingConfig,
     ProviderFilter,
     ProviderLogHandler,
+    ProviderLogQueueHandler,
+    StdoutLogHandler,
+    _discard_queued_records,
+    get_log_context,
+    log_context,
 )
 from cloudformation_cli_python_lib.utils import (
     HandlerRequest,
@@ -14,7 +26,11 @@ from cloudformation_cli_python_lib.utils import (
 
 import botocore.errorfactory
 import botocore.session
+import json
 import logging
+import queue
+import threading
+from io import StringIO
 from unittest.mock import DEFAULT, Mock, create_autospec, patch
 from uuid import uuid4
 
@@ -103,6 +119,12 @@ def mock_handler_set_formatter():
     return patch__set_handler_formatter, patch__set_hook_handler_formatter
 
 
+def make_record(message: str, created: float) -> logging.LogRecord:
+    record = logging.LogRecord("a", 123, "/", 234, message, [], False)
+    record.created = created
+    return record
+
+
 @pytest.fixture
 def mock_provider_handler(mock_session):
     plh = ProviderLogHandler(
@@ -114,6 +136,7 @@ def mock_provider_handler(mock_session):
     # be replaced with mocks
     for method in ["create_log_group", "create_log_stream", "put_log_events"]:
         setattr(plh.client, method, Mock(auto_spec=True))
+    plh.client.put_log_events.return_value = {"nextSequenceToken": "seq"}
 
     # set exceptions instead of using Mock
     plh.client.exceptions = logs_exceptions
@@ -131,6 +154,7 @@ def mock_hook_provider_handler(mock_session):
     # be replaced with mocks
     for method in ["create_log_group", "create_log_stream", "put_log_events"]:
         setattr(plh.client, method, Mock(auto_spec=True))
+    plh.client.put_log_events.return_value = {"nextSequenceToken": "seq"}
 
     # set exceptions instead of using Mock
     plh.client.exceptions = logs_exceptions
@@ -277,17 +301,16 @@ def test__create_already_exists(mock_provider_handler, create_method):
 
 
 @pytest.mark.parametrize("sequence_token", [None, "some-seq"])
-def test__put_log_event_success(mock_provider_handler, sequence_token):
+def test__put_log_events_success(mock_provider_handler, sequence_token):
     mock_provider_handler.sequence_token = sequence_token
     mock_put = mock_provider_handler.client.put_log_events
     mock_put.return_value = {"nextSequenceToken": "some-other-seq"}
-    mock_provider_handler._put_log_event(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
-    )
+    mock_provider_handler._put_log_events([{"timestamp": 1, "message": "log-msg"}])
     mock_put.assert_called_once()
+    assert mock_provider_handler.sequence_token == "some-other-seq"
 
 
-def test__put_log_event_invalid_token(mock_provider_handler):
+def test__put_log_events_invalid_token(mock_provider_handler):
     mock_put = mock_provider_handler.client.put_log_events
     mock_put.return_value = {"nextSequenceToken": "some-other-seq"}
     mock_put.side_effect = [
@@ -295,48 +318,549 @@ def test__put_log_event_invalid_token(mock_provider_handler):
         logs_exceptions.DataAlreadyAcceptedException({}, operation_name="Test"),
         DEFAULT,
     ]
-    mock_provider_handler._put_log_event(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
+    mock_provider_handler._put_log_events([{"timestamp": 1, "message": "log-msg"}])
+    assert mock_put.call_count == 3
+
+
+def test__put_log_events_retries_are_bounded(mock_provider_handler):
+    mock_put = mock_provider_handler.client.put_log_events
+    mock_put.side_effect = logs_exceptions.InvalidSequenceTokenException(
+        {}, operation_name="Test"
     )
+    with pytest.raises(logs_exceptions.InvalidSequenceTokenException):
+        mock_provider_handler._put_log_events([{"timestamp": 1, "message": "a"}])
     assert mock_put.call_count == 3
 
 
-def test_emit_existing_cwl_group_stream(mock_provider_handler):
-    mock_provider_handler._put_log_event = Mock()
-    mock_provider_handler.emit(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
+def test_flush_circuit_breaker(mock_provider_handler):
+    mock_provider_handler.breaker = CircuitBreaker(failure_threshold=1)
+    mock_put = mock_provider_handler.client.put_log_events
+    mock_put.side_effect = logs_exceptions.ServiceUnavailableException(
+        {}, operation_name="Test"
     )
-    mock_provider_handler._put_log_event.assert_called_once()
+    mock_provider_handler.emit(make_record("first", 1.0))
+    with pytest.raises(logs_exceptions.ServiceUnavailableException):
+        mock_provider_handler.flush()
+
+    # while the circuit is open, batches are dropped without a call
+    mock_provider_handler.emit(make_record("second", 2.0))
+    mock_provider_handler.emit(make_record("third", 3.0))
+    mock_provider_handler.flush()
+    mock_put.assert_called_once()
+    assert mock_provider_handler.skipped == 2
 
 
-def test_emit_no_group_stream(mock_provider_handler):
+def test_emit_buffers_until_flush(mock_provider_handler):
+    mock_put = mock_provider_handler.client.put_log_events
+    mock_provider_handler.emit(make_record("second", 2.0))
+    mock_provider_handler.emit(make_record("first", 1.0))
+    mock_put.assert_not_called()
+
+    mock_provider_handler.flush()
+    mock_put.assert_called_once()
+    assert mock_put.call_args[1]["logEvents"] == [
+        {"timestamp": 1000, "message": "first"},
+        {"timestamp": 2000, "message": "second"},
+    ]
+    mock_provider_handler.client.create_log_stream.assert_called_once()
+    mock_provider_handler.client.create_log_group.assert_not_called()
+
+    # nothing buffered, nothing sent
+    mock_provider_handler.flush()
+    mock_put.assert_called_once()
+
+    # the stream is only created once per handler
+    mock_provider_handler.emit(make_record("third", 3.0))
+    mock_provider_handler.flush()
+    assert mock_put.call_count == 2
+    mock_provider_handler.client.create_log_stream.assert_called_once()
+
+
+def test_flush_no_group_stream(mock_provider_handler):
     group_exc = logs_exceptions.ResourceNotFoundException(
         {"Error": {"Message": "log group does not exist"}},
-        operation_name="PutLogRecords",
+        operation_name="CreateLogStream",
     )
-    mock_provider_handler._put_log_event = Mock()
-    mock_provider_handler._put_log_event.side_effect = [group_exc, DEFAULT]
-    mock_provider_handler._create_log_group = Mock()
-    mock_provider_handler._create_log_stream = Mock()
-    mock_provider_handler.emit(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
-    )
-    assert mock_provider_handler._put_log_event.call_count == 2
-    mock_provider_handler._create_log_group.assert_called_once()
-    mock_provider_handler._create_log_stream.assert_called_once()
+    mock_provider_handler.client.create_log_stream.side_effect = [group_exc, DEFAULT]
+    mock_provider_handler.emit(make_record("log-msg", 1.0))
+    mock_provider_handler.flush()
+    mock_provider_handler.client.create_log_group.assert_called_once()
+    assert mock_provider_handler.client.create_log_stream.call_count == 2
+    mock_provider_handler.client.put_log_events.assert_called_once()
 
-    # create_group should not be called again if the group already exists
+    # the stream is created again if it was deleted
     stream_exc = logs_exceptions.ResourceNotFoundException(
         {"Error": {"Message": "log stream does not exist"}},
-        operation_name="PutLogRecords",
+        operation_name="PutLogEvents",
     )
-    mock_provider_handler._put_log_event.side_effect = [stream_exc, DEFAULT]
-    mock_provider_handler.emit(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
+    mock_provider_handler.client.create_log_stream.side_effect = None
+    mock_provider_handler.client.put_log_events.side_effect = [stream_exc, DEFAULT]
+    mock_provider_handler.emit(make_record("log-msg", 2.0))
+    mock_provider_handler.flush()
+    assert mock_provider_handler.client.put_log_events.call_count == 3
+    assert mock_provider_handler.client.create_log_stream.call_count == 3
+    mock_provider_handler.client.create_log_group.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "limit,value,records",
+    [
+        ("MAX_LOG_EVENTS_PER_BATCH", 2, [("a", 1.0), ("b", 1.0), ("c", 1.0)]),
+        ("MAX_LOG_BATCH_BYTES", 60, [("a" * 20, 1.0), ("b" * 20, 1.0)]),
+        ("MAX_LOG_BATCH_SPAN_MS", 1000, [("a", 1.0), ("b", 2.0)]),
+    ],
+)
+def test_emit_flushes_at_batch_limits(mock_provider_handler, limit, value, records):
+    with patch(f"cloudformation_cli_python_lib.log_delivery.{limit}", value):
+        for message, created in records:
+            mock_provider_handler.emit(make_record(message, created))
+    mock_put = mock_provider_handler.client.put_log_events
+    mock_put.assert_called_once()
+    sent = [event["message"] for event in mock_put.call_args[1]["logEvents"]]
+    assert sent == [message for message, _created in records[:-1]]
+    assert len(mock_provider_handler._events) == 1
+
+
+def test_emit_truncates_oversized_events(mock_provider_handler):
+    with patch("cloudformation_cli_python_lib.log_delivery.MAX_LOG_EVENT_BYTES", 52):
+        # the cut falls inside the two bytes of the last character
+        mock_provider_handler.emit(make_record("a" * 8 + "é" * 20, 1.0))
+        mock_provider_handler.emit(make_record("fits", 2.0))
+    mock_provider_handler.flush()
+    mock_put = mock_provider_handler.client.put_log_events
+    sent = [event["message"] for event in mock_put.call_args[1]["logEvents"]]
+    assert sent == ["a" * 8 + "é... (truncated)", "fits"]
+    assert len(sent[0].encode("utf-8")) + LOG_EVENT_OVERHEAD_BYTES <= 52
+
+
+def test_setup_with_shipping_installs_queue_handler(setup_patches, mock_session):
+    payload, _hook_payload, p_logger, p__get_logger, _p__get_hook_logger = setup_patches
+    with p_logger as mock_log, p__get_logger as mock_get, patch(
+        "cloudformation_cli_python_lib.log_delivery.ProviderLogQueueHandler",
+        autospec=True,
+    ) as mock_queue_handler:
+        mock_get.return_value = None
+        shipping = LogShippingConfig()
+        log_handler = ProviderLogHandler.setup(payload, mock_session, None, shipping)
+    assert log_handler is mock_queue_handler.return_value
+    target, config = mock_queue_handler.call_args[0]
+    assert isinstance(target, ProviderLogHandler)
+    assert config is shipping
+    mock_log.return_value.addHandler.assert_called_once_with(log_handler)
+
+
+def test_setup_existing_queue_handler(mock_session):
+    target = ProviderLogHandler("g", "s", mock_session)
+    log_handler = create_autospec(ProviderLogQueueHandler, instance=True)
+    log_handler.target = target
+    mock_session.reset_mock()
+    with patch(
+        "cloudformation_cli_python_lib.log_delivery.logging.getLogger"
+    ) as mock_log:
+        mock_log.return_value.handlers = [logging.Handler(), log_handler]
+        assert ProviderLogHandler.setup(make_payload(), mock_session) is log_handler
+        # a hook handler is not reused for a resource, and vice versa
+        assert HookProviderLogHandler._get_existing_logger() is None
+    mock_session.client.assert_called_once_with("logs")
+    assert target.client is mock_session.client.return_value
+    mock_log.return_value.addHandler.assert_not_called()
+
+
+def test_queue_handler_ships_in_background(mock_provider_handler):
+    log_handler = ProviderLogQueueHandler(mock_provider_handler, LogShippingConfig())
+    try:
+        log_handler.handle(make_record("first", 1.0))
+        log_handler.handle(make_record("second", 2.0))
+        assert log_handler.drain(5.0)
+    finally:
+        log_handler.listener.stop()
+    sent = [
+        event["message"]
+        for call in mock_provider_handler.client.put_log_events.call_args_list
+        for event in call[1]["logEvents"]
+    ]
+    assert sent == ["first", "second"]
+
+
+def test_queue_handler_ignores_records_of_listener(mock_provider_handler):
+    config = LogShippingConfig(max_queue_size=1, drop_policy=DropPolicy.BLOCK)
+    log_handler = ProviderLogQueueHandler(mock_provider_handler, config)
+
+    def log_while_shipping(**_):
+        log_handler.handle(make_record("shipping", 2.0))
+        return DEFAULT
+
+    mock_provider_handler.client.put_log_events.side_effect = log_while_shipping
+    try:
+        log_handler.handle(make_record("first", 1.0))
+        assert log_handler.drain(5.0)
+    finally:
+        log_handler.listener.stop()
+    mock_provider_handler.client.put_log_events.assert_called_once()
+    assert log_handler.records.empty()
+
+
+def test_queue_handler_survives_delivery_errors(mock_provider_handler, capsys):
+    mock_provider_handler.client.put_log_events.side_effect = [
+        Exception("network down"),
+        DEFAULT,
+    ]
+    log_handler = ProviderLogQueueHandler(mock_provider_handler, LogShippingConfig())
+    try:
+        log_handler.handle(make_record("lost", 1.0))
+        assert log_handler.drain(5.0)
+        log_handler.handle(make_record("sent", 2.0))
+        assert log_handler.drain(5.0)
+    finally:
+        log_handler.listener.stop()
+    assert "network down" in capsys.readouterr().out
+    assert mock_provider_handler.client.put_log_events.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "drop_policy,expected",
+    [(DropPolicy.DROP_NEWEST, ["a", "b"]), (DropPolicy.DROP_OLDEST, ["b", "c"])],
+)
+def test_queue_handler_drop_policy(mock_provider_handler, drop_policy, expected):
+    config = LogShippingConfig(max_queue_size=2, drop_policy=drop_policy)
+    with patch("cloudformation_cli_python_lib.log_delivery._ShippingListener.start"):
+        log_handler = ProviderLogQueueHandler(mock_provider_handler, config)
+    for message in ["a", "b", "c"]:
+        log_handler.handle(make_record(message, 1.0))
+    assert log_handler.dropped == 1
+    queued = [log_handler.records.get_nowait().msg for _ in range(2)]
+    assert queued == expected
+
+
+def test_queue_handler_drop_oldest_after_listener_caught_up(mock_provider_handler):
+    config = LogShippingConfig(max_queue_size=1, drop_policy=DropPolicy.DROP_OLDEST)
+    with patch("cloudformation_cli_python_lib.log_delivery._ShippingListener.start"):
+        log_handler = ProviderLogQueueHandler(mock_provider_handler, config)
+    records = log_handler.records
+    with patch.object(
+        records, "put_nowait", side_effect=[queue.Full, None]
+    ) as mock_put, patch.object(records, "get_nowait", side_effect=queue.Empty):
+        log_handler.handle(make_record("a", 1.0))
+    assert mock_put.call_count == 2
+    assert log_handler.dropped == 0
+
+
+def test_queue_handler_block_policy(mock_provider_handler):
+    config = LogShippingConfig(max_queue_size=1, drop_policy=DropPolicy.BLOCK)
+    with patch("cloudformation_cli_python_lib.log_delivery._ShippingListener.start"):
+        log_handler = ProviderLogQueueHandler(mock_provider_handler, config)
+    log_handler.handle(make_record("a", 1.0))
+    blocked = threading.Thread(target=log_handler.handle, args=(make_record("b", 1.0),))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    assert log_handler.records.get_nowait().msg == "a"
+    blocked.join(5.0)
+    assert not blocked.is_alive()
+    assert log_handler.records.get_nowait().msg == "b"
+    assert log_handler.dropped == 0
+
+
+def test_discard_queued_records(mock_provider_handler):
+    config = LogShippingConfig()
+    with patch("cloudformation_cli_python_lib.log_delivery._ShippingListener.start"):
+        log_handler = ProviderLogQueueHandler(mock_provider_handler, config)
+    for message in ["a", "b"]:
+        log_handler.handle(make_record(message, 1.0))
+    with patch(
+        "cloudformation_cli_python_lib.log_delivery.logging.getLogger"
+    ) as mock_log:
+        mock_log.return_value.handlers = [logging.Handler(), log_handler]
+        _discard_queued_records()
+    assert log_handler.dropped == 2
+    assert log_handler.records.empty()
+    mock_provider_handler.client.put_log_events.assert_not_called()
+
+
+def test_queue_handler_drain_before_deadline(mock_provider_handler, capsys):
+    config = LogShippingConfig(drain_timeout=10.0)
+    with patch("cloudformation_cli_python_lib.log_delivery._ShippingListener.start"):
+        log_handler = ProviderLogQueueHandler(mock_provider_handler, config)
+    assert log_handler.drain_before_deadline(None)
+
+    log_handler.handle(make_record("a", 1.0))
+    context = Mock()
+    context.get_remaining_time_in_millis.return_value = 100
+    with patch.object(log_handler, "drain", return_value=False) as mock_drain:
+        assert not log_handler.drain_before_deadline(context)
+    # the margin leaves no time to drain
+    mock_drain.assert_called_once_with(0.0)
+    assert "still queued" in capsys.readouterr().out
+
+
+def test_queue_handler_drain_times_out(mock_provider_handler):
+    with patch("cloudformation_cli_python_lib.log_delivery._ShippingListener.start"):
+        log_handler = ProviderLogQueueHandler(
+            mock_provider_handler, LogShippingConfig()
+        )
+    log_handler.handle(make_record("a", 1.0))
+    assert not log_handler.drain(0.05)
+    assert log_handler.records.unfinished_tasks == 1
+
+
+def test_stdout_handler_writes_json_lines():
+    stream = StringIO()
+    log_handler = StdoutLogHandler("an-arn/MyResourceId", {"action": "CREATE"}, stream)
+    log_handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    record = make_record("log-msg", 1.5)
+    record.levelname = "INFO"
+    log_handler.handle(record)
+    log_handler.handle(make_record("second", 2.0))
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0]) == {
+        "timestamp": 1500,
+        "level": "INFO",
+        "logger": "a",
+        "logStream": "an-arn/MyResourceId",
+        "action": "CREATE",
+        "message": "INFO log-msg",
+    }
+
+
+@pytest.mark.parametrize(
+    "handler_cls,payload,provider,fields",
+    [
+        (
+            StdoutLogHandler,
+            make_payload(),
+            "foo_bar_baz",
+            {"action": "CREATE", "logicalResourceId": "MyResourceId"},
+        ),
+        (
+            HookStdoutLogHandler,
+            make_hook_payload(),
+            "aws_test_hook",
+            {
+                "invocationPoint": "CREATE_PRE_PROVISION",
+                "targetLogicalId": "MyTargetId",
+            },
+        ),
+    ],
+)
+def test_stdout_setup(mock_logger, handler_cls, payload, provider, fields):
+    platform_handler = Mock()
+    mock_logger.handlers = [platform_handler]
+    provider_logger = Mock(handlers=[])
+    with patch(
+        "cloudformation_cli_python_lib.log_delivery.logging.getLogger",
+        side_effect=lambda name=None: provider_logger if name else mock_logger,
+    ) as mock_get_logger:
+        log_handler = handler_cls.setup(payload)
+        provider_logger.handlers.append(log_handler)
+        payload.stackId = "another-arn"
+        # a re-used container updates the installed handler
+        assert handler_cls.setup(payload) is log_handler
+
+    mock_get_logger.assert_any_call(provider)
+    provider_logger.addHandler.assert_called_once_with(log_handler)
+    # records of other loggers are already written to stdout by the platform
+    mock_logger.addHandler.assert_not_called()
+    platform_handler.addFilter.assert_called_once()
+    assert isinstance(log_handler, handler_cls)
+    assert log_handler.log_stream.startswith("another-arn/")
+    assert log_handler.fields["stackId"] == "another-arn"
+    assert fields.items() <= log_handler.fields.items()
+
+
+@pytest.mark.parametrize(
+    "handler_cls,payload",
+    [(StdoutLogHandler, make_payload()), (HookStdoutLogHandler, make_hook_payload())],
+)
+def test_stdout_setup_without_stack_id_with_formatter(
+    mock_logger, handler_cls, payload
+):
+    payload.stackId = None
+    mock_logger.handlers = []
+    other_handler = logging.Handler()
+    provider_logger = Mock(handlers=[other_handler])
+    formatter = JsonFormatter()
+    with patch(
+        "cloudformation_cli_python_lib.log_delivery.logging.getLogger",
+        side_effect=lambda name=None: provider_logger if name else mock_logger,
+    ):
+        log_handler = handler_cls.setup(payload, formatter)
+
+    provider_logger.addHandler.assert_called_once_with(log_handler)
+    assert log_handler.formatter is formatter
+    assert log_handler.log_stream.startswith(f"{payload.awsAccountId}-")
+
+
+def test_stdout_setup_without_type_name_should_not_set_up(mock_logger):
+    payload, hook_payload = make_payload(), make_hook_payload()
+    payload.resourceType = None
+    hook_payload.hookTypeName = None
+    with patch(
+        "cloudformation_cli_python_lib.log_delivery.logging.getLogger",
+        return_value=mock_logger,
+    ):
+        assert StdoutLogHandler.setup(payload) is None
+        assert HookStdoutLogHandler.setup(hook_payload) is None
+    mock_logger.addHandler.assert_not_called()
+
+
+def make_level_record(level: int, message: str = "log-msg") -> logging.LogRecord:
+    return logging.LogRecord("a", level, "/", 234, message, [], False)
+
+
+def test_log_sampler_samples_by_level():
+    samples = iter([0.05, 0.5, 0.05])
+    sampler = LogSampler({logging.DEBUG: 0.1}, sample=lambda: next(samples))
+    assert sampler.filter(make_level_record(logging.DEBUG))
+    assert not sampler.filter(make_level_record(logging.DEBUG))
+    assert sampler.filter(make_level_record(logging.INFO))
+    assert sampler.filter(make_level_record(logging.DEBUG))
+    assert sampler.sampled == {"DEBUG": 1}
+    assert sampler.summary() == (
+        "Provider logs were reduced: sampling dropped 1 DEBUG records"
     )
-    assert mock_provider_handler._put_log_event.call_count == 4
-    mock_provider_handler._create_log_group.assert_called_once()
-    assert mock_provider_handler._create_log_stream.call_count == 2
+
+
+def test_log_sampler_rate_limits_records():
+    sampler = LogSampler(records_per_second=0.0, record_burst=2)
+    kept = [sampler.filter(make_level_record(logging.INFO)) for _ in range(3)]
+    assert kept == [True, True, False]
+    assert sampler.limited == 1
+    assert sampler.summary() == (
+        "Provider logs were reduced: rate limiting dropped 1 records (7 bytes)"
+    )
+
+
+def test_log_sampler_rate_limits_bytes():
+    sampler = LogSampler(bytes_per_second=0.0, byte_burst=10)
+    assert sampler.filter(make_level_record(logging.INFO, "12345678"))
+    assert not sampler.filter(make_level_record(logging.INFO, "123"))
+    assert sampler.filter(make_level_record(logging.INFO, "12"))
+    assert (sampler.limited, sampler.limited_bytes) == (1, 3)
+
+
+def test_log_sampler_refills_over_time():
+    with patch("cloudformation_cli_python_lib.log_delivery.time.monotonic") as now:
+        now.return_value = 100.0
+        sampler = LogSampler(records_per_second=2.0, record_burst=1)
+        assert sampler.filter(make_level_record(logging.INFO))
+        assert not sampler.filter(make_level_record(logging.INFO))
+        now.return_value = 100.5
+        assert sampler.filter(make_level_record(logging.INFO))
+
+
+def test_log_sampler_attach_starts_a_new_invocation():
+    sampler = LogSampler({logging.DEBUG: 0.0}, records_per_second=0.0, record_burst=1)
+    log_handler = logging.Handler()
+    sampler.attach(log_handler)
+    assert not sampler.filter(make_level_record(logging.DEBUG))
+    assert sampler.filter(make_level_record(logging.INFO))
+    assert not sampler.filter(make_level_record(logging.INFO))
+
+    sampler.attach(log_handler)
+    assert log_handler.filters == [sampler]
+    assert sampler.summary() is None
+    assert sampler.filter(make_level_record(logging.INFO))
+
+
+def test_log_sampler_summary_is_not_filtered(caplog):
+    sampler = LogSampler(records_per_second=0.0, record_burst=0)
+    assert not sampler.filter(make_level_record(logging.INFO))
+    with caplog.at_level(logging.WARNING):
+        sampler.log_summary()
+    assert [sampler.filter(record) for record in caplog.records] == [True]
+    assert "rate limiting dropped 1 records" in caplog.text
+
+    sampler = LogSampler()
+    caplog.clear()
+    sampler.log_summary()
+    assert not caplog.records
+
+
+def test_json_formatter():
+    formatter = JsonFormatter({"service": "my-type"})
+    record = make_record("log %s", 1.5)
+    record.args = ("msg",)
+    assert json.loads(formatter.format(record)) == {
+        "timestamp": 1500,
+        "level": "Level 123",
+        "logger": "a",
+        "service": "my-type",
+        "message": "log msg",
+    }
+
+    with log_context({"action": "CREATE", "stackId": None}) as context:
+        assert get_log_context() == {"action": "CREATE", "stackId": None}
+        formatted = JsonFormatter().format(record)
+    assert get_log_context() == {}
+    assert context.encoded == ',"action":"CREATE","stackId":null'
+    assert json.loads(formatted)["action"] == "CREATE"
+    assert "action" not in json.loads(JsonFormatter().format(record))
+
+
+def test_json_formatter_exception():
+    error = ValueError("bad value")
+    try:
+        raise error
+    except ValueError:
+        pass
+    exc_info = (ValueError, error, error.__traceback__)
+    record = logging.LogRecord("a", logging.ERROR, "/", 234, "failed", [], exc_info)
+    message = json.loads(JsonFormatter().format(record))["message"]
+    assert message.startswith("failed\nTraceback")
+    assert message.endswith("ValueError: bad value")
+
+
+def test_json_formatter_stack_info():
+    record = make_record("log-msg", 1.0)
+    record.stack_info = "Stack (most recent call last):\n  the frames"
+    message = json.loads(JsonFormatter().format(record))["message"]
+    assert message == "log-msg\nStack (most recent call last):\n  the frames"
+
+
+def test_stdout_handler_with_json_formatter():
+    stream = StringIO()
+    log_handler = StdoutLogHandler("a-stream", {"action": "CREATE"}, stream)
+    log_handler.setFormatter(JsonFormatter({"service": "my-type"}))
+    with log_context({"action": "UPDATE"}):
+        log_handler.handle(make_record("log-msg", 1.0))
+    log_handler.handle(make_record("outside", 2.0))
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert lines == [
+        {
+            "timestamp": 1000,
+            "level": "Level 123",
+            "logger": "a",
+            "service": "my-type",
+            "logStream": "a-stream",
+            "action": "UPDATE",
+            "message": "log-msg",
+        },
+        {
+            "timestamp": 2000,
+            "level": "Level 123",
+            "logger": "a",
+            "service": "my-type",
+            "logStream": "a-stream",
+            "action": "CREATE",
+            "message": "outside",
+        },
+    ]
+
+
+def test_queue_handler_formats_with_request_context(mock_provider_handler):
+    log_handler = ProviderLogQueueHandler(mock_provider_handler, LogShippingConfig())
+    log_handler.setFormatter(JsonFormatter())
+    try:
+        with log_context({"action": "CREATE"}):
+            log_handler.handle(make_record("log-msg", 1.0))
+        assert log_handler.drain(5.0)
+    finally:
+        log_handler.listener.stop()
+    put = mock_provider_handler.client.put_log_events
+    message = put.call_args[1]["logEvents"][0]["message"]
+    assert json.loads(message)["action"] == "CREATE"
 
 
 def test__get_existing_logger_no_logger_present(mock_logger):
@@ -483,17 +1007,16 @@ def test__hook_create_already_exists(mock_hook_provider_handler, create_method):
 
 
 @pytest.mark.parametrize("sequence_token", [None, "some-seq"])
-def test__hook_put_log_event_success(mock_hook_provider_handler, sequence_token):
+def test__hook_put_log_events_success(mock_hook_provider_handler, sequence_token):
     mock_hook_provider_handler.sequence_token = sequence_token
     mock_put = mock_hook_provider_handler.client.put_log_events
     mock_put.return_value = {"nextSequenceToken": "some-other-seq"}
-    mock_hook_provider_handler._put_log_event(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
-    )
+    mock_hook_provider_handler._put_log_events([{"timestamp": 1, "message": "log-msg"}])
     mock_put.assert_called_once()
+    assert mock_hook_provider_handler.sequence_token == "some-other-seq"
 
 
-def test__hook_put_log_event_invalid_token(mock_hook_provider_handler):
+def test__hook_put_log_events_invalid_token(mock_hook_provider_handler):
     mock_put = mock_hook_provider_handler.client.put_log_events
     mock_put.return_value = {"nextSequenceToken": "some-other-seq"}
     mock_put.side_effect = [
@@ -501,48 +1024,63 @@ def test__hook_put_log_event_invalid_token(mock_hook_provider_handler):
         logs_exceptions.DataAlreadyAcceptedException({}, operation_name="Test"),
         DEFAULT,
     ]
-    mock_hook_provider_handler._put_log_event(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
-    )
+    mock_hook_provider_handler._put_log_events([{"timestamp": 1, "message": "log-msg"}])
     assert mock_put.call_count == 3
 
 
-def test_hook_emit_existing_cwl_group_stream(mock_hook_provider_handler):
-    mock_hook_provider_handler._put_log_event = Mock()
-    mock_hook_provider_handler.emit(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
-    )
-    mock_hook_provider_handler._put_log_event.assert_called_once()
+def test_hook_emit_buffers_until_flush(mock_hook_provider_handler):
+    mock_put = mock_hook_provider_handler.client.put_log_events
+    mock_hook_provider_handler.emit(make_record("second", 2.0))
+    mock_hook_provider_handler.emit(make_record("first", 1.0))
+    mock_put.assert_not_called()
 
+    mock_hook_provider_handler.flush()
+    mock_put.assert_called_once()
+    assert mock_put.call_args[1]["logEvents"] == [
+        {"timestamp": 1000, "message": "first"},
+        {"timestamp": 2000, "message": "second"},
+    ]
+    mock_hook_provider_handler.client.create_log_stream.assert_called_once()
+    mock_hook_provider_handler.client.create_log_group.assert_not_called()
+
+    # nothing buffered, nothing sent
+    mock_hook_provider_handler.flush()
+    mock_put.assert_called_once()
+
+    # the stream is only created once per handler
+    mock_hook_provider_handler.emit(make_record("third", 3.0))
+    mock_hook_provider_handler.flush()
+    assert mock_put.call_count == 2
+    mock_hook_provider_handler.client.create_log_stream.assert_called_once()
 
-def test_hook_emit_no_group_stream(mock_hook_provider_handler):
+
+def test_hook_flush_no_group_stream(mock_hook_provider_handler):
     group_exc = logs_exceptions.ResourceNotFoundException(
         {"Error": {"Message": "log group does not exist"}},
-        operation_name="PutLogRecords",
-    )
-    mock_hook_provider_handler._put_log_event = Mock()
-    mock_hook_provider_handler._put_log_event.side_effect = [group_exc, DEFAULT]
-    mock_hook_provider_handler._create_log_group = Mock()
-    mock_hook_provider_handler._create_log_stream = Mock()
-    mock_hook_provider_handler.emit(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
+        operation_name="CreateLogStream",
     )
-    assert mock_hook_provider_handler._put_log_event.call_count == 2
-    mock_hook_provider_handler._create_log_group.assert_called_once()
-    mock_hook_provider_handler._create_log_stream.assert_called_once()
+    mock_hook_provider_handler.client.create_log_stream.side_effect = [
+        group_exc,
+        DEFAULT,
+    ]
+    mock_hook_provider_handler.emit(make_record("log-msg", 1.0))
+    mock_hook_provider_handler.flush()
+    mock_hook_provider_handler.client.create_log_group.assert_called_once()
+    assert mock_hook_provider_handler.client.create_log_stream.call_count == 2
+    mock_hook_provider_handler.client.put_log_events.assert_called_once()
 
-    # create_group should not be called again if the group already exists
+    # the stream is created again if it was deleted
     stream_exc = logs_exceptions.ResourceNotFoundException(
         {"Error": {"Message": "log stream does not exist"}},
-        operation_name="PutLogRecords",
-    )
-    mock_hook_provider_handler._put_log_event.side_effect = [stream_exc, DEFAULT]
-    mock_hook_provider_handler.emit(
-        logging.LogRecord("a", 123, "/", 234, "log-msg", [], False)
+        operation_name="PutLogEvents",
     )
-    assert mock_hook_provider_handler._put_log_event.call_count == 4
-    mock_hook_provider_handler._create_log_group.assert_called_once()
-    assert mock_hook_provider_handler._create_log_stream.call_count == 2
+    mock_hook_provider_handler.client.create_log_stream.side_effect = None
+    mock_hook_provider_handler.client.put_log_events.side_effect = [stream_exc, DEFAULT]
+    mock_hook_provider_handler.emit(make_record("log-msg", 2.0))
+    mock_hook_provider_handler.flush()
+    assert mock_hook_provider_handler.client.put_log_events.call_count == 3
+    assert mock_hook_provider_handler.client.create_log_stream.call_count == 3
+    mock_hook_provider_handler.client.create_log_group.assert_called_once()
 
 
 def test__get_existing_hook_logger_no_logger_present(mock_logger):
@@ -1,22 +1,36 @@
 # auto enums `.name` causes no-member
 # pylint: disable=redefined-outer-name,no-member,protected-access
 import pytest
+from cloudformation_cli_python_lib import Hook, Resource
+from cloudformation_cli_python_lib.circuit_breaker import CircuitBreaker
 from cloudformation_cli_python_lib.interface import (
     Action,
+    DropPolicy,
     HookInvocationPoint,
     MetricTypes,
     StandardUnit,
 )
 from cloudformation_cli_python_lib.metrics import (
+    BackgroundMetricsFlusher,
+    CloudWatchMetricsSink,
+    EmbeddedMetricFormatSink,
     HookMetricsPublisher,
+    MetricsAggregator,
     MetricsPublisher,
     MetricsPublisherProxy,
+    MetricsSink,
     format_dimensions,
+    get_handler_metrics,
+    handler_metrics,
 )
+from cloudformation_cli_python_lib.tracing import ApiCall, ApiCallTrace
 
 import botocore.errorfactory
 import botocore.session
-from datetime import datetime
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from io import StringIO
 from unittest.mock import Mock, call, patch
 
 cloudwatch_model = botocore.session.get_session().get_service_model("cloudwatch")
@@ -75,6 +89,7 @@ def test_put_metric_catches_error(mock_session):
             1.0,
             datetime.now(),
         )
+        publisher.flush()
 
     expected_calls = [
         call.error(
@@ -91,6 +106,7 @@ def test_publish_exception_metric(mock_session):
     proxy = MetricsPublisherProxy()
     proxy.add_metrics_publisher(mock_session, RESOURCE_TYPE)
     proxy.publish_exception_metric(fake_datetime, Action.CREATE, Exception("fake-err"))
+    proxy.flush()
     expected_calls = [
         call.client("cloudwatch"),
         call.client().put_metric_data(
@@ -121,6 +137,7 @@ def test_publish_invocation_metric(mock_session):
     proxy = MetricsPublisherProxy()
     proxy.add_metrics_publisher(mock_session, RESOURCE_TYPE)
     proxy.publish_invocation_metric(fake_datetime, Action.CREATE)
+    proxy.flush()
 
     expected_calls = [
         call.client("cloudwatch"),
@@ -148,6 +165,7 @@ def test_publish_duration_metric(mock_session):
     proxy = MetricsPublisherProxy()
     proxy.add_metrics_publisher(mock_session, RESOURCE_TYPE)
     proxy.publish_duration_metric(fake_datetime, Action.CREATE, 100)
+    proxy.flush()
 
     expected_calls = [
         call.client("cloudwatch"),
@@ -175,6 +193,7 @@ def test_publish_log_delivery_exception_metric(mock_session):
     proxy = MetricsPublisherProxy()
     proxy.add_metrics_publisher(mock_session, RESOURCE_TYPE)
     proxy.publish_log_delivery_exception_metric(fake_datetime, TypeError("test"))
+    proxy.flush()
 
     expected_calls = [
         call.client("cloudwatch"),
@@ -234,6 +253,7 @@ def test_put_hook_metric_catches_error(mock_session):
             1.0,
             datetime.now(),
         )
+        publisher.flush()
 
     expected_calls = [
         call.error(
@@ -252,6 +272,7 @@ def test_publish_hook_exception_metric(mock_session):
     proxy.publish_exception_metric(
         fake_datetime, HookInvocationPoint.CREATE_PRE_PROVISION, Exception("fake-err")
     )
+    proxy.flush()
     expected_calls = [
         call.client("cloudwatch"),
         call.client().put_metric_data(
@@ -287,6 +308,7 @@ def test_publish_hook_invocation_metric(mock_session):
     proxy.publish_invocation_metric(
         fake_datetime, HookInvocationPoint.CREATE_PRE_PROVISION
     )
+    proxy.flush()
 
     expected_calls = [
         call.client("cloudwatch"),
@@ -319,6 +341,7 @@ def test_publish_hook_duration_metric(mock_session):
     proxy.publish_duration_metric(
         fake_datetime, HookInvocationPoint.CREATE_PRE_PROVISION, 100
     )
+    proxy.flush()
 
     expected_calls = [
         call.client("cloudwatch"),
@@ -349,6 +372,7 @@ def test_publish_hook_log_delivery_exception_metric(mock_session):
     proxy = MetricsPublisherProxy()
     proxy.add_hook_metrics_publisher(mock_session, HOOK_TYPE, ACCOUNT_ID)
     proxy.publish_log_delivery_exception_metric(fake_datetime, TypeError("test"))
+    proxy.flush()
 
     expected_calls = [
         call.client("cloudwatch"),
@@ -383,3 +407,416 @@ def test_metrics_publisher_proxy_add_metrics_publisher_none_safe():
     proxy.add_metrics_publisher(None, None)
     proxy.add_hook_metrics_publisher(None, None, None)
     assert not proxy._publishers  # pylint: disable=protected-access
+
+
+def test_metrics_are_buffered_until_flush(mock_session):
+    fake_datetime = datetime(2019, 1, 1)
+    proxy = MetricsPublisherProxy()
+    proxy.add_metrics_publisher(mock_session, RESOURCE_TYPE)
+    proxy.publish_invocation_metric(fake_datetime, Action.CREATE)
+    proxy.publish_duration_metric(fake_datetime, Action.CREATE, 100)
+    put_metric_data = mock_session.client.return_value.put_metric_data
+    put_metric_data.assert_not_called()
+
+    proxy.flush()
+
+    put_metric_data.assert_called_once()
+    metric_data = put_metric_data.call_args[1]["MetricData"]
+    assert [datum["MetricName"] for datum in metric_data] == [
+        MetricTypes.HandlerInvocationCount.name,
+        MetricTypes.HandlerInvocationDuration.name,
+    ]
+    # both datums share the cached dimension list
+    assert metric_data[0]["Dimensions"] is metric_data[1]["Dimensions"]
+
+    proxy.flush()
+    put_metric_data.assert_called_once()
+
+
+def test_flush_splits_metric_data_at_request_limit(mock_session):
+    publisher = MetricsPublisher(mock_session, RESOURCE_TYPE)
+    for _ in range(2001):
+        publisher.publish_invocation_metric(datetime(2019, 1, 1), Action.CREATE)
+
+    publisher.flush()
+
+    put_metric_data = mock_session.client.return_value.put_metric_data
+    assert [len(c[1]["MetricData"]) for c in put_metric_data.call_args_list] == [
+        1000,
+        1000,
+        1,
+    ]
+
+
+def test_publisher_requires_session_or_sink():
+    with pytest.raises(ValueError):
+        MetricsPublisher(None, RESOURCE_TYPE)
+
+
+def test_cloudwatch_sink_circuit_breaker(mock_session):
+    mock_put = mock_session.client.return_value.put_metric_data
+    mock_put.side_effect = cloudwatch_exceptions.InternalServiceFault(
+        {"Error": {"Code": "InternalServiceError", "Message": ""}},
+        operation_name="PutMetricData",
+    )
+    breaker = CircuitBreaker(failure_threshold=2)
+    sink = CloudWatchMetricsSink(mock_session, breaker)
+
+    with patch("cloudformation_cli_python_lib.metrics.LOG", autospec=True) as log:
+        for _ in range(4):
+            sink.put_metric_data("ns", [{"Value": 1}])
+
+    assert mock_put.call_count == 2
+    assert log.error.call_count == 2
+    assert breaker.rejected == 2
+
+
+def test_proxy_uses_circuit_breaker(mock_session):
+    breaker = CircuitBreaker()
+    proxy = MetricsPublisherProxy(breaker=breaker)
+    proxy.add_metrics_publisher(mock_session, RESOURCE_TYPE)
+    proxy.add_hook_metrics_publisher(mock_session, HOOK_TYPE, ACCOUNT_ID)
+    sinks = [publisher._sink for publisher in proxy._publishers]
+    assert [sink._breaker for sink in sinks] == [breaker, breaker]
+
+
+def test_publish_api_call_metrics():
+    sink = Mock(spec_set=["put_metric_data"])
+    proxy = MetricsPublisherProxy()
+    proxy.add_metrics_publisher(None, RESOURCE_TYPE, sink)
+    trace = ApiCallTrace()
+    proxy.publish_api_call_metrics(datetime(2019, 1, 1), Action.CREATE, trace)
+    trace.record(ApiCall("ec2", "DescribeVpcs", 10.0, 2, 200))
+    trace.record(ApiCall("ec2", "CreateVpc", 20.0, 0, 200))
+    proxy.publish_api_call_metrics(datetime(2019, 1, 1), Action.CREATE, trace)
+    proxy.flush()
+
+    _namespace, metric_data = sink.put_metric_data.call_args[0]
+    assert [(d["MetricName"], d["Value"], d["Unit"]) for d in metric_data] == [
+        ("ApiCallCount", 2.0, "Count"),
+        ("ApiCallDuration", 30.0, "Milliseconds"),
+        ("ApiCallRetryCount", 2.0, "Count"),
+    ]
+
+
+def test_metrics_sink_put_metric_data_not_implemented():
+    with pytest.raises(NotImplementedError):
+        MetricsSink().put_metric_data(RESOURCE_NAMESPACE, [])
+
+
+def test_embedded_metric_format_sink_aware_timestamp():
+    stream = StringIO()
+    publisher = MetricsPublisher(None, RESOURCE_TYPE, EmbeddedMetricFormatSink(stream))
+    publisher.publish_invocation_metric(
+        datetime(2019, 1, 1, 1, tzinfo=timezone(timedelta(hours=1))), Action.CREATE
+    )
+    publisher.flush()
+
+    assert json.loads(stream.getvalue())["_aws"]["Timestamp"] == 1546300800000
+
+
+def test_embedded_metric_format_sink_rejects_aggregation():
+    with pytest.raises(ValueError) as excinfo:
+        MetricsPublisher(
+            None,
+            RESOURCE_TYPE,
+            EmbeddedMetricFormatSink(StringIO()),
+            aggregator=MetricsAggregator(),
+        )
+    assert "Embedded Metric Format" in str(excinfo.value)
+
+    for type_cls, model_cls in ((Resource, Mock()), (Hook, Mock())):
+        with pytest.raises(ValueError):
+            type_cls(
+                "Test::Foo::Bar",
+                model_cls,
+                metrics_sink=EmbeddedMetricFormatSink(),
+                metrics_aggregator=MetricsAggregator(),
+            )
+
+
+def test_embedded_metric_format_sink():
+    stream = StringIO()
+    resource_publisher = MetricsPublisher(
+        None, RESOURCE_TYPE, EmbeddedMetricFormatSink(stream)
+    )
+    hook_publisher = HookMetricsPublisher(
+        None, HOOK_TYPE, ACCOUNT_ID, EmbeddedMetricFormatSink(stream)
+    )
+    resource_publisher.publish_duration_metric(datetime(2019, 1, 1), Action.CREATE, 100)
+    hook_publisher.publish_invocation_metric(
+        datetime(2019, 1, 1), HookInvocationPoint.CREATE_PRE_PROVISION
+    )
+    resource_publisher.flush()
+    hook_publisher.flush()
+
+    resource_doc, hook_doc = [
+        json.loads(line) for line in stream.getvalue().splitlines()
+    ]
+    assert resource_doc == {
+        "_aws": {
+            "Timestamp": 1546300800000,
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": RESOURCE_NAMESPACE,
+                    "Dimensions": [
+                        ["DimensionKeyActionType", "DimensionKeyResourceType"]
+                    ],
+                    "Metrics": [
+                        {"Name": "HandlerInvocationDuration", "Unit": "Milliseconds"}
+                    ],
+                }
+            ],
+        },
+        "DimensionKeyActionType": "CREATE",
+        "DimensionKeyResourceType": RESOURCE_TYPE,
+        "HandlerInvocationDuration": 100,
+    }
+    metric_directive = hook_doc["_aws"]["CloudWatchMetrics"][0]
+    assert metric_directive["Namespace"] == HOOK_NAMESPACE
+    assert hook_doc["HandlerInvocationCount"] == 1.0
+    assert hook_doc["DimensionKeyHookType"] == HOOK_TYPE
+
+
+class BlockingSink:
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.delivered = []
+
+    def put_metric_data(self, namespace, metric_data):
+        self.entered.set()
+        assert self.release.wait(5)
+        self.delivered.extend((namespace, datum["Value"]) for datum in metric_data)
+
+
+def start_blocked_flusher(sink, **kwargs):
+    flusher = BackgroundMetricsFlusher(max_queue_size=2, **kwargs)
+    flusher.submit(sink, "ns", {"Value": 0})
+    assert sink.entered.wait(5)
+    return flusher
+
+
+def test_background_flusher_delivers_from_thread():
+    sink = Mock(spec_set=["put_metric_data"])
+    context = Mock(spec_set=["get_remaining_time_in_millis"])
+    context.get_remaining_time_in_millis.return_value = 10000
+    proxy = MetricsPublisherProxy(BackgroundMetricsFlusher())
+    proxy.add_metrics_publisher(None, RESOURCE_TYPE, sink)
+
+    proxy.publish_invocation_metric(datetime(2019, 1, 1), Action.CREATE)
+    proxy.publish_duration_metric(datetime(2019, 1, 1), Action.CREATE, 100)
+    proxy.flush(context)
+
+    metric_names = [
+        datum["MetricName"]
+        for c in sink.put_metric_data.call_args_list
+        for datum in c[0][1]
+    ]
+    assert metric_names == [
+        MetricTypes.HandlerInvocationCount.name,
+        MetricTypes.HandlerInvocationDuration.name,
+    ]
+    assert {c[0][0] for c in sink.put_metric_data.call_args_list} == {
+        RESOURCE_NAMESPACE
+    }
+
+
+@pytest.mark.parametrize(
+    "drop_policy,expected",
+    [(DropPolicy.DROP_NEWEST, [0, 1, 2]), (DropPolicy.DROP_OLDEST, [0, 2, 3])],
+)
+def test_background_flusher_drop_policy(drop_policy, expected):
+    sink = BlockingSink()
+    flusher = start_blocked_flusher(sink, drop_policy=drop_policy)
+    for value in (1, 2, 3):
+        flusher.submit(sink, "ns", {"Value": value})
+
+    assert flusher.dropped == 1
+    sink.release.set()
+    assert flusher.drain(5)
+    assert [value for _, value in sink.delivered] == expected
+
+
+def test_background_flusher_block_policy():
+    sink = BlockingSink()
+    flusher = start_blocked_flusher(sink, drop_policy=DropPolicy.BLOCK)
+    flusher.submit(sink, "ns", {"Value": 1})
+    flusher.submit(sink, "ns", {"Value": 2})
+
+    producer = threading.Thread(target=flusher.submit, args=(sink, "ns", {"Value": 3}))
+    producer.start()
+    producer.join(0.05)
+    assert producer.is_alive()
+
+    sink.release.set()
+    producer.join(5)
+    assert flusher.drain(5)
+    assert [value for _, value in sink.delivered] == [0, 1, 2, 3]
+    assert not flusher.dropped
+
+
+def test_background_flusher_drain_respects_deadline():
+    sink = BlockingSink()
+    flusher = start_blocked_flusher(sink)
+    context = Mock(spec_set=["get_remaining_time_in_millis"])
+    context.get_remaining_time_in_millis.return_value = 400
+
+    with patch("cloudformation_cli_python_lib.metrics.LOG", autospec=True) as mock_log:
+        assert not flusher.drain_before_deadline(context)
+    mock_log.warning.assert_called_once()
+
+    sink.release.set()
+    assert flusher.drain_before_deadline(None)
+
+
+def test_background_flusher_discard_drops_queued_datums():
+    sink = BlockingSink()
+    flusher = start_blocked_flusher(sink)
+    flusher.submit(sink, "ns", {"Value": 1})
+
+    # the datum being delivered is waited for
+    assert not flusher.discard(0.05)
+    assert flusher.dropped == 1
+    sink.release.set()
+    assert flusher.discard(5)
+    assert [value for _, value in sink.delivered] == [0]
+
+
+def test_background_flusher_sink_errors_are_logged():
+    sink = Mock(spec_set=["put_metric_data"])
+    sink.put_metric_data.side_effect = Exception("boom")
+    flusher = BackgroundMetricsFlusher()
+
+    with patch("cloudformation_cli_python_lib.metrics.LOG", autospec=True) as mock_log:
+        flusher.submit(sink, "ns", {"Value": 1})
+        assert flusher.drain(5)
+    mock_log.exception.assert_called_once()
+
+
+def invoke_with_aggregator(aggregator, sink, durations, flusher=None):
+    proxy = MetricsPublisherProxy(flusher, aggregator)
+    proxy.add_metrics_publisher(None, RESOURCE_TYPE, sink)
+    for milliseconds in durations:
+        proxy.publish_invocation_metric(datetime(2019, 1, 1), Action.CREATE)
+        proxy.publish_duration_metric(datetime(2019, 1, 1), Action.CREATE, milliseconds)
+    proxy.flush()
+
+
+def test_aggregator_statistic_values_across_invocations():
+    sink = Mock(spec_set=["put_metric_data"])
+    aggregator = MetricsAggregator(interval=3600)
+
+    invoke_with_aggregator(aggregator, sink, [100, 300])
+    invoke_with_aggregator(aggregator, sink, [200])
+    sink.put_metric_data.assert_not_called()
+
+    aggregator.interval = 0
+    invoke_with_aggregator(aggregator, sink, [50])
+
+    sink.put_metric_data.assert_called_once()
+    namespace, (count, duration) = sink.put_metric_data.call_args[0]
+    assert namespace == RESOURCE_NAMESPACE
+    assert count == {
+        "MetricName": MetricTypes.HandlerInvocationCount.name,
+        "Dimensions": [
+            {"Name": "DimensionKeyActionType", "Value": "CREATE"},
+            {"Name": "DimensionKeyResourceType", "Value": RESOURCE_TYPE},
+        ],
+        "Unit": StandardUnit.Count.name,
+        "Timestamp": str(datetime(2019, 1, 1)),
+        "StatisticValues": {
+            "SampleCount": 4.0,
+            "Sum": 4.0,
+            "Minimum": 1.0,
+            "Maximum": 1.0,
+        },
+    }
+    assert duration["StatisticValues"] == {
+        "SampleCount": 4.0,
+        "Sum": 650.0,
+        "Minimum": 50.0,
+        "Maximum": 300.0,
+    }
+    assert not aggregator.collect(force=True)
+
+
+def test_aggregator_values_for_percentiles():
+    sink = Mock(spec_set=["put_metric_data"])
+    aggregator = MetricsAggregator(interval=3600, keep_values=True)
+    durations = [float(ms) for ms in range(200)] + [0.0]
+
+    invoke_with_aggregator(aggregator, sink, durations)
+    ((_, _, metric_data),) = aggregator.collect(force=True)
+
+    count, *duration = metric_data
+    assert (count["Values"], count["Counts"]) == ([1.0], [201.0])
+    assert [len(datum["Values"]) for datum in duration] == [150, 50]
+    assert duration[0]["Values"][:2] == [0.0, 1.0]
+    assert duration[0]["Counts"][:2] == [2.0, 1.0]
+    assert "StatisticValues" not in duration[0]
+
+
+def test_aggregator_flushes_on_series_threshold():
+    sink = Mock(spec_set=["put_metric_data"])
+    aggregator = MetricsAggregator(interval=3600, max_series=2)
+
+    invoke_with_aggregator(aggregator, sink, [100])
+
+    metric_data = sink.put_metric_data.call_args[0][1]
+    assert len(metric_data) == 2
+
+
+def test_aggregator_sends_through_flusher():
+    sink = Mock(spec_set=["put_metric_data"])
+    flusher = BackgroundMetricsFlusher()
+    aggregator = MetricsAggregator(interval=0)
+
+    with patch.object(flusher, "submit", wraps=flusher.submit) as mock_submit:
+        invoke_with_aggregator(aggregator, sink, [100], flusher)
+
+    assert mock_submit.call_count == 2
+    assert sum(len(c[0][1]) for c in sink.put_metric_data.call_args_list) == 2
+
+
+def test_handler_metrics_outside_invocation_are_discarded():
+    get_handler_metrics().publish("ItemsListed", 3)
+
+
+def test_handler_metrics_share_publishers():
+    sink = Mock(spec_set=["put_metric_data"])
+    proxy = MetricsPublisherProxy()
+    proxy.add_metrics_publisher(None, RESOURCE_TYPE, sink)
+    proxy.add_hook_metrics_publisher(None, HOOK_TYPE, ACCOUNT_ID, sink)
+
+    with handler_metrics(proxy, Action.LIST) as metrics:
+        assert get_handler_metrics() is metrics
+        metrics.publish("ItemsListed", 3, dimensions={"Page": "1"})
+        get_handler_metrics().publish("ApiCalls")
+        get_handler_metrics().publish(
+            "Stabilization", 2.5, StandardUnit.Seconds, {"Attempt": "2"}
+        )
+    get_handler_metrics().publish("Discarded")
+    proxy.flush()
+
+    resource_call, hook_call = sink.put_metric_data.call_args_list
+    namespace, (items, api_calls, stabilization) = resource_call[0]
+    assert namespace == RESOURCE_NAMESPACE
+    assert items["MetricName"] == "ItemsListed"
+    assert items["Value"] == 3
+    assert items["Unit"] == "Count"
+    assert items["Dimensions"] == [
+        {"Name": "DimensionKeyActionType", "Value": "LIST"},
+        {"Name": "Page", "Value": "1"},
+        {"Name": "DimensionKeyResourceType", "Value": RESOURCE_TYPE},
+    ]
+    assert (api_calls["MetricName"], api_calls["Value"]) == ("ApiCalls", 1.0)
+    assert (stabilization["Unit"], stabilization["Value"]) == ("Seconds", 2.5)
+
+    namespace, metric_data = hook_call[0]
+    assert namespace == HOOK_NAMESPACE
+    assert metric_data[0]["Dimensions"] == [
+        {"Name": "DimensionKeyInvocationPointType", "Value": "LIST"},
+        {"Name": "Page", "Value": "1"},
+        {"Name": "DimensionKeyHookType", "Value": HOOK_TYPE},
+    ]
@@ -0,0 +1,120 @@
+# pylint: disable=protected-access
+import pytest
+from cloudformation_cli_python_lib.profiling import (
+    Profile,
+    SamplingProfiler,
+    _collapse,
+    _frame_name,
+    _Sampler,
+)
+
+import logging
+import sys
+import threading
+import time
+from unittest.mock import patch
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_collapse_is_outermost_first():
+    def inner():
+        return _collapse(sys._getframe())
+
+    stack = inner().split(";")
+    assert stack[-1].startswith("inner (")
+    assert stack[-2].startswith("test_collapse_is_outermost_first (")
+    assert _collapse(sys._getframe(), max_depth=1) == _frame_name(sys._getframe())
+
+
+def test_profile_collapsed():
+    profile = Profile("CREATE")
+    profile.stacks.update({"a;b": 3, "a;c": 1})
+    assert profile.samples == 4
+    assert profile.collapsed() == "a;b 3\na;c 1"
+    assert profile.collapsed(1) == "a;b 3"
+    assert profile.collapsed(max_bytes=len("a;b 3\na;c 1")) == "a;b 3\na;c 1"
+    assert profile.collapsed(max_bytes=len("a;b 3\na;c 1") - 1) == "a;b 3"
+    assert profile.collapsed(max_bytes=1) == ""
+
+
+def test_sampler_skips_finished_threads():
+    profile = Profile("CREATE")
+    sampler = _Sampler(threading.get_ident(), 0.001, profile)
+    # the sampled thread has finished, so it has no frame
+    with patch(
+        "cloudformation_cli_python_lib.profiling.sys._current_frames", return_value={}
+    ) as mock_frames:
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+    mock_frames.assert_called()
+    assert not profile.stacks
+
+
+def test_slow_calls_are_logged(caplog):
+    profiler = SamplingProfiler(threshold=0.05, interval=0.005)
+    with caplog.at_level(logging.WARNING), profiler.profile("CREATE") as profile:
+        busy(0.1)
+
+    assert profile.kept
+    assert profile.duration >= 0.05
+    assert any("busy (" in stack for stack in profile.stacks)
+    assert "Profile of CREATE" in caplog.text
+    assert profile.collapsed(1) in caplog.text
+
+
+def test_logged_profile_fits_the_byte_budget(caplog):
+    profiler = SamplingProfiler(threshold=0.0)
+    profile = Profile("CREATE")
+    profile.stacks.update({f"{'a' * 1000};{i}": 100 - i for i in range(100)})
+    with caplog.at_level(logging.WARNING), patch(
+        "cloudformation_cli_python_lib.profiling.MAX_LOGGED_PROFILE_BYTES", 5000
+    ):
+        profiler._report(profile)
+
+    (record,) = caplog.records
+    logged = record.getMessage().split("\n", 1)[1]
+    assert logged == profile.collapsed(4)
+
+
+def test_fast_calls_are_discarded(caplog):
+    profiler = SamplingProfiler(threshold=10.0, interval=0.001)
+    with caplog.at_level(logging.WARNING), profiler.profile("READ") as profile:
+        busy(0.02)
+
+    assert not profile.kept
+    assert not profile.stacks
+    assert not caplog.text
+
+
+def test_samples_on_exception():
+    profiler = SamplingProfiler(threshold=0.0, interval=0.001)
+    with pytest.raises(ValueError), profiler.profile("DELETE") as profile:
+        busy(0.02)
+        raise ValueError()
+    assert profile.kept
+
+
+def test_profiles_written_to_output_dir(tmp_path):
+    output_dir = tmp_path / "profiles"
+    profiler = SamplingProfiler(threshold=0.0, interval=0.001, output_dir=output_dir)
+    with profiler.profile("UPDATE") as profile:
+        busy(0.02)
+
+    (path,) = output_dir.iterdir()
+    assert path.name.startswith("UPDATE-")
+    assert path.suffix == ".collapsed"
+    assert path.read_text() == profile.collapsed() + "\n"
+
+
+def test_failure_to_write_is_logged(tmp_path, caplog):
+    profiler = SamplingProfiler(threshold=0.0, interval=0.001, output_dir=tmp_path)
+    with patch("pathlib.Path.write_text", side_effect=OSError("full")):
+        with profiler.profile("UPDATE"):
+            busy(0.02)
+    assert "Failed to write the profile of UPDATE" in caplog.text
@@ -0,0 +1,118 @@
+import pytest
+from cloudformation_cli_python_lib.interface import HookContext
+from cloudformation_cli_python_lib.query import (
+    MAX_COMPILED_QUERIES,
+    WILDCARD,
+    PathQuery,
+    QueryCache,
+    compile_query,
+)
+
+from unittest.mock import patch
+
+TARGET_MODEL = {
+    "resourceProperties": {
+        "BucketName": "my-bucket",
+        "Tags": [{"Key": "a", "Value": "1"}, {"Key": "b", "Value": "2"}],
+        "Rules": {"first": {"Enabled": "true"}, "second": {"Enabled": "false"}},
+        "dotted.key": "dotted",
+    }
+}
+
+
+@pytest.mark.parametrize(
+    "expression,expected",
+    [
+        ("resourceProperties.BucketName", "my-bucket"),
+        ("$.resourceProperties.BucketName", "my-bucket"),
+        ("resourceProperties.Tags[1].Key", "b"),
+        ("resourceProperties.Tags[-1].Value", "2"),
+        ("resourceProperties['dotted.key']", "dotted"),
+        ('resourceProperties["BucketName"]', "my-bucket"),
+        ("resourceProperties.Missing", None),
+        ("resourceProperties.Tags[5]", None),
+        ("resourceProperties.BucketName.Nested", None),
+        ("resourceProperties.Tags.Key", None),
+    ],
+)
+def test_singular_query(expression, expected):
+    query = compile_query(expression)
+    assert query.is_singular
+    assert query.get(TARGET_MODEL) == expected
+
+
+@pytest.mark.parametrize(
+    "expression,expected",
+    [
+        ("resourceProperties.Tags[*].Key", ["a", "b"]),
+        ("resourceProperties.Tags.*.Value", ["1", "2"]),
+        ("resourceProperties.Rules.*.Enabled", ["true", "false"]),
+        ("*.BucketName", ["my-bucket"]),
+        ("resourceProperties.BucketName[*]", []),
+        ("resourceProperties.Missing[*].Key", []),
+    ],
+)
+def test_wildcard_query(expression, expected):
+    query = compile_query(expression)
+    assert not query.is_singular
+    assert query.get(TARGET_MODEL) == expected
+
+
+def test_query_default():
+    assert compile_query("a.b").get({}, default="x") == "x"
+
+
+@pytest.mark.parametrize("expression", ["a..b", "a[", "a[x]", "a['b]"])
+def test_invalid_query(expression):
+    with pytest.raises(ValueError) as excinfo:
+        PathQuery(expression)
+    assert expression in str(excinfo.value)
+
+
+def test_compile_query_is_cached():
+    assert compile_query("a.b") is compile_query("a.b")
+    assert PathQuery("a.b") == compile_query("a.b")
+    assert PathQuery("a.b") != "a.b"
+    assert repr(PathQuery("a.b")) == "PathQuery('a.b')"
+
+
+def test_query_cache_memoizes_results():
+    cache = QueryCache(TARGET_MODEL)
+    query = compile_query("resourceProperties.Tags[*].Key")
+
+    with patch.object(PathQuery, "find", autospec=True, return_value=["a"]) as find:
+        assert cache.get(query) == ["a"]
+        assert cache.get("resourceProperties.Tags[*].Key") == ["a"]
+        assert cache.find(query) == ["a"]
+
+    find.assert_called_once_with(query, TARGET_MODEL)
+    assert cache.get("resourceProperties.Missing", "x") == "x"
+
+
+def test_query_cache_returns_copies():
+    cache = QueryCache(TARGET_MODEL)
+    cache.find("resourceProperties.Tags[*].Key").append("c")
+    cache.get("resourceProperties.Tags[*].Key").clear()
+    assert cache.find("resourceProperties.Tags[*].Key") == ["a", "b"]
+
+
+def test_compile_query_cache_is_bounded():
+    assert compile_query.cache_info().maxsize == MAX_COMPILED_QUERIES
+    assert repr(WILDCARD) == "*"
+
+
+def test_hook_context_query():
+    hook_context = HookContext(
+        awsAccountId=None,
+        stackId=None,
+        hookTypeName=None,
+        hookTypeVersion=None,
+        invocationPoint=None,
+        targetName=None,
+        targetType=None,
+        targetLogicalId=None,
+        targetModel=TARGET_MODEL,
+    )
+    assert hook_context.query("resourceProperties.BucketName") == "my-bucket"
+    assert hook_context.query("resourceProperties.Tags[*].Key") == ["a", "b"]
+    assert hook_context.query("resourceProperties.Missing", "x") == "x"
@@ -0,0 +1,297 @@
+# pylint: disable=protected-access
+import pytest
+from cloudformation_cli_python_lib.boto3_proxy import (
+    _create_session,
+    _SwappableCredentials,
+)
+from cloudformation_cli_python_lib.read_cache import ReadCache
+from cloudformation_cli_python_lib.utils import Credentials
+
+import threading
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from io import BytesIO
+from unittest.mock import patch
+
+CREDENTIALS = Credentials("a", "b", "c")
+OTHER_CREDENTIALS = Credentials("d", "e", "f")
+
+
+def cached_client(cache, service_name="s3"):
+    proxy = _create_session(
+        CREDENTIALS, "us-east-1", _SwappableCredentials(CREDENTIALS)
+    )
+    uncached = proxy.client(service_name)
+    proxy.enable_read_cache(cache)
+    client = proxy.client(service_name)
+    assert client is not uncached
+    return proxy, client
+
+
+def test_enabling_the_same_cache_again_keeps_clients():
+    cache = ReadCache()
+    proxy, client = cached_client(cache)
+    proxy.enable_read_cache(cache)
+    assert proxy.client("s3") is client
+
+
+def test_caches_reads_for_the_invocation():
+    cache = ReadCache()
+    _proxy, client = cached_client(cache)
+    with Stubber(client) as stubber:
+        stubber.add_response("list_buckets", {"Buckets": [{"Name": "b"}]})
+        stubber.add_response("get_bucket_tagging", {"TagSet": []}, {"Bucket": "b"})
+        first = client.list_buckets()
+        first["Buckets"].clear()  # callers get their own copy
+        assert client.list_buckets()["Buckets"] == [{"Name": "b"}]
+        client.get_bucket_tagging(Bucket="b")
+        client.get_bucket_tagging(Bucket="b")
+        stubber.assert_no_pending_responses()
+
+    assert (cache.hits, cache.misses) == (2, 2)
+    cache.start_invocation()
+    with Stubber(client) as stubber:
+        stubber.add_response("list_buckets", {"Buckets": []})
+        assert client.list_buckets()["Buckets"] == []
+
+
+def test_params_are_part_of_the_key():
+    _proxy, client = cached_client(ReadCache())
+    with Stubber(client) as stubber:
+        stubber.add_response("get_bucket_tagging", {"TagSet": []}, {"Bucket": "a"})
+        stubber.add_response("get_bucket_tagging", {"TagSet": []}, {"Bucket": "b"})
+        client.get_bucket_tagging(Bucket="a")
+        client.get_bucket_tagging(Bucket="b")
+        client.get_bucket_tagging(Bucket="a")
+        stubber.assert_no_pending_responses()
+
+
+def test_credentials_are_part_of_the_key():
+    proxy, client = cached_client(ReadCache())
+    with Stubber(client) as stubber:
+        stubber.add_response("list_buckets", {"Buckets": []})
+        stubber.add_response("list_buckets", {"Buckets": [{"Name": "other"}]})
+        client.list_buckets()
+        proxy.swap_credentials(OTHER_CREDENTIALS)
+        assert client.list_buckets()["Buckets"] == [{"Name": "other"}]
+
+
+def test_mutating_call_invalidates_the_service():
+    cache = ReadCache()
+    _proxy, client = cached_client(cache)
+    with Stubber(client) as stubber:
+        stubber.add_response("list_buckets", {"Buckets": []})
+        stubber.add_response("create_bucket", {}, {"Bucket": "b"})
+        stubber.add_response("list_buckets", {"Buckets": [{"Name": "b"}]})
+        client.list_buckets()
+        client.create_bucket(Bucket="b")
+        assert client.list_buckets()["Buckets"] == [{"Name": "b"}]
+        stubber.assert_no_pending_responses()
+
+
+def test_mutating_call_keeps_other_services():
+    cache = ReadCache()
+    proxy, s3 = cached_client(cache)
+    sqs = proxy.client("sqs")
+    with Stubber(s3) as s3_stubber, Stubber(sqs) as sqs_stubber:
+        s3_stubber.add_response("list_buckets", {"Buckets": []})
+        sqs_stubber.add_response("delete_queue", {}, {"QueueUrl": "q"})
+        s3.list_buckets()
+        sqs.delete_queue(QueueUrl="q")
+        s3.list_buckets()
+        s3_stubber.assert_no_pending_responses()
+    assert cache.hits == 1
+
+
+def test_ttl_expires_responses():
+    _proxy, client = cached_client(ReadCache(ttl=5.0))
+    with Stubber(client) as stubber, patch(
+        "cloudformation_cli_python_lib.read_cache.time.monotonic"
+    ) as mock_monotonic:
+        stubber.add_response("list_buckets", {"Buckets": []})
+        stubber.add_response("list_buckets", {"Buckets": [{"Name": "b"}]})
+        mock_monotonic.return_value = 100.0
+        client.list_buckets()
+        mock_monotonic.return_value = 104.0
+        assert client.list_buckets()["Buckets"] == []
+        mock_monotonic.return_value = 105.0
+        assert client.list_buckets()["Buckets"] == [{"Name": "b"}]
+
+
+@pytest.mark.parametrize("ttl", [None, 0.0, -1.0])
+def test_ttl_must_be_positive(ttl):
+    with pytest.raises(ValueError):
+        ReadCache(ttl=ttl)
+
+
+def test_reads_overlapping_a_mutation_are_not_cached():
+    cache = ReadCache()
+    _proxy, client = cached_client(cache)
+
+    def make_api_call(_operation_name, _api_params):
+        # the bucket is created while the read is in flight
+        cache.call(client, lambda *_: {}, "CreateBucket", {"Bucket": "b"})
+        return {"Buckets": []}
+
+    assert cache.call(client, make_api_call, "ListBuckets", {}) == {"Buckets": []}
+    assert not cache._entries
+
+
+def test_mutation_invalidates_reads_made_while_it_runs():
+    cache = ReadCache()
+    _proxy, client = cached_client(cache)
+
+    def create_bucket(_operation_name, _api_params):
+        assert cache.call(client, read, "ListBuckets", {}) == {"Buckets": []}
+        return {}
+
+    def read(_operation_name, _api_params):
+        return {"Buckets": []}
+
+    cache.call(client, create_bucket, "CreateBucket", {})
+    assert not cache._entries
+
+
+def test_reads_after_an_invalidation_do_not_join_earlier_calls():
+    cache = ReadCache()
+    _proxy, client = cached_client(cache)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def make_api_call(_operation_name, _api_params):
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+        return {"Buckets": [{"Name": str(len(calls))}]}
+
+    results = {}
+
+    def read():
+        name = threading.current_thread().name
+        results[name] = cache.call(client, make_api_call, "ListBuckets", {})
+
+    leader = threading.Thread(target=read, name="leader")
+    leader.start()
+    started.wait(5)
+    cache.invalidate("s3")
+    read()
+    release.set()
+    leader.join(5)
+
+    assert calls == ["leader", "MainThread"]
+    assert results["MainThread"] == {"Buckets": [{"Name": "2"}]}
+    assert not cache.coalesced
+
+
+def test_streaming_responses_are_not_cached():
+    _proxy, client = cached_client(ReadCache())
+    params = {"Bucket": "b", "Key": "k"}
+    with Stubber(client) as stubber:
+        for body in (b"first", b"second"):
+            stubber.add_response(
+                "get_object", {"Body": StreamingBody(BytesIO(body), len(body))}, params
+            )
+        assert client.get_object(**params)["Body"].read() == b"first"
+        assert client.get_object(**params)["Body"].read() == b"second"
+
+
+def test_custom_read_prefixes():
+    cache = ReadCache(read_prefixes=("Head",))
+    assert cache.is_read("HeadBucket")
+    assert not cache.is_read("ListBuckets")
+    _proxy, client = cached_client(cache)
+    with Stubber(client) as stubber:
+        stubber.add_response("list_buckets", {"Buckets": []})
+        stubber.add_response("list_buckets", {"Buckets": []})
+        client.list_buckets()
+        client.list_buckets()
+        stubber.assert_no_pending_responses()
+
+
+def test_errors_are_not_cached():
+    _proxy, client = cached_client(ReadCache())
+    with Stubber(client) as stubber:
+        stubber.add_client_error("list_buckets", "Throttling", http_status_code=400)
+        stubber.add_response("list_buckets", {"Buckets": []})
+        try:
+            client.list_buckets()
+        except client.exceptions.ClientError:
+            pass
+        assert client.list_buckets()["Buckets"] == []
+        assert not ReadCache()._flights
+
+
+def test_coalesces_concurrent_reads():
+    cache = ReadCache()
+    _proxy, client = cached_client(cache)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def make_api_call(operation_name, _api_params):
+        calls.append(operation_name)
+        started.set()
+        release.wait(5)
+        return {"Buckets": [{"Name": "b"}]}
+
+    results = []
+
+    def read():
+        results.append(cache.call(client, make_api_call, "ListBuckets", {}))
+
+    leader = threading.Thread(target=read)
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=read) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while cache.coalesced < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert calls == ["ListBuckets"]
+    assert results == [{"Buckets": [{"Name": "b"}]}] * 4
+    assert cache.coalesced == 3
+
+
+def test_coalesced_reads_retry_after_a_failure():
+    cache = ReadCache()
+    _proxy, client = cached_client(cache)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def make_api_call(_operation_name, _api_params):
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+            raise ValueError("failed")
+        return {"Buckets": []}
+
+    def lead():
+        try:
+            cache.call(client, make_api_call, "ListBuckets", {})
+        except ValueError:
+            pass
+
+    results = []
+    leader = threading.Thread(target=lead, name="leader")
+    follower = threading.Thread(
+        target=lambda: results.append(
+            cache.call(client, make_api_call, "ListBuckets", {})
+        ),
+        name="follower",
+    )
+    leader.start()
+    started.wait(5)
+    follower.start()
+    while not cache.coalesced:
+        threading.Event().wait(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert calls == ["leader", "follower"]
+    assert results == [{"Buckets": []}]
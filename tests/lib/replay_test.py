@@ -0,0 +1,168 @@
+import pytest
+from cloudformation_cli_python_lib.replay import (
+    Cassette,
+    ReplayError,
+    ReplayingSessionProxy,
+    _decode,
+    _encode,
+)
+from cloudformation_cli_python_lib.utils import Credentials
+
+import json
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+from datetime import datetime, timezone
+from io import BytesIO
+from unittest.mock import call, patch
+
+CREDENTIALS = Credentials("a", "b", "c")
+CREATED = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+
+def record(cassette):
+    proxy = cassette.record_sessions()(CREDENTIALS, "us-east-1", identity="caller")
+    client = proxy.client("s3")
+    with cassette, Stubber(client) as stubber:
+        stubber.add_response(
+            "list_buckets", {"Buckets": [{"Name": "b", "CreationDate": CREATED}]}
+        )
+        stubber.add_response(
+            "get_object",
+            {"Body": StreamingBody(BytesIO(b"content"), 7)},
+            {"Bucket": "b", "Key": "k"},
+        )
+        stubber.add_client_error(
+            "head_bucket", "NotFound", http_status_code=404, expected_params=None
+        )
+
+        assert client.list_buckets()["Buckets"][0]["CreationDate"] == CREATED
+        assert client.get_object(Bucket="b", Key="k")["Body"].read() == b"content"
+        with pytest.raises(ClientError):
+            client.head_bucket(Bucket="missing")
+
+
+def test_session_factories_return_none_without_credentials(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.json")
+    assert cassette.record_sessions()(None) is None
+    assert cassette.replay_sessions()(None) is None
+
+
+@pytest.mark.parametrize("factory", ["record_sessions", "replay_sessions"])
+def test_provider_sessions_are_not_recorded_or_replayed(tmp_path, factory):
+    cassette = Cassette(tmp_path / "cassette.json")
+    with patch(
+        "cloudformation_cli_python_lib.replay._get_boto_session"
+    ) as mock_session:
+        proxy = getattr(cassette, factory)()(
+            CREDENTIALS, "us-east-1", identity="provider"
+        )
+
+    assert proxy is mock_session.return_value
+    mock_session.assert_called_once_with(
+        CREDENTIALS, "us-east-1", "provider", None, None
+    )
+
+
+def test_record_saves_once_on_exit(tmp_path):
+    path = tmp_path / "cassette.json"
+    cassette = Cassette(path)
+    with patch.object(cassette, "save", wraps=cassette.save) as save:
+        record(cassette)
+    save.assert_called_once_with()
+    assert len(Cassette(path).interactions) == 3
+
+    # nothing new to save
+    with patch.object(cassette, "save") as save:
+        with cassette:
+            pass
+    save.assert_not_called()
+
+
+def test_encode_and_decode_values():
+    value = {"bytes": b"raw", "set": {1}, "items": ("a", 1.5, None)}
+    assert _decode(_encode(value)) == {
+        "bytes": b"raw",
+        "set": repr({1}),
+        "items": ["a", 1.5, None],
+    }
+
+
+def test_record_and_replay(tmp_path):
+    path = tmp_path / "cassettes" / "s3.json"
+    record(Cassette(path))
+
+    with path.open() as f:
+        recorded = json.load(f)
+    assert recorded["version"] == 1
+    assert [i["operation"] for i in recorded["interactions"]] == [
+        "ListBuckets",
+        "GetObject",
+        "HeadBucket",
+    ]
+    params = recorded["interactions"][1]["params"]
+    assert (params["Bucket"], params["Key"]) == ("b", "k")
+    assert recorded["interactions"][2]["statusCode"] == 404
+
+    cassette = Cassette(path)
+    for _ in range(2):  # every session replays from the start
+        proxy = cassette.replay_sessions()(CREDENTIALS, "us-east-1")
+        assert isinstance(proxy, ReplayingSessionProxy)
+        client = proxy.client("s3")
+
+        bucket = client.list_buckets()["Buckets"][0]
+        assert bucket == {"Name": "b", "CreationDate": CREATED}
+        assert client.get_object(Bucket="b", Key="k")["Body"].read() == b"content"
+        with pytest.raises(client.exceptions.ClientError) as excinfo:
+            client.head_bucket(Bucket="missing")
+        assert excinfo.value.response["Error"]["Code"] == "NotFound"
+
+        with pytest.raises(ReplayError):
+            client.list_buckets()
+
+
+def test_replay_matches_params(tmp_path):
+    path = tmp_path / "cassette.json"
+    record(Cassette(path))
+
+    client = Cassette(path).replay_sessions()(CREDENTIALS).client("s3", "us-east-1")
+    with pytest.raises(ReplayError) as excinfo:
+        client.get_object(Bucket="b", Key="other")
+    assert "s3.GetObject" in str(excinfo.value)
+
+    client = (
+        Cassette(path, match_params=False)
+        .replay_sessions()(CREDENTIALS)
+        .client("s3", "us-east-1")
+    )
+    assert client.get_object(Bucket="b", Key="other")["Body"].read() == b"content"
+
+
+def test_replay_injects_latency(tmp_path):
+    path = tmp_path / "cassette.json"
+    record(Cassette(path))
+    cassette = Cassette(path)
+    duration_ms = cassette.interactions[0]["durationMs"]
+
+    client = cassette.replay_sessions(0.5)(CREDENTIALS, "us-east-1").client("s3")
+    recorded = cassette.replay_sessions(0.5, recorded_latency=True)(
+        CREDENTIALS, "us-east-1"
+    ).client("s3")
+    without = cassette.replay_sessions()(CREDENTIALS, "us-east-1").client("s3")
+
+    with patch("cloudformation_cli_python_lib.replay.time.sleep") as mock_sleep:
+        client.list_buckets()
+        recorded.list_buckets()
+        without.list_buckets()
+
+    assert mock_sleep.call_args_list == [
+        call(0.5),
+        call(pytest.approx(0.5 + duration_ms / 1000.0)),
+    ]
+
+
+def test_load_unsupported_version(tmp_path):
+    path = tmp_path / "cassette.json"
+    path.write_text(json.dumps({"version": 0, "interactions": []}))
+    with pytest.raises(ReplayError):
+        Cassette(path)
@@ -7,14 +7,21 @@ from cloudformation_cli_python_lib.interface import (
     Action,
     BaseModel,
     HandlerErrorCode,
+    LogDelivery,
     OperationStatus,
     ProgressEvent,
 )
+from cloudformation_cli_python_lib.log_delivery import (
+    LogShippingConfig,
+    ProviderLogQueueHandler,
+    get_log_context,
+)
+from cloudformation_cli_python_lib.metrics import MetricsAggregator, get_handler_metrics
 from cloudformation_cli_python_lib.resource import Resource, _ensure_serialize
 from cloudformation_cli_python_lib.utils import Credentials, HandlerRequest
 
 from datetime import datetime
-from unittest.mock import Mock, call, patch, sentinel
+from unittest.mock import MagicMock, Mock, call, create_autospec, patch, sentinel
 
 ENTRYPOINT_PAYLOAD = {
     "awsAccountId": "123456789012",
@@ -101,6 +108,107 @@ def test_entrypoint_success():
     mock_handler.assert_called_once()
 
 
+def test_entrypoint_metrics_flush_failure_is_not_fatal():
+    resource = Resource(TYPE_NAME, Mock(), Mock())
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"
+    ), patch(
+        "cloudformation_cli_python_lib.resource.MetricsPublisherProxy"
+    ) as mock_metrics:
+        mock_metrics.return_value.flush.side_effect = Exception("network down")
+        event = resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_metrics.return_value.flush.assert_called_once()
+    assert event["status"] == OperationStatus.SUCCESS.name  # pylint: disable=no-member
+
+
+def test_entrypoint_log_flush_failure_is_not_fatal(capsys):
+    resource = Resource(TYPE_NAME, Mock(), Mock())
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.resource.MetricsPublisherProxy"
+    ):
+        mock_log_delivery.return_value.flush.side_effect = Exception("throttled")
+        event = resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_log_delivery.return_value.flush.assert_called_once()
+    assert "Failed to deliver provider logs throttled" in capsys.readouterr().out
+    assert event["status"] == OperationStatus.SUCCESS.name  # pylint: disable=no-member
+
+
+def test_entrypoint_drains_queued_logs():
+    shipping = LogShippingConfig()
+    resource = Resource(TYPE_NAME, Mock(), Mock(), log_shipping=shipping)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+    log_handler = create_autospec(ProviderLogQueueHandler, instance=True)
+
+    with patch(
+        "cloudformation_cli_python_lib.resource.ProviderLogHandler.setup",
+        return_value=log_handler,
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.resource.MetricsPublisherProxy"
+    ):
+        resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    assert mock_log_delivery.call_args[0][3] is shipping
+    log_handler.drain_before_deadline.assert_called_once_with(None)
+    log_handler.flush.assert_not_called()
+
+
+def test_entrypoint_stdout_log_delivery():
+    resource = Resource(TYPE_NAME, Mock(), Mock(), log_delivery=LogDelivery.STDOUT)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.resource.StdoutLogHandler.setup"
+    ) as mock_stdout, patch(
+        "cloudformation_cli_python_lib.resource.MetricsPublisherProxy"
+    ):
+        resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    mock_log_delivery.assert_not_called()
+    mock_stdout.assert_called_once()
+    mock_stdout.return_value.flush.assert_called_once()
+
+
+def test_entrypoint_log_sampler():
+    log_sampler = Mock()
+    resource = Resource(TYPE_NAME, Mock(), Mock(), log_sampler=log_sampler)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+
+    with patch(
+        "cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"
+    ) as mock_log_delivery, patch(
+        "cloudformation_cli_python_lib.resource.MetricsPublisherProxy"
+    ):
+        resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    log_sampler.attach.assert_called_once_with(mock_log_delivery.return_value)
+    log_sampler.log_summary.assert_called_once_with()
+
+
 def test_entrypoint_handler_raises():
     @dataclass
     class ResourceModel(BaseModel):
@@ -133,6 +241,7 @@ def test_entrypoint_handler_raises():
         )
 
     mock_metrics.return_value.publish_exception_metric.assert_called_once()
+    mock_metrics.return_value.flush.assert_called_once()
     assert event == {
         "errorCode": "InvalidRequest",
         "message": "handler failed",
@@ -202,6 +311,212 @@ def test_entrypoint_ignore_remove_fields_from_response():
     mock_handler.assert_called_once()
 
 
+def test_entrypoint_metrics_sink_without_log_group():
+    mock_sink = Mock(spec_set=["put_metric_data"])
+    resource = Resource(TYPE_NAME, Mock(), Mock(), metrics_sink=mock_sink)
+
+    @resource.handler(Action.CREATE)
+    def create(_session, _request, _callback_context):
+        get_handler_metrics().publish("ItemsCreated", 2)
+        return ProgressEvent(status=OperationStatus.SUCCESS, message="")
+
+    payload = ENTRYPOINT_PAYLOAD.copy()
+    payload["requestData"] = payload["requestData"].copy()
+    payload["requestData"]["providerLogGroupName"] = None
+
+    with patch("cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"):
+        resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, payload, None
+        )
+
+    mock_sink.put_metric_data.assert_called_once()
+    namespace, metric_data = mock_sink.put_metric_data.call_args[0]
+    assert namespace == "AWS/CloudFormation/AWS/Test/TestModel"
+    assert [datum["MetricName"] for datum in metric_data] == [
+        "HandlerInvocationCount",
+        "ItemsCreated",
+        "HandlerInvocationDuration",
+    ]
+
+
+def test_entrypoint_sets_log_context():
+    resource = Resource(TYPE_NAME, Mock(), Mock())
+    contexts = []
+
+    @resource.handler(Action.CREATE)
+    def create(_session, _request, _callback_context):
+        contexts.append(get_log_context())
+        return ProgressEvent(status=OperationStatus.SUCCESS, message="")
+
+    with patch(
+        "cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"
+    ), patch("cloudformation_cli_python_lib.resource.MetricsPublisherProxy"):
+        resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    assert contexts == [
+        {
+            "action": "CREATE",
+            "resourceType": ENTRYPOINT_PAYLOAD["resourceType"],
+            "clientRequestToken": ENTRYPOINT_PAYLOAD["bearerToken"],
+            "stackId": ENTRYPOINT_PAYLOAD["stackId"],
+            "logicalResourceId": ENTRYPOINT_PAYLOAD["requestData"]["logicalResourceId"],
+        }
+    ]
+    assert get_log_context() == {}
+
+
+def test_entrypoint_traces_caller_api_calls():
+    session_factory = Mock()
+    resource = Resource(
+        TYPE_NAME, Mock(), Mock(), session_factory=session_factory, trace_api_calls=True
+    )
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+    caller_sess, provider_sess = Mock(), Mock()
+    session_factory.side_effect = lambda *args, identity, **kwargs: {
+        "caller": caller_sess,
+        "provider": provider_sess,
+    }[identity]
+
+    with patch(
+        "cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"
+    ), patch(
+        "cloudformation_cli_python_lib.resource.MetricsPublisherProxy"
+    ) as mock_metrics:
+        resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    caller_sess.enable_api_call_tracing.assert_called_once_with()
+    provider_sess.enable_api_call_tracing.assert_not_called()
+    mock_metrics.return_value.publish_api_call_metrics.assert_called_once()
+
+
+def test_entrypoint_caches_caller_reads():
+    session_factory, read_cache = Mock(), Mock()
+    resource = Resource(
+        TYPE_NAME,
+        Mock(),
+        Mock(),
+        session_factory=session_factory,
+        read_cache=read_cache,
+    )
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+    caller_sess, provider_sess = Mock(), Mock()
+    session_factory.side_effect = lambda *args, identity, **kwargs: {
+        "caller": caller_sess,
+        "provider": provider_sess,
+    }[identity]
+
+    with patch("cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"):
+        resource.__call__.__wrapped__(  # pylint: disable=no-member
+            resource, ENTRYPOINT_PAYLOAD, None
+        )
+
+    caller_sess.enable_read_cache.assert_called_once_with(read_cache)
+    provider_sess.enable_read_cache.assert_not_called()
+    caller_sess.enable_api_call_tracing.assert_not_called()
+    read_cache.start_invocation.assert_called_once_with()
+
+
+def test_entrypoint_discards_undelivered_before_swapping_credentials():
+    manager = Mock()
+    resource = Resource(
+        TYPE_NAME,
+        Mock(),
+        session_factory=manager.session_factory,
+        metrics_flusher=manager.flusher,
+    )
+    manager.flusher.drain_timeout = 1.0
+
+    with patch(
+        "cloudformation_cli_python_lib.invocation._discard_queued_records",
+        manager.discard_queued_records,
+    ):
+        resource._parse_request(ENTRYPOINT_PAYLOAD)
+
+    calls = [name for name, _, _ in manager.mock_calls]
+    assert calls == [
+        "session_factory",
+        "flusher.discard",
+        "discard_queued_records",
+        "session_factory",
+    ]
+    assert manager.session_factory.call_args_list[1][1]["identity"] == "provider"
+    manager.flusher.discard.assert_called_once_with(1.0)
+
+
+def test_entrypoint_sends_aggregates_before_swapping_account_credentials():
+    session_factory = Mock()
+    resource = Resource(
+        TYPE_NAME,
+        Mock(),
+        session_factory=session_factory,
+        metrics_aggregator=MetricsAggregator(interval=3600.0),
+    )
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+    # the process-wide provider session, with its credentials swapped in place
+    provider_sess = Mock()
+    swapped = []
+    put = provider_sess.client.return_value.put_metric_data
+    put.side_effect = lambda **kwargs: swapped.append("put")
+
+    def get_session(credentials, identity, **_):
+        if identity == "provider":
+            swapped.append(credentials.accessKeyId)
+            return provider_sess
+        return Mock()
+
+    session_factory.side_effect = get_session
+    other_account = {
+        **ENTRYPOINT_PAYLOAD,
+        "awsAccountId": "210987654321",
+        "requestData": {
+            **ENTRYPOINT_PAYLOAD["requestData"],
+            "providerCredentials": {
+                "accessKeyId": "OTHERACCOUNT",
+                "secretAccessKey": "secret",
+                "sessionToken": "token",
+            },
+        },
+    }
+
+    with patch("cloudformation_cli_python_lib.resource.ProviderLogHandler.setup"):
+        for payload in (ENTRYPOINT_PAYLOAD, ENTRYPOINT_PAYLOAD, other_account):
+            resource.__call__.__wrapped__(  # pylint: disable=no-member
+                resource, payload, None
+            )
+
+    first_key = ENTRYPOINT_PAYLOAD["requestData"]["providerCredentials"]["accessKeyId"]
+    assert swapped == [first_key, first_key, "put", "OTHERACCOUNT"]
+    metric_data = put.call_args[1]["MetricData"]
+    invocations = [
+        datum
+        for datum in metric_data
+        if datum["MetricName"] == "HandlerInvocationCount"
+    ]
+    assert invocations[0]["StatisticValues"]["SampleCount"] == 2.0
+
+
+def test_invoke_handler_profiles_handler():
+    profiler = MagicMock()
+    resource = Resource(TYPE_NAME, Mock(), profiler=profiler)
+    event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
+    resource.handler(Action.CREATE)(Mock(return_value=event))
+
+    progress = resource._invoke_handler(  # pylint: disable=protected-access
+        None, Mock(), Action.CREATE, {}
+    )
+
+    assert progress is event
+    profiler.profile.assert_called_once_with("CREATE")
+    profiler.profile.return_value.__enter__.assert_called_once()
+
+
 def test_entrypoint_success_without_caller_provider_creds():
     resource = Resource(TYPE_NAME, Mock(), Mock())
     event = ProgressEvent(status=OperationStatus.SUCCESS, message="")
@@ -253,7 +568,13 @@ def test__parse_request_valid_request_and__cast_resource_request():
         sentinel.type_configuration
     ]
 
-    resource = Resource(TYPE_NAME, mock_model, mock_type_configuration_model)
+    resource = Resource(
+        TYPE_NAME,
+        mock_model,
+        mock_type_configuration_model,
+        client_config=sentinel.client_config,
+        service_client_configs=sentinel.service_client_configs,
+    )
 
     with patch(
         "cloudformation_cli_python_lib.resource._get_boto_session"
@@ -263,9 +584,17 @@ def test__parse_request_valid_request_and__cast_resource_request():
 
     mock_session.assert_has_calls(
         [
-            call(Credentials(**ENTRYPOINT_PAYLOAD["requestData"]["callerCredentials"])),
             call(
-                Credentials(**ENTRYPOINT_PAYLOAD["requestData"]["providerCredentials"])
+                Credentials(**ENTRYPOINT_PAYLOAD["requestData"]["callerCredentials"]),
+                identity="caller",
+                client_config=sentinel.client_config,
+                service_client_configs=sentinel.service_client_configs,
+            ),
+            call(
+                Credentials(**ENTRYPOINT_PAYLOAD["requestData"]["providerCredentials"]),
+                identity="provider",
+                client_config=sentinel.client_config,
+                service_client_configs=sentinel.service_client_configs,
             ),
         ],
         any_order=True,
@@ -474,3 +803,39 @@ def test_test_entrypoint_success():
     mock_model._deserialize.assert_has_calls([call(None), call(None)])
     mock_type_configuration_model._deserialize.assert_has_calls([call(None)])
     mock_handler.assert_called_once()
+
+
+def test_test_entrypoint_session_factory():
+    mock_model = Mock(spec_set=["_deserialize"])
+    mock_session_factory = Mock()
+    resource = Resource(
+        TYPE_NAME,
+        mock_model,
+        client_config=sentinel.client_config,
+        session_factory=mock_session_factory,
+    )
+    mock_handler = resource.handler(Action.CREATE)(
+        Mock(return_value=ProgressEvent(status=OperationStatus.SUCCESS))
+    )
+
+    payload = {
+        "credentials": {"accessKeyId": "a", "secretAccessKey": "b", "sessionToken": ""},
+        "action": "CREATE",
+        "request": {"clientRequestToken": "ecba020e-b2e6-4742-a7d0-8a06ae7c4b2b"},
+        "region": "us-east-1",
+    }
+    with patch(
+        "cloudformation_cli_python_lib.resource._get_boto_session"
+    ) as mock_session:
+        resource.test_entrypoint.__wrapped__(  # pylint: disable=no-member
+            resource, payload, None
+        )
+
+    mock_session.assert_not_called()
+    mock_session_factory.assert_called_once_with(
+        Credentials("a", "b", ""),
+        region="us-east-1",
+        client_config=sentinel.client_config,
+        service_client_configs=None,
+    )
+    assert mock_handler.call_args[0][0] is mock_session_factory.return_value
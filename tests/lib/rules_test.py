@@ -0,0 +1,230 @@
+# pylint: disable=protected-access
+import pytest
+from cloudformation_cli_python_lib import Hook
+from cloudformation_cli_python_lib.interface import (
+    BaseHookHandlerRequest,
+    HandlerErrorCode,
+    HookAnnotationSeverityLevel,
+    HookAnnotationStatus,
+    HookContext,
+    HookInvocationPoint,
+    OperationStatus,
+)
+from cloudformation_cli_python_lib.rules import HookRule, RuleEngine, _RuleRun
+
+import threading
+import time
+from unittest.mock import Mock, sentinel
+
+TYPE_NAME = "Test::Foo::Bar"
+
+
+def make_request(target_name="AWS::S3::Bucket", target_model=None):
+    return BaseHookHandlerRequest(
+        clientRequestToken="token",
+        hookContext=HookContext(
+            awsAccountId="123456789012",
+            stackId="stack",
+            hookTypeName=TYPE_NAME,
+            hookTypeVersion="1.0",
+            invocationPoint=HookInvocationPoint.CREATE_PRE_PROVISION,
+            targetName=target_name,
+            targetType="RESOURCE",
+            targetLogicalId="MyBucket",
+            targetModel=target_model
+            or {
+                "resourceProperties": {
+                    "BucketName": "my-bucket",
+                    "BucketEncryption": {"ServerSideEncryptionConfiguration": []},
+                }
+            },
+        ),
+    )
+
+
+def test_rule_applies_to_target():
+    rule = HookRule("r", Mock(), target_types=("AWS::S3::*",))
+    assert rule.applies_to(make_request().hookContext)
+    assert not rule.applies_to(make_request("AWS::SQS::Queue").hookContext)
+
+    rule = HookRule("r", Mock(), target_types=("RESOURCE",))
+    assert rule.applies_to(make_request("AWS::SQS::Queue").hookContext)
+
+
+def test_rule_resolves_declared_paths():
+    rule = HookRule(
+        "r",
+        Mock(),
+        paths=(
+            "resourceProperties.BucketName",
+            "resourceProperties.BucketName.Missing",
+            "resourceProperties.Missing",
+        ),
+    )
+    assert rule.resolve(make_request().hookContext) == {
+        "resourceProperties.BucketName": "my-bucket",
+        "resourceProperties.BucketName.Missing": None,
+        "resourceProperties.Missing": None,
+    }
+
+
+def test_evaluate_rules_passed_and_failed():
+    hook = Hook(TYPE_NAME, Mock())
+    request = make_request()
+
+    @hook.rule("BucketNamed", paths=["resourceProperties.BucketName"])
+    def bucket_named(req, values, type_configuration):
+        assert req is request
+        assert type_configuration is sentinel.type_configuration
+        assert values == {"resourceProperties.BucketName": "my-bucket"}
+
+    @hook.rule(
+        "BucketVersioned",
+        target_types=["AWS::S3::Bucket"],
+        paths=["resourceProperties.VersioningConfiguration"],
+        severity=HookAnnotationSeverityLevel.HIGH,
+        remediation_message="Enable versioning",
+        remediation_link="https://example.com",
+    )
+    def bucket_versioned(_req, values, _type_configuration):
+        if not values["resourceProperties.VersioningConfiguration"]:
+            return "Versioning is not enabled"
+        return None  # pragma: no cover
+
+    @hook.rule("QueueRule", target_types=["AWS::SQS::*"])
+    def queue_rule(_req, _values, _type_configuration):  # pragma: no cover
+        raise AssertionError("should not run for buckets")
+
+    evaluation = hook.evaluate_rules(request, sentinel.type_configuration)
+
+    passed, failed = evaluation.annotations
+    assert passed.annotationName == "BucketNamed"
+    assert passed.status == HookAnnotationStatus.PASSED
+    assert passed.remediationMessage is None
+    assert failed.annotationName == "BucketVersioned"
+    assert failed.status == HookAnnotationStatus.FAILED
+    assert failed.statusMessage == "Versioning is not enabled"
+    assert failed.severityLevel == HookAnnotationSeverityLevel.HIGH
+    assert failed.remediationMessage == "Enable versioning"
+    assert failed.remediationLink == "https://example.com"
+    assert set(evaluation.timings) == {"BucketNamed", "BucketVersioned"}
+
+    progress = evaluation.to_progress_event()
+    assert progress.status == OperationStatus.FAILED
+    assert progress.errorCode == HandlerErrorCode.NonCompliant
+    assert progress.message == "1 of 2 rules failed: BucketVersioned"
+    assert progress.annotations == evaluation.annotations
+
+    response = Hook._create_progress_response(progress, None)._serialize()
+    assert [a["status"] for a in response["annotations"]] == ["PASSED", "FAILED"]
+
+
+def test_evaluate_rules_success():
+    hook = Hook(TYPE_NAME, Mock())
+    hook.rule("Ok")(Mock(return_value=None))
+
+    progress = hook.evaluate_rules(make_request(), None).to_progress_event()
+
+    assert progress.status == OperationStatus.SUCCESS
+    assert progress.annotations[0].status == HookAnnotationStatus.PASSED
+
+
+def test_evaluate_rules_no_applicable_rules():
+    hook = Hook(TYPE_NAME, Mock())
+    hook.rule("Queue", target_types=["AWS::SQS::*"])(Mock())
+
+    evaluation = hook.evaluate_rules(make_request(), None)
+
+    assert not evaluation.results
+    assert evaluation.to_progress_event().status == OperationStatus.SUCCESS
+
+
+def test_evaluate_rules_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def check(_req, _values, _type_configuration):
+        barrier.wait()
+
+    rules = [HookRule(f"rule{i}", check) for i in range(3)]
+    evaluation = RuleEngine(rules).evaluate(make_request(), None)
+
+    assert not evaluation.failed
+
+
+def test_evaluate_rules_exception():
+    rule = HookRule("Broken", Mock(side_effect=ValueError("boom")))
+
+    (annotation,) = RuleEngine([rule]).evaluate(make_request(), None).annotations
+
+    assert annotation.status == HookAnnotationStatus.FAILED
+    assert annotation.statusMessage == "Rule raised an exception: boom (ValueError)"
+
+
+def test_evaluate_rules_timeout():
+    release = threading.Event()
+
+    def slow(_req, _values, _type_configuration):
+        release.wait(5)
+
+    rules = [
+        HookRule("Slow", slow, timeout=0.05),
+        HookRule("Fast", Mock(return_value=None)),
+    ]
+    try:
+        evaluation = RuleEngine(rules).evaluate(make_request(), None)
+    finally:
+        release.set()
+
+    slow_annotation, fast_annotation = evaluation.annotations
+    assert slow_annotation.status == HookAnnotationStatus.FAILED
+    assert slow_annotation.statusMessage == "Rule timed out after 0.05 seconds"
+    assert evaluation.timings["Slow"] == pytest.approx(50.0)
+    assert fast_annotation.status == HookAnnotationStatus.PASSED
+
+
+def test_evaluate_rules_timeout_starts_when_rule_runs():
+    def check(_req, _values, _type_configuration):
+        time.sleep(0.3)
+
+    rules = [HookRule(f"r{i}", check, timeout=0.5) for i in range(4)]
+    evaluation = RuleEngine(rules, max_workers=2).evaluate(make_request(), None)
+
+    assert not evaluation.failed
+    assert all(duration < 500.0 for duration in evaluation.timings.values())
+
+
+def test_evaluate_rules_queued_behind_timed_out_rules():
+    release = threading.Event()
+    queued = Mock(return_value=None)
+
+    def hung(_req, _values, _type_configuration):
+        release.wait(5)
+
+    rules = [
+        HookRule("Hung1", hung, timeout=0.05),
+        HookRule("Hung2", hung, timeout=0.05),
+        HookRule("Queued", queued),
+    ]
+    try:
+        evaluation = RuleEngine(rules, max_workers=2).evaluate(make_request(), None)
+    finally:
+        release.set()
+
+    assert [annotation.statusMessage for annotation in evaluation.failed] == [
+        "Rule timed out after 0.05 seconds",
+        "Rule timed out after 0.05 seconds",
+        f"Rule timed out after {rules[2].timeout} seconds",
+    ]
+    queued.assert_not_called()
+
+
+def test_wait_until_started_while_workers_are_busy():
+    run = _RuleRun(HookRule("Queued", Mock(return_value=None)))
+    busy = Mock(**{"running.return_value": True})
+    timer = threading.Timer(0.15, run.started.set)
+    timer.start()
+    try:
+        assert RuleEngine._wait_until_started(run, [busy], workers=2)
+    finally:
+        timer.cancel()
+    busy.running.assert_called()
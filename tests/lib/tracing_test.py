@@ -0,0 +1,99 @@
+# pylint: disable=protected-access
+import pytest
+from cloudformation_cli_python_lib.boto3_proxy import (
+    _create_session,
+    _SwappableCredentials,
+)
+from cloudformation_cli_python_lib.tracing import (
+    ApiCall,
+    ApiCallTrace,
+    _after_call,
+    _before_call,
+    _needs_retry,
+    api_call_trace,
+    get_api_call_trace,
+)
+from cloudformation_cli_python_lib.utils import Credentials
+
+import json
+from botocore.stub import Stubber
+from unittest.mock import Mock, patch
+
+CREDENTIALS = Credentials("a", "b", "c")
+
+
+def test_traces_client_calls():
+    proxy = _create_session(CREDENTIALS, "us-east-1")
+    untraced = proxy.client("s3")
+    proxy.enable_api_call_tracing()
+    client = proxy.client("s3")
+    assert client is not untraced
+
+    with Stubber(client) as stubber, api_call_trace() as trace:
+        stubber.add_response("list_buckets", {"Buckets": []})
+        stubber.add_client_error("head_bucket", "NotFound", http_status_code=404)
+        client.list_buckets()
+        with pytest.raises(client.exceptions.ClientError):
+            client.head_bucket(Bucket="missing")
+        assert get_api_call_trace() is trace
+
+    assert [(call.operation, call.status_code) for call in trace.calls] == [
+        ("ListBuckets", 200),
+        ("HeadBucket", 404),
+    ]
+    assert all(call.service == "s3" for call in trace.calls)
+    assert trace.summary()["s3.HeadBucket"]["errors"] == 1
+    assert trace.summary()["s3.ListBuckets"]["errors"] == 0
+
+
+def test_enabling_tracing_again_keeps_clients():
+    proxy = _create_session(
+        CREDENTIALS, "us-east-1", _SwappableCredentials(CREDENTIALS)
+    )
+    proxy.enable_api_call_tracing()
+    client = proxy.client("s3")
+    proxy.enable_api_call_tracing()
+    assert proxy.client("s3") is client
+
+
+def test_calls_outside_a_trace_are_not_recorded():
+    proxy = _create_session(CREDENTIALS, "us-east-1")
+    proxy.enable_api_call_tracing()
+    client = proxy.client("s3")
+    with Stubber(client) as stubber:
+        stubber.add_response("list_buckets", {"Buckets": []})
+        client.list_buckets()
+    assert not get_api_call_trace().calls
+
+
+def test_retries_and_duration():
+    model = Mock()
+    model.service_model.service_name = "ec2"
+    model.name = "DescribeVpcs"
+    context = {}
+    with patch(
+        "cloudformation_cli_python_lib.tracing.time.perf_counter",
+        side_effect=[1.0, 1.25],
+    ), api_call_trace() as trace:
+        _before_call(context=context)
+        for attempts in (1, 2, 3):
+            _needs_retry(attempts=attempts, request_dict={"context": context})
+        _after_call(http_response=Mock(status_code=200), model=model, context=context)
+
+    assert trace.calls == [ApiCall("ec2", "DescribeVpcs", 250.0, 2, 200)]
+    assert (trace.duration_ms, trace.retries) == (250.0, 2)
+
+
+def test_log_summary(caplog):
+    trace = ApiCallTrace()
+    trace.log_summary()
+    assert not caplog.records
+
+    trace.record(ApiCall("ec2", "DescribeVpcs", 10.0, 0, 200))
+    trace.record(ApiCall("ec2", "DescribeVpcs", 30.0, 1, None))
+    with caplog.at_level("INFO"):
+        trace.log_summary()
+    summary = json.loads(caplog.records[0].args[0])
+    assert summary == {
+        "ec2.DescribeVpcs": {"count": 2, "durationMs": 40.0, "retries": 1, "errors": 1}
+    }